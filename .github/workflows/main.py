@@ -1,20 +1,50 @@
+import os
 import csv
+import sys
+import json
+import time
+import argparse
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 SHOW_FILTER = None
 CHANNEL_FILTER = None
 
+SEARCH_URL = "https://archive.org/advancedsearch.php"
+CHUNK_SIZE = 250
 
-def load_csv(filename, show_filter=None, channel_filter=None) -> list:
-    data = []
-    with open(filename, "r") as file:
+# descriptions in the full export are longer than csv's default field limit
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+
+def iter_csv(filename, show_filter=None, channel_filter=None):
+    """
+    Yields the rows that pass the filters, one at a time, with only the
+    columns the validator needs, so a big export (with descriptions) is
+    never held in memory.
+    """
+
+    with open(filename, "r", newline="") as file:
         reader = csv.DictReader(file)
         for row in reader:
             if (show_filter is None or row["series"] == show_filter) and (
                 channel_filter is None or row["channel"] == channel_filter
             ):
-                data.append(row)
-    return data
+                yield {"link": row["link"], "archive_id": row["archive_id"]}
+
+
+def iter_chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def format_filename(show_filter, channel_filter) -> str:
@@ -40,48 +70,232 @@ def format_start_msg(show_filter, channel_filter) -> str:
     return msg
 
 
-def process_chunk(chunk):
-    archive_ids = [row["archive_id"] for row in chunk]
-    or_conditions = "+OR+".join(id for id in archive_ids)
-    url = f"https://archive.org/advancedsearch.php?q=identifier:({or_conditions})&fl[]=identifier&sort[]=&sort[]=&sort[]=&rows=300&page=1&output=json&save=yes"
-    response = requests.get(url)
-    if response.status_code == 200:
-        result = response.json()
-        found_ids = [doc["identifier"] for doc in result["response"]["docs"]]
-        missing_ids = [id for id in archive_ids if id not in found_ids]
-        return missing_ids
-    else:
-        return []
-
-
-def main(filename):
-    data = load_csv(filename, show_filter=SHOW_FILTER, channel_filter=CHANNEL_FILTER)
-    print(format_start_msg(show_filter=SHOW_FILTER, channel_filter=CHANNEL_FILTER))
-    missing_links = []
-    chunk_size = 250
-    total_chunks = len(data) // chunk_size + (1 if len(data) % chunk_size != 0 else 0)
-    for i in range(0, len(data), chunk_size):
-        chunk = data[i : i + chunk_size]
-        chunk_number = i // chunk_size + 1
-        missing_ids = process_chunk(chunk)
-        missing_links.extend(
-            [row["link"] for row in chunk if row["archive_id"] in missing_ids]
+class RateLimiter:
+    """At most `rate` requests per second over all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def make_session(jobs):
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_maxsize=jobs,
+            max_retries=Retry(
+                total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504]
+            ),
+        ),
+    )
+    return session
+
+
+def search_identifiers(session, limiter, archive_ids):
+    """
+    Returns the set of archive_ids that exist. Pages through the results
+    until every hit reported by numFound was read, so a short page can't
+    turn found items into false "missing" ones. Raises on any failure.
+    """
+
+    query = f"identifier:({' OR '.join(archive_ids)})"
+    rows = len(archive_ids)
+    found = set()
+    page = 1
+    while True:
+        limiter.wait()
+        response = session.get(
+            SEARCH_URL,
+            params={
+                "q": query,
+                "fl[]": "identifier",
+                "rows": rows,
+                "page": page,
+                "output": "json",
+            },
+            timeout=60,
+        )
+        response.raise_for_status()
+        result = response.json()["response"]
+        docs = result["docs"]
+        found.update(doc["identifier"] for doc in docs)
+        if len(found) >= result["numFound"] or not docs:
+            break
+        page += 1
+    if len(found) < result["numFound"]:
+        raise ValueError(
+            f"incomplete result: {len(found)} of {result['numFound']} identifiers read"
         )
+    return found
 
-    total_links = len(data)  # Subtract header row
-    present_links = total_links - len(missing_links)
+
+def process_chunk(session, limiter, chunk):
+    archive_ids = [row["archive_id"] for row in chunk]
+    found_ids = search_identifiers(session, limiter, archive_ids)
+    return [row["link"] for row in chunk if row["archive_id"] not in found_ids]
+
+
+class Checkpoint:
+    """
+    Progress of a validation run: which chunks are done, and how long the
+    output file was when the last of them was recorded. Missing links of a
+    chunk are written to the output file before the chunk is recorded
+    here; a resumed run cuts the file back to the recorded length, so links
+    of a chunk that was written but not recorded aren't there twice. Only
+    used again for the same csv (same size and mtime), filters and chunk
+    size.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.done = set()
+        self.output_size = 0
+        self.resumed = False
+        if path and os.path.exists(path):
+            with open(path, "r") as file:
+                saved = json.load(file)
+            if saved.get("key") == key:
+                self.done = set(saved["done"])
+                self.output_size = saved.get("output_size", 0)
+                self.resumed = True
+                print(f"Resuming from checkpoint, {len(self.done)} chunks already checked")
+
+    def record(self, index, output_size):
+        self.done.add(index)
+        self.output_size = output_size
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(
+                {"key": self.key, "done": sorted(self.done), "output_size": output_size},
+                file,
+            )
+        os.replace(tmp_path, self.path)
+
+
+def main(
+    filename,
+    output_filename,
+    show_filter=SHOW_FILTER,
+    channel_filter=CHANNEL_FILTER,
+    jobs=4,
+    rate=2.0,
+    checkpoint_path=None,
+):
+    print(format_start_msg(show_filter=show_filter, channel_filter=channel_filter))
+    stat = os.stat(filename)
+    checkpoint = Checkpoint(
+        checkpoint_path,
+        [
+            filename,
+            stat.st_size,
+            stat.st_mtime,
+            output_filename,
+            show_filter,
+            channel_filter,
+            CHUNK_SIZE,
+        ],
+    )
+    session = make_session(jobs)
+    limiter = RateLimiter(rate)
+    counts = {"total": 0, "missing": 0, "unchecked": 0}
+    failed_chunks = 0
+
+    def finish(future, index, size, output):
+        nonlocal failed_chunks
+        try:
+            missing_links = future.result()
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # not checked is not missing, leave it for the next run
+            print(f"Chunk {index + 1} could not be checked: {e}")
+            counts["unchecked"] += size
+            failed_chunks += 1
+            return
+        for link in missing_links:
+            output.write(link + "\n")
+        output.flush()
+        os.fsync(output.fileno())
+        counts["missing"] += len(missing_links)
+        checkpoint.record(index, output.tell())
+
+    mode = "a" if checkpoint.resumed else "w"
+    if checkpoint.resumed and os.path.exists(output_filename):
+        # drop what was written after the last recorded chunk
+        if os.path.getsize(output_filename) > checkpoint.output_size:
+            os.truncate(output_filename, checkpoint.output_size)
+    with open(output_filename, mode) as output, ThreadPoolExecutor(
+        max_workers=jobs
+    ) as executor:
+        pending = {}
+        rows = iter_csv(filename, show_filter=show_filter, channel_filter=channel_filter)
+        for index, chunk in enumerate(iter_chunks(rows)):
+            counts["total"] += len(chunk)
+            if index in checkpoint.done:
+                continue
+            # only a few chunks in flight, the rest of the csv isn't read yet
+            while len(pending) >= jobs * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future, *pending.pop(future), output)
+            future = executor.submit(process_chunk, session, limiter, chunk)
+            pending[future] = (index, len(chunk))
+        for future in list(pending):
+            wait([future])
+            finish(future, *pending.pop(future), output)
+
+    if checkpoint.resumed:
+        # earlier runs wrote part of the file
+        with open(output_filename, "r") as output:
+            counts["missing"] = sum(1 for line in output if line.strip())
+    total_links = counts["total"]
+    present_links = total_links - counts["missing"] - counts["unchecked"]
     print(f"\nTotal links: {total_links}")
     print(f"Links present in Archive.org: {present_links}")
-    print(f"Missing links: {len(missing_links)}")
+    print(f"Missing links: {counts['missing']}")
+    if failed_chunks:
+        print(
+            f"Not checked: {counts['unchecked']} links in {failed_chunks} chunks, run again to resume"
+        )
+    elif checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
 
-    return missing_links
+    return counts
 
 
 if __name__ == "__main__":
-    csv_filename = "episodes_info_some.csv"
-    missing_links = main(csv_filename)
+    parser = argparse.ArgumentParser(description="Find episodes missing on archive.org")
+    parser.add_argument("csv", nargs="?", default="episodes_info_some.csv")
+    parser.add_argument("--show", default=SHOW_FILTER, help="Only check this series")
+    parser.add_argument("--channel", default=CHANNEL_FILTER, help="Only check this channel")
+    parser.add_argument("--jobs", default=4, type=int, help="Searches at once (default 4)")
+    parser.add_argument(
+        "--rate", default=2.0, type=float, help="Most searches per second (default 2)"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="validate_checkpoint.json",
+        help="Progress file used to resume an interrupted run",
+    )
+    args = parser.parse_args()
 
-    filename = format_filename(show_filter=SHOW_FILTER, channel_filter=CHANNEL_FILTER)
-    with open(f"{filename}", "w") as file:
-        for link in missing_links:
-            file.write(link + "\n")
+    main(
+        args.csv,
+        format_filename(show_filter=args.show, channel_filter=args.channel),
+        show_filter=args.show,
+        channel_filter=args.channel,
+        jobs=max(1, args.jobs),
+        rate=args.rate,
+        checkpoint_path=args.checkpoint,
+    )
@@ -0,0 +1,253 @@
+import re
+import sys
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+
+from .state import get_state_store
+
+# what yt-dlp prints when a server pushes back or a fragment has to be retried
+THROTTLED = re.compile(r"HTTP Error (429|5\d\d)")
+RETRIED = re.compile(r"Retrying( fragment| \()")
+
+# downloads shorter than this say nothing about the throughput
+MIN_SAMPLE_SECONDS = 5
+# a few retried fragments are normal, more than this share of them is pushback
+MAX_RETRY_RATE = 0.05
+
+
+def get_cdn_host(info_dict):
+    """
+    Host the video of an (unprocessed or processed) info dict comes from,
+    None if the info dict has no format urls.
+    """
+
+    if not info_dict:
+        return None
+    formats = info_dict.get("requested_formats")
+    if not formats:
+        # the best format comes last, that's what yt-dlp picks by default
+        formats = [info_dict] if info_dict.get("url") else info_dict.get("formats", [])[-1:]
+    if not formats:
+        return None
+    return urlparse(formats[0].get("url") or "").hostname
+
+
+class HostState:
+    def __init__(self, concurrency, best=None, best_rate=0.0):
+        self.concurrency = concurrency
+        self.best = best or concurrency
+        self.best_rate = best_rate
+        self.last_rate = None
+        # bytes received from this host by every download, for the aggregate rate
+        self.received = 0
+        self.holds = 0
+
+
+class DownloadProbe:
+    """
+    Feedback of one yt-dlp download: bytes come in through the progress
+    hook, retries and 429/5xx answers through the logger.
+    """
+
+    def __init__(self, controller, host, concurrency, received):
+        self.controller = controller
+        self.host = host
+        self.concurrency = concurrency
+        self.started = time.monotonic()
+        self.received_at_start = received
+        self.errors = 0
+        self.failed = False
+        self._seen = {}
+        # fragments per file, a file without fragments counts as one
+        self._fragments = {}
+        self._progress_line = False
+
+    def apply(self, video_options):
+        video_options["concurrent_fragment_downloads"] = self.concurrency
+        video_options.setdefault("progress_hooks", []).append(self.hook)
+        video_options["logger"] = self
+
+    @property
+    def fragments(self):
+        return sum(self._fragments.values()) or 1
+
+    @property
+    def retry_rate(self):
+        """Retries and 429/5xx answers per fragment downloaded."""
+
+        return self.errors / self.fragments
+
+    def hook(self, status):
+        key = status.get("tmpfilename") or status.get("filename")
+        count = status.get("fragment_count") or status.get("fragment_index") or 1
+        self._fragments[key] = max(self._fragments.get(key, 1), count)
+        downloaded = status.get("downloaded_bytes")
+        if downloaded is None:
+            return
+        delta = downloaded - self._seen.get(key, 0)
+        self._seen[key] = downloaded
+        if delta > 0:
+            self.controller.add_received(self.host, delta)
+
+    def _check(self, message):
+        if THROTTLED.search(message) or RETRIED.search(message):
+            self.errors += 1
+
+    # yt-dlp logger interface, printing what yt-dlp would print itself
+
+    def debug(self, message):
+        self._check(message)
+        if message.startswith("[debug] "):
+            return
+        if message.startswith("[download]") and "%" in message and "ETA" in message:
+            sys.stdout.write(f"\r{message}")
+            sys.stdout.flush()
+            self._progress_line = True
+            return
+        if self._progress_line:
+            sys.stdout.write("\n")
+            self._progress_line = False
+        print(message)
+
+    info = debug
+
+    def warning(self, message):
+        self._check(message)
+        print(f"WARNING: {message}", file=sys.stderr)
+
+    def error(self, message):
+        self._check(message)
+        print(message, file=sys.stderr)
+
+    def finish(self, failed=False):
+        self.failed = failed
+        if self._progress_line:
+            sys.stdout.write("\n")
+            self._progress_line = False
+        self.controller.record(self)
+
+
+class FragmentController:
+    """
+    AIMD for yt-dlp's concurrent_fragment_downloads, per CDN host. A
+    download's setting is fixed once it starts, so every finished download
+    is one step: while the aggregate throughput from the host (all workers
+    together) keeps improving the next downloads get `step` more
+    fragments, a failed download or one where more than MAX_RETRY_RATE of
+    the fragments needed a retry (or got a 429 / 5xx) halves it, and when a
+    step up didn't pay off it goes back to the best setting seen, trying
+    higher again every few downloads. The best setting per host is kept
+    in the state store and is where the next run starts.
+    """
+
+    PROBE_EVERY = 5
+
+    def __init__(self, initial=10, minimum=1, maximum=32, step=2, store=None):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.step = step
+        self.store = store or get_state_store()
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            saved = None
+            try:
+                saved = self.store.get_fragment_tuning(host)
+            except Exception as err:
+                logging.warning(f"Fragments: could not read the saved setting of {host} - {err}")
+            if saved:
+                concurrency = min(self.maximum, max(self.minimum, saved[0]))
+                state = HostState(concurrency, concurrency, saved[1])
+                logging.info(f"Fragments: {host} starts at the saved {concurrency}")
+            else:
+                state = HostState(min(self.maximum, max(self.minimum, self.initial)))
+            self._hosts[host] = state
+        return state
+
+    def probe(self, host) -> DownloadProbe:
+        with self._lock:
+            state = self._state(host)
+            return DownloadProbe(self, host, state.concurrency, state.received)
+
+    def add_received(self, host, size):
+        with self._lock:
+            self._state(host).received += size
+
+    def _save(self, host, state):
+        try:
+            self.store.save_fragment_tuning(host, state.best, state.best_rate)
+        except Exception as err:
+            logging.warning(f"Fragments: could not save the setting of {host} - {err}")
+
+    def record(self, probe):
+        elapsed = time.monotonic() - probe.started
+        with self._lock:
+            state = self._state(probe.host)
+            before = state.concurrency
+            if probe.failed or probe.retry_rate > MAX_RETRY_RATE:
+                # multiplicative decrease, from what this download used
+                state.concurrency = max(self.minimum, probe.concurrency // 2)
+                state.last_rate = None
+                state.holds = 0
+                if probe.concurrency <= state.best:
+                    state.best = state.concurrency
+                    self._save(probe.host, state)
+                reason = (
+                    "failed"
+                    if probe.failed
+                    else f"{probe.errors} retries/errors in {probe.fragments} fragments"
+                )
+            else:
+                received = state.received - probe.received_at_start
+                if elapsed < MIN_SAMPLE_SECONDS or received <= 0:
+                    return
+                rate = received / elapsed
+                if probe.concurrency == state.best or rate > state.best_rate:
+                    state.best, state.best_rate = probe.concurrency, rate
+                    self._save(probe.host, state)
+                if state.last_rate is None or rate > state.last_rate * 1.05:
+                    state.concurrency = min(self.maximum, probe.concurrency + self.step)
+                    state.holds = 0
+                else:
+                    state.holds += 1
+                    state.concurrency = state.best
+                    if state.holds >= self.PROBE_EVERY:
+                        state.concurrency = min(self.maximum, state.best + self.step)
+                        state.holds = 0
+                state.last_rate = rate
+                reason = f"{rate / 1024 / 1024:.1f} MB/s"
+        if state.concurrency != before:
+            logging.info(
+                f"Fragments: {probe.host} {before} -> {state.concurrency} ({reason}, best {state.best})"
+            )
+
+
+_controller = None
+_controller_lock = threading.Lock()
+_settings = {"enabled": False, "initial": 10, "maximum": 32}
+
+
+def configure_adaptive_fragments(enabled=False, initial=10, maximum=32):
+    _settings["enabled"] = enabled
+    _settings["initial"] = max(1, initial)
+    _settings["maximum"] = max(1, maximum)
+
+
+def use_adaptive_fragments() -> bool:
+    return _settings["enabled"]
+
+
+def get_fragment_controller() -> FragmentController:
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = FragmentController(
+                initial=_settings["initial"], maximum=_settings["maximum"]
+            )
+        return _controller
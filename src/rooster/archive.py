@@ -0,0 +1,54 @@
+import logging
+import sqlite3
+import threading
+
+from .state import get_state_store
+
+
+class ArchiveIndex:
+    """
+    The yt-dlp download archive ("roosterteeth 12345" entries), kept in the
+    state store instead of logs/archive.log so lookups are indexed and
+    several processes can add to it safely.
+
+    It can be passed to yt-dlp as the `download_archive` option: yt-dlp only
+    needs `in` and `add()` from it, and stops reloading a file for every
+    YoutubeDL instance.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or get_state_store()
+
+    def has_id(self, episode_id):
+        return self.store.archive_has_id(episode_id)
+
+    def __contains__(self, entry):
+        return self.store.archive_contains(entry)
+
+    def __len__(self):
+        return self.store.archive_size()
+
+    def __bool__(self):
+        # yt-dlp skips the archive check entirely on an empty archive, no
+        # need to count rows for that
+        return True
+
+    def add(self, entry):
+        """Called by yt-dlp after a finished download."""
+
+        try:
+            self.store.archive_add(entry)
+        except sqlite3.Error as ex:
+            logging.critical(f"Archive: could not save {entry} - {ex}")
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_archive_index() -> ArchiveIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ArchiveIndex()
+        return _index
@@ -0,0 +1,394 @@
+import os
+import time
+import shutil
+import atexit
+import socket
+import logging
+import secrets
+import threading
+import tempfile
+import subprocess
+from pathlib import Path
+
+from requests.exceptions import RequestException
+
+from .bandwidth import get_bandwidth_limiter
+from .client import get_http_client
+from .hls import HlsError, UnsupportedPlaylist, parse_media_playlist, remux
+
+MB = 1024 * 1024
+
+
+class AriaError(HlsError):
+    pass
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _is_fault(result):
+    return isinstance(result, dict) and "faultCode" in result
+
+
+class AriaDaemon:
+    """
+    One aria2c for the whole run, driven over JSON-RPC, instead of a new
+    aria2c process per download. Every worker submits its fragments or
+    files to the same daemon, so connections stay warm across episodes and
+    `max_downloads` and `speed_limit` hold for all of them together.
+    Each caller keeps at most `window` jobs queued and polls their status.
+    The daemon goes away with the run (shutdown_aria_daemon at the end of
+    main, atexit, and --stop-with-process if python dies without cleaning
+    up).
+    """
+
+    name = "aria2c"
+
+    def __init__(
+        self,
+        max_downloads=16,
+        connections_per_server=16,
+        speed_limit="0",
+        max_tries=10,
+        window=64,
+        poll_interval=0.5,
+    ):
+        self.max_downloads = max_downloads
+        self.connections_per_server = connections_per_server
+        self.speed_limit = speed_limit
+        self.max_tries = max_tries
+        self.window = window
+        self.poll_interval = poll_interval
+        self._secret = secrets.token_hex(16)
+        self._port = None
+        self._process = None
+        self._atexit_registered = False
+        self._applied_limit = None
+        self._lock = threading.Lock()
+        self.http = get_http_client()
+
+    @property
+    def rpc_url(self):
+        return f"http://127.0.0.1:{self._port}/jsonrpc"
+
+    def start(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return
+            if shutil.which("aria2c") is None:
+                raise AriaError("aria2c is not installed")
+            self._port = _free_port()
+            # the secret goes in a file only we can read, on the command line
+            # every user on the machine would see it in the process list
+            fd, conf_path = tempfile.mkstemp(prefix="rooster-aria2-", suffix=".conf")
+            with os.fdopen(fd, "w") as f:
+                f.write(f"rpc-secret={self._secret}\n")
+            command = [
+                "aria2c",
+                f"--conf-path={conf_path}",
+                "--enable-rpc",
+                "--rpc-listen-all=false",
+                f"--rpc-listen-port={self._port}",
+                f"--stop-with-process={os.getpid()}",
+                f"--max-concurrent-downloads={self.max_downloads}",
+                f"--max-connection-per-server={self.connections_per_server}",
+                f"--split={self.connections_per_server}",
+                "--min-split-size=1M",
+                f"--max-overall-download-limit={self.speed_limit}",
+                f"--max-tries={self.max_tries}",
+                "--retry-wait=2",
+                "--auto-file-renaming=false",
+                "--allow-overwrite=true",
+                "--file-allocation=none",
+                "--console-log-level=warn",
+                "--summary-interval=0",
+            ]
+            try:
+                self._process = subprocess.Popen(
+                    command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+
+                # workers wait here until the RPC answers
+                deadline = time.monotonic() + 10
+                while True:
+                    try:
+                        version = self.call("aria2.getVersion")
+                        break
+                    except AriaError:
+                        if self._process.poll() is not None or time.monotonic() > deadline:
+                            # don't leave a half-started aria2c for the next start()
+                            self._process.kill()
+                            self._process.wait()
+                            self._process = None
+                            raise AriaError("aria2c RPC did not come up")
+                        time.sleep(0.1)
+            finally:
+                # aria2c reads its conf file once, at startup
+                os.unlink(conf_path)
+            if not self._atexit_registered:
+                # start() runs again after a crash, one handler is enough
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+        print(f"aria2c {version['version']} daemon started, RPC on port {self._port}")
+        logging.info(f"aria2c daemon {version['version']} on port {self._port}")
+
+    def call(self, method, *params):
+        if method != "system.multicall":
+            # multicall carries the token in each of its calls instead
+            params = (f"token:{self._secret}", *params)
+        payload = {"jsonrpc": "2.0", "id": "rooster", "method": method, "params": params}
+        try:
+            response = self.http.post(self.rpc_url, json=payload, timeout=(5, 30))
+            answer = response.json()
+        except (RequestException, ValueError) as err:
+            raise AriaError(f"aria2c RPC {method} failed: {err}")
+        if "error" in answer:
+            raise AriaError(f"aria2c RPC {method}: {answer['error'].get('message')}")
+        return answer["result"]
+
+    def multicall(self, calls):
+        """Runs (method, *params) calls in one request, returns their results."""
+
+        results = self._multicall(calls)
+        for result in results:
+            if _is_fault(result):
+                raise AriaError(f"aria2c RPC: {result.get('faultString')}")
+        return [result[0] for result in results]
+
+    def _multicall(self, calls):
+        # one entry per call: [result], or a fault dict for a call that failed
+        if not calls:
+            return []
+        return self.call(
+            "system.multicall",
+            [
+                {
+                    "methodName": method,
+                    "params": [f"token:{self._secret}", *params],
+                }
+                for method, *params in calls
+            ],
+        )
+
+    def _options(self, path, headers):
+        path = Path(path)
+        options = {"dir": str(path.parent.resolve()), "out": path.name}
+        if headers:
+            options["header"] = [f"{key}: {value}" for key, value in headers.items()]
+        return options
+
+    def download_files(self, jobs):
+        """
+        Downloads (url, path, headers) jobs through the daemon, at most
+        `window` queued at a time, and returns their sizes. The first job
+        that fails raises, and the rest of this call's jobs are removed.
+        """
+
+        self.start()
+        limiter = get_bandwidth_limiter()
+        jobs = list(jobs)
+        sizes = [0] * len(jobs)
+        pending = {}
+        # completedLength of each gid at the last poll
+        received = {}
+        next_job = 0
+        try:
+            while next_job < len(jobs) or pending:
+                # a batch can run into the next time window
+                self._follow_bandwidth_schedule()
+                if next_job < len(jobs) and len(pending) < self.window:
+                    batch = jobs[next_job : next_job + self.window - len(pending)]
+                    results = self._multicall(
+                        [
+                            ("aria2.addUri", [url], self._options(path, headers))
+                            for url, path, headers in batch
+                        ]
+                    )
+                    # the ones that were added go into pending before raising
+                    # for a fault, so they get removed as well
+                    fault = None
+                    for result in results:
+                        if _is_fault(result):
+                            fault = fault or result
+                        else:
+                            pending[result[0]] = next_job
+                        next_job += 1
+                    if fault is not None:
+                        raise AriaError(f"aria2c RPC: {fault.get('faultString')}")
+
+                gids = list(pending)
+                statuses = self.multicall(
+                    [
+                        (
+                            "aria2.tellStatus",
+                            gid,
+                            ["status", "completedLength", "errorMessage"],
+                        )
+                        for gid in gids
+                    ]
+                )
+                finished = []
+                for gid, status in zip(gids, statuses):
+                    completed = int(status["completedLength"])
+                    if limiter.limits_ingress:
+                        # only charged, the daemon limits itself
+                        limiter.ingress.reserve(completed - received.get(gid, 0))
+                    received[gid] = completed
+                    if status["status"] == "complete":
+                        sizes[pending.pop(gid)] = completed
+                        received.pop(gid)
+                        finished.append(gid)
+                    elif status["status"] in ("error", "removed"):
+                        url = jobs[pending.pop(gid)][0]
+                        raise AriaError(
+                            f"{url}: {status.get('errorMessage') or status['status']}"
+                        )
+                self.multicall([("aria2.removeDownloadResult", gid) for gid in finished])
+                if pending and not finished:
+                    time.sleep(self.poll_interval)
+        except BaseException:
+            for gid in pending:
+                try:
+                    self.call("aria2.forceRemove", gid)
+                except AriaError:
+                    pass
+            raise
+        return sizes
+
+    def _follow_bandwidth_schedule(self):
+        # without its own --aria-speed-limit the daemon gets the current
+        # ingress ceiling, which can change with the time of day. What it
+        # receives is charged to the ingress bucket in download_files, so
+        # the other downloads of the run slow down to make room for it
+        limiter = get_bandwidth_limiter()
+        if self.speed_limit not in ("0", 0, None) or not limiter.limits_ingress:
+            return
+        limit = str(int(limiter.ingress.schedule.rate()))
+        if limit != self._applied_limit:
+            self.call("aria2.changeGlobalOption", {"max-overall-download-limit": limit})
+            self._applied_limit = limit
+
+    def download_hls(self, url, part, headers):
+        """Downloads the fragments of a media playlist and joins them into `part`."""
+
+        part = Path(part)
+        response = self.http.get(url, headers=headers)
+        response.raise_for_status()
+        init, fragments = parse_media_playlist(response.text, response.url)
+        ordered = ([init] if init else []) + fragments
+        if any(fragment.byterange is not None for fragment in ordered):
+            raise UnsupportedPlaylist("byte range playlist")
+
+        fragment_dir = part.with_name(f"{part.name}.fragments")
+        fragment_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            paths = [fragment_dir / f"{index:06d}.frag" for index in range(len(ordered))]
+            self.download_files(
+                (fragment.url, path, headers) for fragment, path in zip(ordered, paths)
+            )
+            with open(part, "wb") as output:
+                for path in paths:
+                    with open(path, "rb") as f:
+                        shutil.copyfileobj(f, output, 8 * MB)
+                    path.unlink()
+        finally:
+            shutil.rmtree(fragment_dir, ignore_errors=True)
+        return len(ordered)
+
+    def download_formats(self, formats, path, cookiejar=None):
+        """
+        Downloads the formats yt-dlp selected: HLS fragment by fragment,
+        plain http(s) files in `connections_per_server` pieces. The result
+        is remuxed with ffmpeg into `path` unless it's a single plain file.
+        """
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        parts = []
+        try:
+            for format in formats:
+                protocol = format.get("protocol")
+                if protocol not in ("m3u8", "m3u8_native", "http", "https"):
+                    raise UnsupportedPlaylist(f"{protocol} format")
+                headers = dict(format.get("http_headers") or {})
+                if cookiejar is not None:
+                    cookie = cookiejar.get_cookie_header(format["url"])
+                    if cookie:
+                        headers["Cookie"] = cookie
+                part = path.with_name(f"{path.stem}.f{format['format_id']}.aria.part")
+                parts.append(part)
+
+                start = time.monotonic()
+                if protocol.startswith("m3u8"):
+                    files = self.download_hls(format["url"], part, headers)
+                else:
+                    files = len(self.download_files([(format["url"], part, headers)]))
+                elapsed = time.monotonic() - start
+                size = part.stat().st_size / MB
+                summary = f"{part.name}: {files} files, {size:.1f} MB in {elapsed:.1f}s ({size / max(elapsed, 0.001):.1f} MB/s)"
+                print(f"[{self.name}] {summary}")
+                logging.info(f"{self.name}: {summary}")
+
+            if len(formats) == 1 and not formats[0]["protocol"].startswith("m3u8"):
+                os.replace(parts[0], path)
+            else:
+                remux(parts, path)
+        finally:
+            for part in parts:
+                part.unlink(missing_ok=True)
+
+    def shutdown(self):
+        with self._lock:
+            process, self._process = self._process, None
+        if process is None or process.poll() is not None:
+            return
+        try:
+            self.call("aria2.shutdown")
+            process.wait(timeout=10)
+        except (AriaError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        logging.info("aria2c daemon stopped")
+
+
+_daemon = None
+_daemon_lock = threading.Lock()
+_settings = {
+    "enabled": False,
+    "max_downloads": 16,
+    "speed_limit": "0",
+    "max_tries": 10,
+}
+
+
+def configure_aria(enabled=False, max_downloads=16, speed_limit=None, max_tries=10):
+    _settings["enabled"] = enabled
+    _settings["max_downloads"] = max(1, max_downloads)
+    _settings["speed_limit"] = speed_limit or "0"
+    _settings["max_tries"] = max(1, max_tries)
+
+
+def use_aria_daemon() -> bool:
+    return _settings["enabled"]
+
+
+def get_aria_daemon() -> AriaDaemon:
+    global _daemon
+    with _daemon_lock:
+        if _daemon is None:
+            _daemon = AriaDaemon(
+                max_downloads=_settings["max_downloads"],
+                speed_limit=_settings["speed_limit"],
+                max_tries=_settings["max_tries"],
+            )
+        return _daemon
+
+
+def shutdown_aria_daemon():
+    with _daemon_lock:
+        daemon = _daemon
+    if daemon is not None:
+        daemon.shutdown()
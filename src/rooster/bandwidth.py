@@ -0,0 +1,218 @@
+import io
+import re
+import time
+import logging
+import threading
+from datetime import datetime
+
+UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+BIT_UNITS = {"": 1, "K": 1000, "M": 1000**2, "G": 1000**3}
+RATE = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMG]?)(bit|bps)?$", re.IGNORECASE)
+WINDOW = re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(.+)$")
+
+
+def parse_rate(value) -> float:
+    """
+    Bytes per second of "50M" (MiB/s, like yt-dlp's --limit-rate) or
+    "400Mbit" (megabits per second). 0 means unlimited.
+    """
+
+    match = RATE.match(value.strip())
+    if not match:
+        raise ValueError(f"invalid rate: {value!r}")
+    number, unit, bits = match.groups()
+    if bits:
+        return float(number) * BIT_UNITS[unit.upper()] / 8
+    return float(number) * UNITS[unit.upper()]
+
+
+class Schedule:
+    """
+    A rate that depends on the time of day, from a spec like
+    "80M,09:00-18:00=30M,01:00-06:00=0": the first entry without a time
+    window is the default, windows are local time and may wrap around
+    midnight, and the first matching window wins.
+    """
+
+    def __init__(self, spec=None):
+        self.default = 0.0
+        self.windows = []
+        for entry in (spec or "").split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            window = WINDOW.match(entry)
+            if window:
+                start_h, start_m, end_h, end_m, rate = window.groups()
+                self.windows.append(
+                    (
+                        int(start_h) * 60 + int(start_m),
+                        int(end_h) * 60 + int(end_m),
+                        parse_rate(rate),
+                    )
+                )
+            else:
+                self.default = parse_rate(entry)
+
+    def __bool__(self):
+        return bool(self.default or any(rate for _, _, rate in self.windows))
+
+    def rate(self, now=None) -> float:
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.windows:
+            if start <= end:
+                if start <= minute < end:
+                    return rate
+            elif minute >= start or minute < end:
+                return rate
+        return self.default
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every thread going one way. Each caller reserves
+    its bytes in arrival order (GCRA: the next reservation starts where the
+    last one ended), then sleeps until they're covered, so small chunks
+    from many downloads interleave fairly instead of one taking the whole
+    budget. At most `burst` seconds of unused rate can be saved up, which
+    keeps even short peaks at the ceiling.
+    """
+
+    def __init__(self, schedule, burst=1.0):
+        self.schedule = schedule
+        self.burst = burst
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def reserve(self, size) -> float:
+        """Takes `size` bytes, returns how long the caller has to wait for them."""
+
+        rate = self.schedule.rate()
+        if not rate or size <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + size / rate
+            wait = self._next - now - self.burst
+        return max(0.0, wait)
+
+    def consume(self, size):
+        wait = self.reserve(size)
+        if wait:
+            self.waited += wait
+            time.sleep(wait)
+
+
+class ThrottledFile(io.FileIO):
+    """File opened for reading whose reads go through a token bucket."""
+
+    def __init__(self, path, bucket):
+        super().__init__(path, "rb")
+        self._bucket = bucket
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self._bucket.consume(len(data))
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self._bucket.consume(count or 0)
+        return count
+
+
+class DownloadHook:
+    """
+    yt-dlp progress hook that charges the bytes of one download to the
+    ingress bucket. yt-dlp calls it from the thread that received them
+    (every fragment thread, too), so waiting here slows that download.
+    With wait=False the bytes are only charged: an external aria2c isn't
+    slowed by waiting here, it gets its own limit, and the rest of the run
+    leaves room for what it received.
+    """
+
+    def __init__(self, bucket, wait=True):
+        self._bucket = bucket
+        self._wait = wait
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, status):
+        downloaded = status.get("downloaded_bytes")
+        if downloaded is None:
+            return
+        key = status.get("tmpfilename") or status.get("filename")
+        with self._lock:
+            delta = downloaded - self._seen.get(key, 0)
+            if delta <= 0:
+                return
+            self._seen[key] = downloaded
+        if self._wait:
+            self._bucket.consume(delta)
+        else:
+            self._bucket.reserve(delta)
+
+
+class BandwidthLimiter:
+    """
+    The bandwidth budget of the whole run: one bucket for everything that
+    comes in (yt-dlp downloads, the native HLS engine, thumbnails) and one
+    for everything that goes out (IA uploads). `download_jobs` is how many
+    episodes download at once, each external aria2c gets that share.
+    """
+
+    def __init__(self, ingress=None, egress=None, download_jobs=1):
+        self.ingress = TokenBucket(ingress or Schedule())
+        self.egress = TokenBucket(egress or Schedule())
+        self.download_jobs = max(1, download_jobs)
+
+    @property
+    def limits_ingress(self):
+        return bool(self.ingress.schedule)
+
+    @property
+    def limits_egress(self):
+        return bool(self.egress.schedule)
+
+    def download_hook(self, external=False):
+        """A new progress hook for one yt-dlp download (external: by aria2c)."""
+
+        return DownloadHook(self.ingress, wait=not external)
+
+    def external_download_limit(self) -> int:
+        """Bytes per second for one external aria2c right now, 0 is unlimited."""
+
+        return int(self.ingress.schedule.rate() / self.download_jobs)
+
+    def open_for_upload(self, path):
+        return ThrottledFile(path, self.egress)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+_settings = {"ingress": None, "egress": None, "download_jobs": 1}
+
+
+def configure_bandwidth(ingress=None, egress=None, download_jobs=1):
+    """Ingress / egress schedules, see Schedule. Raises ValueError on a bad spec."""
+
+    _settings["ingress"] = Schedule(ingress)
+    _settings["egress"] = Schedule(egress)
+    _settings["download_jobs"] = max(1, download_jobs)
+    for name in ("ingress", "egress"):
+        if _settings[name]:
+            logging.info(
+                f"Bandwidth: {name} {_settings[name].default / 1024 / 1024:.1f} MB/s by default, {len(_settings[name].windows)} time windows"
+            )
+
+
+def get_bandwidth_limiter() -> BandwidthLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = BandwidthLimiter(
+                _settings["ingress"], _settings["egress"], _settings["download_jobs"]
+            )
+        return _limiter
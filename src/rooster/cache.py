@@ -0,0 +1,131 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+
+class MetadataCache:
+    """
+    On-disk cache of resolved episode data (the dict returned by the
+    get_episode_data_from_* functions), keyed by slug. Entries older than
+    `ttl` seconds are treated as missing, and once the cache grows past
+    `max_entries` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, max_entries=100000):
+        self.path = Path(path) if path else Path.cwd() / "logs" / "metadata.db"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS episodes (
+                slug TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS episodes_accessed ON episodes (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, slug):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, created_at FROM episodes WHERE slug = ?", (slug,)
+            ).fetchone()
+            if row is None:
+                return None
+            data, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM episodes WHERE slug = ?", (slug,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE episodes SET accessed_at = ? WHERE slug = ?", (now, slug)
+            )
+            self._conn.commit()
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def put(self, slug, episode_data):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?)",
+                (slug, json.dumps(episode_data), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM episodes").fetchone()
+        if count <= self.max_entries:
+            return
+        # drop an extra 10% so we don't evict on every single put
+        overflow = count - self.max_entries + self.max_entries // 10
+        self._conn.execute(
+            """DELETE FROM episodes WHERE slug IN (
+                SELECT slug FROM episodes ORDER BY accessed_at LIMIT ?
+            )""",
+            (overflow,),
+        )
+        logging.info(f"Metadata cache: evicted {overflow} least recently used entries")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_settings = {"enabled": True, "refresh": False}
+_cache_lock = threading.Lock()
+
+
+def configure_metadata_cache(enabled=True, refresh=False):
+    """
+    enabled: use the cache at all
+    refresh: ignore cached entries (they still get overwritten by fresh data)
+    """
+
+    _cache_settings["enabled"] = enabled
+    _cache_settings["refresh"] = refresh
+
+
+def get_metadata_cache():
+    global _cache
+    if not _cache_settings["enabled"]:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache()
+        return _cache
+
+
+def get_cached_episode_data(slug):
+    cache = get_metadata_cache()
+    if cache is None or _cache_settings["refresh"]:
+        return None
+    try:
+        return cache.get(slug)
+    except sqlite3.Error as e:
+        logging.warning(f"Metadata cache: could not read {slug} - {e}")
+        return None
+
+
+def save_episode_data_to_cache(slug, episode_data):
+    cache = get_metadata_cache()
+    if cache is None or episode_data is None:
+        return
+    try:
+        cache.put(slug, episode_data)
+    except sqlite3.Error as e:
+        logging.warning(f"Metadata cache: could not save {slug} - {e}")
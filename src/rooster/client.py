@@ -0,0 +1,85 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) seconds, unless a call asks for something else
+DEFAULT_TIMEOUT = (10, 60)
+
+SVOD_HOST = "svod-be.roosterteeth.com"
+SVOD_HEADERS = {
+    "authority": "svod-be.roosterteeth.com",
+    "accept": "application/json",
+    "accept-language": "en-US,en;q=0.9",
+    "cache-control": "no-cache",
+    "client-debug-id": "0.9053162591183688",
+    "client-id": "4338d2b4bdc8db1239360f28e72f0d9ddb1fd01e7a38fbb07b4b1f4ba4564cc5",
+    "client-type": "web",
+    "content-type": "application/json",
+    "origin": "https://roosterteeth.com",
+}
+
+
+class HttpClient:
+    """
+    The one requests session used for every request rooster makes itself
+    (yt-dlp and internetarchive bring their own). urllib3 keeps a pool of
+    keep-alive connections per host, so thumbnails and API calls reuse
+    connections instead of a new TCP + TLS handshake every time.
+
+    svod-be requests get SVOD_HEADERS (a header set to None in `headers`
+    leaves that default out), every request gets DEFAULT_TIMEOUT, and
+    GET/HEAD are retried on connection errors and 429/5xx. Other methods
+    aren't retried here: uploads and logins handle that themselves.
+    """
+
+    def __init__(self, pool_connections=32, pool_maxsize=16):
+        self.session = requests.Session()
+        # shared by all threads and hosts, so don't let responses set cookies
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        retries = Retry(
+            total=5,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retries,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, headers=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+        if urlparse(url).hostname == SVOD_HOST:
+            headers = {**SVOD_HEADERS, **(headers or {})}
+            headers = {name: value for name, value in headers.items() if value is not None}
+        return self.session.request(
+            method, url, headers=headers, timeout=timeout, **kwargs
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,289 @@
+import csv
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from .parser import RoosterTeethParser
+from .channels import channels, get_channel_name_from_id
+from .shows import shows, get_show_name_from_id
+from .iaexists import get_identifier_from_id, get_numerical_id
+
+CSV_FIELDS = [
+    "series",
+    "channel",
+    "link",
+    "archive_id",
+    "slug",
+    "title",
+    "season",
+    "episode",
+    "episode_type",
+    "original_air_date",
+    "is_first_content",
+]
+
+
+class CrawlCache:
+    """
+    svod-be answers kept in logs/crawl.db with their ETag / Last-Modified,
+    so a re-crawl sends conditional requests and unchanged pages come back
+    as an empty 304. Also holds the checkpoint: the shows that were written
+    out completely.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else Path.cwd() / "logs" / "crawl.db"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS shows_done (
+                    slug TEXT PRIMARY KEY,
+                    episodes INTEGER NOT NULL,
+                    finished_at REAL NOT NULL
+                );
+                """
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, url):
+        return (
+            self._connect()
+            .execute(
+                "SELECT etag, last_modified, body FROM pages WHERE url = ?", (url,)
+            )
+            .fetchone()
+        )
+
+    def put(self, url, etag, last_modified, body):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                (url, etag, last_modified, body),
+            )
+
+    def done_shows(self):
+        return {
+            slug
+            for (slug,) in self._connect().execute("SELECT slug FROM shows_done")
+        }
+
+    def mark_done(self, slug, episodes):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO shows_done VALUES (?, ?, ?)",
+                (slug, episodes, time.time()),
+            )
+
+    def reset_checkpoint(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM shows_done")
+
+
+class CatalogCrawler(RoosterTeethParser):
+    """
+    Walks every channel in channels.py and every show in shows.py, show by
+    show on a thread pool, and collects the full svod-be record of every
+    episode and bonus feature.
+    """
+
+    def __init__(self, cache=None, session=None, max_workers=8):
+        super().__init__(session=session, max_workers=max_workers)
+        self.cache = cache or CrawlCache()
+        self.not_modified = 0
+
+    def _get_json(self, url):
+        cached = self.cache.get(url)
+        headers = dict(self._headers())
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["if-none-match"] = etag
+            if last_modified:
+                headers["if-modified-since"] = last_modified
+            # "no-cache" would make the server skip the validators; the
+            # client adds SVOD_HEADERS back in unless the header is None
+            headers["cache-control"] = None
+        response = self.http.get(url, headers=headers, timeout=30)
+        if response.status_code == 304 and cached:
+            self.not_modified += 1
+            return json.loads(cached[2])
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.cache.put(url, etag, last_modified, response.text)
+        return response.json()
+
+    def list_shows(self):
+        """Shows from shows.py plus whatever the channels list, by slug."""
+
+        found = {show["slug"]: show["title"] for show in shows}
+        for channel in channels:
+            url = f"{self._API_BASE_URL}/shows?channel_id={channel['uuid']}&order=asc&order_by=title"
+            try:
+                for show in self._iter_pages(url):
+                    attributes = show.get("attributes", {})
+                    slug = attributes.get("slug")
+                    if slug and slug not in found:
+                        found[slug] = attributes.get("title")
+            except (requests.RequestException, ValueError) as e:
+                print(f"Could not list the shows of {channel['name']}: {e}")
+                logging.warning(f"Crawler: shows of channel {channel['slug']} failed - {e}")
+        return found
+
+    def crawl_show(self, slug, title=None):
+        """Returns the episode records of a show, or raises."""
+
+        season_links = self._get_season_links(
+            f"https://roosterteeth.com/series/{slug}"
+        )
+        if season_links is None:
+            raise ValueError(f"no seasons found for {slug}")
+        return [
+            make_episode_record(episode, title)
+            for season_link in season_links
+            for episode in self._iter_pages(season_link)
+        ]
+
+
+def make_episode_record(episode, show_title=None):
+    attributes = episode.get("attributes", {})
+    episode_id = episode.get("id")
+    episode_type = episode.get("type")
+    # the same item name the uploader uses, see downloader.get_itemname
+    archive_id = get_identifier_from_id(get_numerical_id(episode_id, episode_type))
+    canonical = (episode.get("canonical_links") or {}).get("self")
+    return {
+        "series": get_show_name_from_id(attributes.get("show_id")) or show_title,
+        "channel": get_channel_name_from_id(attributes.get("channel_id")),
+        "link": f"https://roosterteeth.com{canonical}" if canonical else None,
+        "archive_id": archive_id,
+        "slug": attributes.get("slug"),
+        "title": attributes.get("title"),
+        "season": attributes.get("season_number"),
+        "episode": attributes.get("number"),
+        "episode_type": episode_type,
+        "original_air_date": attributes.get("original_air_date"),
+        "is_first_content": attributes.get("is_sponsors_only"),
+        "record": episode,
+    }
+
+
+def crawl(csv_path, ndjson_path, jobs=8, restart=False):
+    """
+    Crawls the catalog into csv_path and ndjson_path. Every show is written
+    to both files as soon as it's done and then checkpointed, so a run
+    that gets interrupted continues with the shows that are left (and
+    appends to the same files).
+    """
+
+    cache = CrawlCache()
+    if restart:
+        cache.reset_checkpoint()
+    crawler = CatalogCrawler(cache=cache, max_workers=jobs)
+    done = cache.done_shows()
+    resume = bool(done)
+
+    show_slugs = crawler.list_shows()
+    todo = [slug for slug in show_slugs if slug not in done]
+    print(f"Crawling {len(todo)} shows ({len(done)} already done)")
+
+    write_header = not (resume and Path(csv_path).exists())
+    mode = "w" if write_header else "a"
+    written = 0
+    failed = []
+    with open(csv_path, mode, newline="") as csv_file, open(
+        ndjson_path, mode
+    ) as ndjson_file, ThreadPoolExecutor(
+        max_workers=jobs, thread_name_prefix="crawl"
+    ) as executor:
+        writer = csv.DictWriter(csv_file, CSV_FIELDS, extrasaction="ignore")
+        if write_header:
+            writer.writeheader()
+        futures = {
+            executor.submit(crawler.crawl_show, slug, show_slugs[slug]): slug
+            for slug in todo
+        }
+        for future in as_completed(futures):
+            slug = futures[future]
+            try:
+                records = future.result()
+            except (requests.RequestException, ValueError, KeyError) as e:
+                print(f"{slug}: failed, will be retried on the next run - {e}")
+                logging.warning(f"Crawler: {slug} failed - {e}")
+                failed.append(slug)
+                continue
+            for record in records:
+                if record["link"]:
+                    writer.writerow(record)
+                ndjson_file.write(json.dumps(record) + "\n")
+            csv_file.flush()
+            ndjson_file.flush()
+            cache.mark_done(slug, len(records))
+            written += len(records)
+            print(f"{slug}: {len(records)} episodes")
+
+    print(
+        f"Wrote {written} episodes from {len(todo) - len(failed)} shows, {crawler.not_modified} pages unchanged since the last crawl"
+    )
+    if failed:
+        print(f"{len(failed)} shows failed, run again to resume: {', '.join(failed)}")
+    else:
+        cache.reset_checkpoint()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Crawl the Rooster Teeth catalog into an episodes CSV / NDJSON"
+    )
+    parser.add_argument(
+        "--csv", default="episodes_info.csv", help="CSV output (default episodes_info.csv)"
+    )
+    parser.add_argument(
+        "--ndjson",
+        default="episodes_info.ndjson",
+        help="Full episode records, one JSON per line (default episodes_info.ndjson)",
+    )
+    parser.add_argument("--jobs", default=8, type=int, help="Shows crawled at once (default 8)")
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint of an interrupted crawl and start over",
+    )
+    args = parser.parse_args()
+
+    Path("logs").mkdir(exist_ok=True)
+    logging.basicConfig(
+        filename="logs/rooster.log",
+        filemode="a",
+        format="%(asctime)s - %(name)s - %(threadName)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    crawl(args.csv, args.ndjson, jobs=max(1, args.jobs), restart=args.restart)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,7 +2,6 @@ import os
 import re
 import logging
 from urllib.parse import urlparse
-import requests
 from datetime import datetime
 import shutil
 import json
@@ -10,9 +9,20 @@ import yt_dlp
 
 from .channels import get_channel_name_from_id
 from .shows import get_show_name_from_id
+from .session import get_rooster_session
+from .cache import get_cached_episode_data, save_episode_data_to_cache
+from .resolver import resolve_first
+from .archive import get_archive_index
+from .state import get_state_store
+from .iaexists import get_ia_existence_cache, get_identifier_from_id, get_numerical_id
+from .upload import get_upload_pool
+from .client import get_http_client
+from .hls import download_with_engine, get_hls_downloader, use_native_hls
+from .aria import get_aria_daemon, use_aria_daemon
+from .adaptive import get_cdn_host, get_fragment_controller, use_adaptive_fragments
+from .bandwidth import get_bandwidth_limiter
 
 from urllib3.exceptions import MaxRetryError, NewConnectionError
-from requests.adapters import HTTPAdapter
 from requests.exceptions import SSLError
 from requests.exceptions import RequestException
 from pathlib import Path
@@ -52,26 +62,22 @@ def get_download_location(fn_mode: str) -> Path:
     return download_path
 
 
-def save_successful_downloaded_slugs(slug):
-    downlaoded_log_path = get_downloaded_log_filename()
+def save_episode_status(slug, status, episode_id=None, error=None):
     try:
-        with open(downlaoded_log_path, "a") as log_file:
-            log_file.write(slug + "\n")
+        get_state_store().set_status(slug, status, episode_id=episode_id, error=error)
     except Exception as ex:
         logging.critical(
-            f"Successful Download Log: An error occurred while saving slug {slug} - {ex}"
+            f"State Store: An error occurred while saving {status} for {slug} - {ex}"
         )
 
 
-def save_failed_upload_url_slugs(url):
-    downlaoded_log_path = get_failed_uploaded_log_filename()
-    try:
-        with open(downlaoded_log_path, "a") as log_file:
-            log_file.write(url + "\n")
-    except Exception as ex:
-        logging.critical(
-            f"Failed Upload Log: An error occurred while saving url {url} - {ex}"
-        )
+def save_successful_downloaded_slugs(slug, episode_id=None):
+    save_episode_status(slug, "downloaded", episode_id=episode_id)
+
+
+def save_failed_upload_url_slugs(url, episode_id=None):
+    slug = url.rstrip("/").split("/")[-1]
+    save_episode_status(slug, "failed", episode_id=episode_id, error="upload")
 
 
 log_dir = Path.cwd() / "logs"
@@ -82,7 +88,7 @@ if not os.path.exists(log_dir):
 logging.basicConfig(
     filename="logs/rooster.log",
     filemode="a",
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(name)s - %(threadName)s - %(levelname)s - %(message)s",
     level=logging.DEBUG,
 )
 
@@ -161,14 +167,7 @@ def exists_in_archive(episode_data):
     id_episode = str(episode_data["id_numerical"])
     if episode_data["season_number"] == "99":
         id_episode += "-bonus"  # Handle bonus ids
-    archive = get_archive_log_filename()
-    if os.path.isfile(archive):
-        with open(archive, "r") as f:
-            for line in f:
-                id_archive = line.split(" ")[1].rstrip()
-                if id_archive == id_episode:
-                    return True
-    return False
+    return get_archive_index().has_id(id_episode)
 
 
 def extract_data_from_ytdl_dict(info_dict):
@@ -259,12 +258,8 @@ def is_tool(name):
 
 
 def get_itemname(data) -> str:
-    # roosterteeth-test appended for test purposes. -test will be removed
-    return f"roosterteeth-{data['id_numerical']}"
-    # if data["episode_type"] == "bonus_feature":
-    #     return f"roosterteeth-{data['id_numerical']}-bonus"
-    # else:
-    #     return f"roosterteeth-{data['id_numerical']}"
+    # id_numerical already carries the -bonus of bonus features
+    return get_identifier_from_id(data["id_numerical"])
 
 
 def get_folder_location_for_ia_upload(episode_data) -> str:
@@ -282,8 +277,8 @@ def get_folder_location_for_ia_upload(episode_data) -> str:
 
 def check_if_ia_item_exists(episode_data) -> bool:
     itemname = get_itemname(episode_data)
-    item = internetarchive.get_item(itemname)
-    if item.exists:
+    # prefetched in batches for the run, falls back to a per-item lookup
+    if get_ia_existence_cache().exists(itemname):
         return True, itemname
     return False, itemname
 
@@ -321,7 +316,10 @@ def generate_ia_meta(episode_data):
     year = episode_data["original_air_date"][:4]
     episode_slug = episode_data["slug"]
     original_url = f"https://roosterteeth.com/watch/{episode_slug}"
-    genres_list = episode_data["genres"]
+    # copy, extending the cached list would add the tags again on every call
+    genres_list = (
+        list(episode_data["genres"]) if episode_data["genres"] is not None else None
+    )
     first_exclusive = "First" if episode_data["is_first_content"] else "Public"
     first_exclusive_bool = True if episode_data["is_first_content"] else False
 
@@ -502,11 +500,9 @@ def download_thumbnail_fallback(episode_data, fn_mode):
             return
 
         # Attempt to download
-        s = requests.Session()
-        s.mount(thumbnail_url, HTTPAdapter(max_retries=5))
-
         try:
-            response = s.get(thumbnail_url)
+            response = get_http_client().get(thumbnail_url)
+            get_bandwidth_limiter().ingress.consume(len(response.content))
             if response.status_code == 200:
                 file_directory.mkdir(parents=True, exist_ok=True)
                 with open(file_path, "wb") as f:
@@ -586,11 +582,9 @@ def download_thumbnail(thumbnail_url, episode_data, fn_mode):
             return
 
         # Attempt to download
-        s = requests.Session()
-        s.mount(thumbnail_url, HTTPAdapter(max_retries=5))
-
         try:
-            response = s.get(thumbnail_url)
+            response = get_http_client().get(thumbnail_url)
+            get_bandwidth_limiter().ingress.consume(len(response.content))
             if response.status_code == 200:
                 with open(file_path, "wb") as f:
                     f.write(response.content)
@@ -630,11 +624,14 @@ def download_thumbnail(thumbnail_url, episode_data, fn_mode):
         return False
 
 
-def download_thumb_from_yt_dlp_data(extractor_options, vod_url, episode_data, fn_mode):
+def download_thumb_from_yt_dlp_data(
+    extractor_options, vod_url, episode_data, fn_mode, info_dict=None
+):
     try:
-        info_dict = yt_dlp.YoutubeDL(extractor_options).extract_info(
-            vod_url, download=False
-        )
+        if info_dict is None:
+            info_dict = yt_dlp.YoutubeDL(extractor_options).extract_info(
+                vod_url, download=False
+            )
     except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as err:
         print(err)
         print("Are you sure its a valid link?")
@@ -700,22 +697,16 @@ def generate_download_filename_and_dir(episode_data, fn_mode) -> Path:
     return full_name_with_dir
 
 
-def downloader(
+def get_video_options(
     username,
     password,
-    vod_url,
-    episode_data,
     concurrent_fragments,
     use_aria,
-    fn_mode,
     fragment_retries,
     fragment_abort,
-    keep_after_upload,
-    ignore_existing,
 ):
     video_options = {
-        "username": username,
-        "password": password,
+        **get_rooster_session(username, password).ydl_options(),
         "restrictedfilenames": True,
         "forcejson": False,
         "writeinfojson": True,
@@ -728,8 +719,10 @@ def downloader(
         "retries": 10,
         "fragment_retries": fragment_retries,
         "skip_unavailable_fragments": fragment_abort,
-        "download_archive": get_archive_log_filename(),
+        # shared in-memory index of logs/archive.log, yt-dlp appends through it
+        "download_archive": get_archive_index(),
         # "progress_hooks": [ydl_progress_hook],
+        "progress_hooks": [],
         "retry_sleep_functions": {
             "http": lambda attempt: min(10, attempt**2),
             "fragment": lambda attempt: min(5, attempt),
@@ -739,18 +732,66 @@ def downloader(
         "max_sleep_interval": 5,
     }
 
+    # every download draws from the shared ingress budget
+    limiter = get_bandwidth_limiter()
+    external_aria = use_aria is True and is_tool("aria2c")
+    if limiter.limits_ingress:
+        video_options["progress_hooks"].append(
+            limiter.download_hook(external=external_aria)
+        )
+
     ## use aria2c if it exists in system
     if use_aria is True:
-        if is_tool("aria2c"):
+        if external_aria:
             video_options["external_downloader"] = "aria2c"
             video_options["external_downloader_args"] = [
-                "-j 16",
-                " -x 16",
-                "-s 16",
+                "-j",
+                "16",
+                "-x",
+                "16",
+                "-s",
+                "16",
             ]
+            if limiter.limits_ingress:
+                # its own process, so it gets its share of the current limit
+                video_options["external_downloader_args"].append(
+                    f"--max-overall-download-limit={limiter.external_download_limit()}"
+                )
     else:
         video_options["concurrent_fragment_downloads"] = int(concurrent_fragments)
 
+    return video_options
+
+
+def download_episode(
+    username,
+    password,
+    vod_url,
+    episode_data,
+    concurrent_fragments,
+    use_aria,
+    fn_mode,
+    fragment_retries,
+    fragment_abort,
+    info_dict=None,
+):
+    """
+    Downloads the thumbnail and the video of an episode.
+    If info_dict (from resolving the metadata with yt-dlp) is given, it's
+    downloaded directly instead of extracting the page and manifest again.
+    Returns:
+        Path: the episode container directory, or None if the download failed
+    """
+
+    video_options = get_video_options(
+        username,
+        password,
+        concurrent_fragments,
+        use_aria,
+        fragment_retries,
+        fragment_abort,
+    )
+
     # TODO:
     # why am i calling the info_dict before checking if I have filename
     # data or not? thumbnail infO? idk
@@ -769,85 +810,164 @@ def downloader(
     ###
     # generate file name
     ## generate directory
-    if episode_data:  # Have Episode Data
-        # step 1: Download Thumbnail
-        if episode_data["large_thumb"]:
-            try:
-                download_thumbnail(episode_data["large_thumb"], episode_data, fn_mode)
-            except FileNotFoundError as fnf_err:
-                print(f"Error with file location or sth {fnf_err}")
-                logging.warning(f"Error with file location error {fnf_err}")
-            except:
-                print("Error Downloading HQ Thumbs. Will download LQ Thumb")
-                logging.warning("Error Downloading HQ Thumbs. Will download LQ Thumb")
-                video_options["writethumbnail"] = True
-
-        full_name_with_dir = generate_download_filename_and_dir(
-            episode_data=episode_data, fn_mode=fn_mode
-        )
-    else:
+    if not episode_data:  # Have Episode Data
         print("Episode Data not found, skipping...")
+        return None
 
+    # step 1: Download Thumbnail
+    if episode_data["large_thumb"]:
+        try:
+            download_thumbnail(episode_data["large_thumb"], episode_data, fn_mode)
+        except FileNotFoundError as fnf_err:
+            print(f"Error with file location or sth {fnf_err}")
+            logging.warning(f"Error with file location error {fnf_err}")
+        except:
+            print("Error Downloading HQ Thumbs. Will download LQ Thumb")
+            logging.warning("Error Downloading HQ Thumbs. Will download LQ Thumb")
+            video_options["writethumbnail"] = True
+
+    full_name_with_dir = generate_download_filename_and_dir(
+        episode_data=episode_data, fn_mode=fn_mode
+    )
     video_options["outtmpl"] = str(full_name_with_dir)
 
-    # IA Specific Task
-    if fn_mode == "ia":
-        ia_metadata = generate_ia_meta(episode_data=episode_data)
+    # tune yt-dlp's own fragment downloads, the other engines bring their own
+    probe = None
+    tune_fragments = use_adaptive_fragments() and not (
+        use_aria or use_native_hls() or use_aria_daemon()
+    )
 
     # pass off to yt-dlp for downloading
     print("Starting download: ", episode_data["title"])
     try:
-        yt_dlp.YoutubeDL(video_options).download(vod_url)
+        if tune_fragments:
+            if info_dict is None:
+                # the setting is per CDN host, which only the formats tell
+                info_dict = get_info_dict_from_ydl(username, password, vod_url)
+            host = get_cdn_host(info_dict)
+            if host is not None:
+                probe = get_fragment_controller().probe(host)
+                probe.apply(video_options)
+        ydl = yt_dlp.YoutubeDL(video_options)
+        if use_native_hls():
+            info_dict = download_with_engine(
+                ydl, info_dict, vod_url, get_hls_downloader()
+            )
+        elif use_aria_daemon():
+            info_dict = download_with_engine(ydl, info_dict, vod_url, get_aria_daemon())
+        if info_dict is not None:
+            ydl.process_ie_result(info_dict, download=True)
+        else:
+            ydl.download(vod_url)
+        if probe is not None:
+            probe.finish()
         print(f"{episode_data['id_numerical']} Downloaded successfully {vod_url}")
+    except:
+        if probe is not None:
+            probe.finish(failed=True)
+        logging.critical(
+            f"{episode_data['id_numerical']} Error with yt_dlp downloading for: {vod_url}"
+        )
+        save_episode_status(
+            episode_data["slug"],
+            "failed",
+            episode_id=episode_data["id_numerical"],
+            error="download",
+        )
+        return None
 
-        if has_video_and_image(
-            full_name_with_dir.parent
-        ):  # checks for mp4 and jpg/png existance
-            print("Downloads includes image/video file, saving to downloaded log")
-            save_successful_downloaded_slugs(slug=episode_data["slug"])
+    return full_name_with_dir.parent
 
-        # check whether every file has downloaded. specially mp4
-        # SAVE SLUG to a new file for fast-check
-        if fn_mode == "ia":
-            container_dir = full_name_with_dir.parent
-            ready_for_upload = check_if_files_are_ready(directory=container_dir)
-
-            if ready_for_upload:
-                print("Directory contains mp4 file and no incomplete parts, Uploading.")
-                upload_status = upload_ia(
-                    directory_location=container_dir,
-                    md=ia_metadata,
-                    episoda_data=episode_data,
-                    keep_after_upload=keep_after_upload,
-                    ignore_existing=ignore_existing,
-                )
-                if upload_status is not True:
-                    if not ignore_existing:
-                        print("Something went wrong with the upload, try again later.")
-                    else:
-                        print("Should be updated, please do a simple manual check! WIP")
-                else:
-                    if not keep_after_upload:
-                        shutil.rmtree(container_dir)
 
-            else:
-                print("Directory does not contain .mp4 files. Exiting.")
-                logging.critical(
-                    f"Directory does not contain .mp4 files: {container_dir}"
-                )
+def post_process_download(episode_data, container_dir, fn_mode) -> bool:
+    """
+    Records a finished download and, for IA mode, checks that the container
+    directory is ready to be uploaded.
+    """
 
+    if has_video_and_image(container_dir):  # checks for mp4 and jpg/png existance
+        print("Downloads includes image/video file, saving to downloaded log")
+        save_successful_downloaded_slugs(
+            slug=episode_data["slug"], episode_id=episode_data["id_numerical"]
+        )
+
+    # check whether every file has downloaded. specially mp4
+    # SAVE SLUG to a new file for fast-check
+    if fn_mode == "ia":
+        if not check_if_files_are_ready(directory=container_dir):
+            print("Directory does not contain .mp4 files. Exiting.")
+            logging.critical(f"Directory does not contain .mp4 files: {container_dir}")
+            save_episode_status(episode_data["slug"], "failed", error="incomplete")
+            return False
+        print("Directory contains mp4 file and no incomplete parts, Uploading.")
+        save_episode_status(episode_data["slug"], "verified")
+    return True
+
+
+def upload_episode(episode_data, container_dir, keep_after_upload, ignore_existing):
+    ia_metadata = generate_ia_meta(episode_data=episode_data)
+    upload_status = upload_ia(
+        directory_location=container_dir,
+        md=ia_metadata,
+        episoda_data=episode_data,
+        keep_after_upload=keep_after_upload,
+        ignore_existing=ignore_existing,
+    )
+    if upload_status is not True:
+        if not ignore_existing:
+            print("Something went wrong with the upload, try again later.")
+            return False
         else:
-            print(
-                f"An error occurred while trying to upload from this location: {container_dir}"
-            )
-            logging.critical(
-                f"An error occurred while trying to upload from this location: {container_dir}"
-            )
+            print("Should be updated, please do a simple manual check! WIP")
+    else:
+        save_episode_status(episode_data["slug"], "uploaded")
+        get_ia_existence_cache().set_exists(get_itemname(episode_data))
+        if not keep_after_upload:
+            shutil.rmtree(container_dir)
+    return True
 
-    except:
-        logging.critical(
-            f"{episode_data['id_numerical']} Error with yt_dlp downloading for: {vod_url}"
-        )
+
+def downloader(
+    username,
+    password,
+    vod_url,
+    episode_data,
+    concurrent_fragments,
+    use_aria,
+    fn_mode,
+    fragment_retries,
+    fragment_abort,
+    keep_after_upload,
+    ignore_existing,
+    info_dict=None,
+):
+    container_dir = download_episode(
+        username,
+        password,
+        vod_url,
+        episode_data,
+        concurrent_fragments,
+        use_aria,
+        fn_mode,
+        fragment_retries,
+        fragment_abort,
+        info_dict,
+    )
+    if container_dir is None:
+        return False
+
+    try:
+        if not post_process_download(episode_data, container_dir, fn_mode):
+            return False
+        if fn_mode == "ia":
+            return upload_episode(
+                episode_data, container_dir, keep_after_upload, ignore_existing
+            )
+    except Exception as e:
+        print(f"An error occurred while post processing {container_dir}: {e}")
+        logging.critical(f"An error occurred while post processing {container_dir}: {e}")
+        return False
+    return True
 
 
 def get_rt_api_url(url):
@@ -864,35 +984,26 @@ def get_api_url(url):
     return api_url
 
 
-def get_episode_data_from_api(url):
-    s = requests.Session()
-    s.mount(url, HTTPAdapter(max_retries=5))
+def _get_api_response(url, headers=None):
+    """
+    GET for the metadata apis. Returns None when the api doesn't have the
+    episode. Connection errors, timeouts and 5xx answers are raised, so the
+    resolver can count them against the source's breaker.
+    """
 
-    try:
-        response = s.get(url)
-        if response.status_code == 200:
-            episode_data = response.json().get("data", [])
-        else:
-            print(f"Failed to get api data from: {url}")
-            logging.info(
-                f"An error occurred: {e}. Please note this episodeId: {episode_data['id_numerical']}"
-            )
-            return None
-    except MaxRetryError as e:
-        print(f"MaxRetryError occurred: {e}")
-        if hasattr(e, "pool"):
-            e.pool.close()
-        print("Closed connections to avoid further issues.")
-        logging.warning(f"MaxRetryError occurred: {e}")
-        return None
-    except NewConnectionError as e:
-        print(f"NewConnectionError occurred: {e}")
-        logging.warning(f"NewConnectionError occurred: {e}")
+    response = get_http_client().get(url, headers=headers)
+    if response.status_code >= 500:
+        response.raise_for_status()
+    if response.status_code != 200:
+        print(f"Failed to get api data from: {url}")
+        logging.info(f"API: {url} answered {response.status_code}")
         return None
+    return response
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        logging.critical(f"An error occurred: {e}")
+
+def get_episode_data_from_api(url):
+    response = _get_api_response(url)
+    if response is None:
         return None
 
     episode_data = response.json().get("documents", [])
@@ -901,8 +1012,7 @@ def get_episode_data_from_api(url):
         episode_id = episode_obj.get("id")
         uuid = episode_obj.get("uuid")
         episode_type = episode_obj.get("type")
-        if episode_type == "bonus_feature":
-            episode_id = f"{episode_id}-bonus"
+        episode_id = get_numerical_id(episode_id, episode_type)
 
         attributes = episode_obj.get("attributes", {})
         title = make_filename_safe_unicode(attributes.get("title"))
@@ -965,37 +1075,12 @@ def get_episode_data_from_api(url):
         return None
 
 
-def get_episode_data_from_rt_api(url):
-    s = requests.Session()
-    s.mount(url, HTTPAdapter(max_retries=5))
-
-    try:
-        response = s.get(url)
-        if response.status_code == 200:
-            episode_data = response.json().get("data", [])
-        else:
-            print(f"Failed to get api data from: {url}")
-            logging.info(
-                f"An error occurred: {e}. Please note this episodeId: {episode_data['id_numerical']}"
-            )
-            return None
-    except MaxRetryError as e:
-        print(f"MaxRetryError occurred: {e}")
-        if hasattr(e, "pool"):
-            e.pool.close()
-        print("Closed connections to avoid further issues.")
-        logging.warning(f"MaxRetryError occurred: {e}")
-        return None
-    except NewConnectionError as e:
-        print(f"NewConnectionError occurred: {e}")
-        logging.warning(f"NewConnectionError occurred: {e}")
-        return None
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        logging.critical(f"An error occurred: {e}")
+def get_episode_data_from_rt_api(url, headers=None):
+    response = _get_api_response(url, headers=headers)
+    if response is None:
         return None
 
+    episode_data = response.json().get("data", [])
     if episode_data:
         episode_obj = episode_data[0]
         episode_id = episode_obj.get("id")
@@ -1004,9 +1089,7 @@ def get_episode_data_from_rt_api(url):
         large_thumb = get_high_quality_thumbnail_link(images)
 
         episode_type = episode_obj.get("type")
-
-        if episode_type == "bonus_feature":
-            episode_id = f"{episode_id}-bonus"
+        episode_id = get_numerical_id(episode_id, episode_type)
 
         attributes = episode_obj.get("attributes", {})
         title = make_filename_safe_unicode(attributes.get("title"))
@@ -1123,12 +1206,13 @@ def process_yt_dlp_info_dict(data):
     }
 
 
+def get_info_dict_from_ydl(username, password, vod_url):
+    yt_dlp_options = get_rooster_session(username, password).ydl_options()
+    return yt_dlp.YoutubeDL(yt_dlp_options).extract_info(url=vod_url, download=False)
+
+
 def get_episode_data_from_ydl(username, password, vod_url):
-    yt_dlp_options = {
-        "username": username,
-        "password": password,
-    }
-    info = yt_dlp.YoutubeDL(yt_dlp_options).extract_info(url=vod_url, download=False)
+    info = get_info_dict_from_ydl(username, password, vod_url)
     episode_data = process_yt_dlp_info_dict(info)
     return episode_data
 
@@ -1149,45 +1233,80 @@ def get_episode_data_from_ydl(username, password, vod_url):
 #         ydl.download(vod_url)
 
 
-def show_stuff(
+def get_metadata_sources(username, password, vod_url):
+    """
+    The ways to get episode data, in order of preference. Each one returns
+    (episode_data, info_dict), info_dict is only available from yt-dlp.
+    """
+
+    def from_ydl():
+        info_dict = get_info_dict_from_ydl(
+            vod_url=vod_url, username=username, password=password
+        )
+        if info_dict is None:
+            return None, None
+        return process_yt_dlp_info_dict(info_dict), info_dict
+
+    def from_rt_api():
+        api_url = get_rt_api_url(url=vod_url)
+        episode_data = get_episode_data_from_rt_api(
+            api_url, headers=get_rooster_session(username, password).headers()
+        )
+        return episode_data, None
+
+    def from_api():
+        alt_api_url = get_api_url(url=vod_url)
+        return get_episode_data_from_api(alt_api_url), None
+
+    return [
+        ("yt-dlp", from_ydl),
+        ("rt-api", from_rt_api),
+        ("workers-api", from_api),
+    ]
+
+
+def resolve_episode(
     username,
     password,
     vod_url,
-    concurrent_fragments,
     fast_check,
-    use_aria,
     fn_mode,
-    fragment_retries,
-    fragment_abort,
     total_slugs,
     ignore_existing,
-    keep_after_upload,
     update_metadata,
 ):
-    if not is_tool("ffmpeg"):
-        print(f"{bcolors.WARNING}ffmpeg not installed, go do that{bcolors.ENDC}")
-        exit()
+    """
+    Resolves the episode metadata and runs every check that can skip it.
+    Returns:
+        tuple: (status, episode_data, info_dict). status is None when the
+        episode still needs to be downloaded, otherwise it's the final status
+        for the link. info_dict is the yt-dlp extraction result (if yt-dlp
+        resolved the metadata), to be reused for the download.
+    """
+
     # check manually
     if fast_check:
         if exists_in_downloaded_log(slug=vod_url.split("/")[-1], slugs=total_slugs):
             print(
                 f"{bcolors.UNDERLINE}{vod_url}: URL already recorded in downloaded log{bcolors.ENDC}"
             )
-            return
-
-    episode_data = None
-    episode_data = get_episode_data_from_ydl(
-        vod_url=vod_url, username=username, password=password
-    )
+            return "skipped", None, None
 
-    if episode_data is None:
-        print("Primary method failed, trying secondary methods")
-        api_url = get_rt_api_url(url=vod_url)
-        episode_data = get_episode_data_from_rt_api(api_url)
-        if episode_data is None:
-            print("Secondary method failed, yikes, trying last resort")
-            alt_api_url = get_api_url(url=vod_url)
-            episode_data = get_episode_data_from_api(alt_api_url)
+    slug = vod_url.rstrip("/").split("/")[-1]
+    info_dict = None
+    episode_data = get_cached_episode_data(slug)
+    if episode_data is not None:
+        print(f"Using cached metadata for {slug}")
+    else:
+        episode_data, info_dict = resolve_first(
+            get_metadata_sources(username, password, vod_url)
+        )
+        save_episode_data_to_cache(slug, episode_data)
+        if episode_data is not None:
+            try:
+                get_state_store().mark_resolved(slug, episode_data["id_numerical"])
+            except Exception as ex:
+                logging.warning(f"State Store: could not save {slug} - {ex}")
 
     # update meta:
     if update_metadata is True:
@@ -1197,45 +1316,81 @@ def show_stuff(
                 f"{bcolors.WARNING}Item doesn't exist yet, can't update metadata for {vod_url}{bcolors.ENDC}"
             )
             logging.info(f"Item doesn't exist yet, can't update metadata for {vod_url}")
-            return
+            return "missing", episode_data, info_dict
         else:
-            update_ia_metadata(episode_data)
-            return
+            if update_ia_metadata(episode_data):
+                return "updated", episode_data, info_dict
+            return "failed", episode_data, info_dict
 
     if episode_data is None:
         print(f"{bcolors.FAIL}All 3 API Failed.. Skipping...{bcolors.ENDC}")
-    else:
-        if exists_in_archive(episode_data):
-            print(
-                f'{bcolors.WARNING}{episode_data["id_numerical"]}: {episode_data["title"]} already recorded in archive{bcolors.ENDC}'
-            )
-        else:
-            if fn_mode == "ia":
-                if not ignore_existing:
-                    item_exists, identifier = check_if_ia_item_exists(
-                        episode_data=episode_data
-                    )
-                    if item_exists is True:
-                        print()
-                        print(
-                            f"{bcolors.OKBLUE}Item already exists at https://archive.org/details/{identifier}{bcolors.ENDC}"
-                        )
-                        print()
-                        return
-
-            downloader(
-                username,
-                password,
-                vod_url,
-                episode_data,
-                concurrent_fragments,
-                use_aria,
-                fn_mode,
-                fragment_retries,
-                fragment_abort,
-                keep_after_upload,
-                ignore_existing,
+        return "failed", None, None
+
+    if exists_in_archive(episode_data):
+        print(
+            f'{bcolors.WARNING}{episode_data["id_numerical"]}: {episode_data["title"]} already recorded in archive{bcolors.ENDC}'
+        )
+        return "archived", episode_data, info_dict
+
+    if fn_mode == "ia":
+        if not ignore_existing:
+            item_exists, identifier = check_if_ia_item_exists(
+                episode_data=episode_data
             )
+            if item_exists is True:
+                print()
+                print(
+                    f"{bcolors.OKBLUE}Item already exists at https://archive.org/details/{identifier}{bcolors.ENDC}"
+                )
+                print()
+                return "exists", episode_data, info_dict
+
+    return None, episode_data, info_dict
+
+
+def show_stuff(
+    username,
+    password,
+    vod_url,
+    concurrent_fragments,
+    fast_check,
+    use_aria,
+    fn_mode,
+    fragment_retries,
+    fragment_abort,
+    total_slugs,
+    ignore_existing,
+    keep_after_upload,
+    update_metadata,
+):
+    status, episode_data, info_dict = resolve_episode(
+        username,
+        password,
+        vod_url,
+        fast_check,
+        fn_mode,
+        total_slugs,
+        ignore_existing,
+        update_metadata,
+    )
+    if status is not None:
+        return status
+
+    downloaded = downloader(
+        username,
+        password,
+        vod_url,
+        episode_data,
+        concurrent_fragments,
+        use_aria,
+        fn_mode,
+        fragment_retries,
+        fragment_abort,
+        keep_after_upload,
+        ignore_existing,
+        info_dict,
+    )
+    return "downloaded" if downloaded else "failed"
 
 
 def upload_ia(directory_location, md, episoda_data, keep_after_upload, ignore_existing):
@@ -1246,33 +1401,27 @@ def upload_ia(directory_location, md, episoda_data, keep_after_upload, ignore_ex
     #     msg = "`internetarchive` configuration file is not configured" " properly."
     #     raise Exception(msg)
 
-    dir_loc_with_slash = str(directory_location) + "/"
-
     dete_after_upload = not keep_after_upload
 
-    item = internetarchive.get_item(identifier=identifier_ia)
-
     try:
-        r = item.upload(
-            # identifier=identifier_ia,
-            files=dir_loc_with_slash,
+        r = get_upload_pool().upload_directory(
+            identifier=identifier_ia,
+            directory=directory_location,
             metadata=md,
-            verbose=True,
-            retries=9001,
-            request_kwargs=dict(timeout=9001),
             delete=dete_after_upload,
-            # checksum=True,
+            # repair runs only send what's missing or different
+            sync=ignore_existing,
         )
 
         VIDEO_OKAY = False
         successful_uploads = 0
-        for response in r:
-            if response.status_code == 200:
+        for result in r:
+            if result.ok:
                 successful_uploads += 1
 
-            # Check if the URL ends with '.mp4'
+            # Check if the file is the '.mp4'
             if not ignore_existing:
-                if response.url.endswith(".mp4"):
+                if result.ok and result.key.endswith(".mp4"):
                     print()
                     print(
                         f"{md['title']} | {bcolors.OKGREEN}Uploaded Successfully at https://archive.org/details/{identifier_ia}{bcolors.ENDC}"
@@ -1288,7 +1437,9 @@ def upload_ia(directory_location, md, episoda_data, keep_after_upload, ignore_ex
                     f"{successful_uploads} out of {len(r)} added successfully. {bcolors.OKGREEN}Check at: https://archive.org/details/{identifier_ia}{bcolors.ENDC}"
                 )
         if successful_uploads == 0:
-            save_failed_upload_url_slugs(md["originalUrl"])
+            save_failed_upload_url_slugs(
+                md["originalUrl"], episode_id=episoda_data["id_numerical"]
+            )
             print(
                 "Something went wrong with the uploads. if you are updating existing item, ignore this. And any NoneType Error"
             )
@@ -0,0 +1,578 @@
+import os
+import ssl
+import time
+import random
+import asyncio
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from .bandwidth import get_bandwidth_limiter
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+READ_CHUNK = 1024 * 1024
+
+
+class HlsError(Exception):
+    pass
+
+
+class UnsupportedPlaylist(HlsError):
+    """A playlist or format the engine doesn't handle, yt-dlp downloads it instead."""
+
+
+class ProtocolError(HlsError):
+    """A response the pool can't parse: bad status line, chunk size or length."""
+
+
+class HttpStatusError(HlsError):
+    def __init__(self, status, url, retry_after=None):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Fragment:
+    def __init__(self, index, url, byterange=None):
+        self.index = index
+        self.url = url
+        # (length, offset) from #EXT-X-BYTERANGE
+        self.byterange = byterange
+        self.size = 0
+        self.attempts = 0
+        self.elapsed = 0.0
+
+    def headers(self):
+        if self.byterange is None:
+            return {}
+        length, offset = self.byterange
+        return {"Range": f"bytes={offset}-{offset + length - 1}"}
+
+
+def _parse_byterange(value, previous_end):
+    length, _, offset = value.partition("@")
+    return int(length), int(offset) if offset else previous_end
+
+
+def _parse_attributes(value):
+    attributes = {}
+    for part in value.split(","):
+        key, _, val = part.partition("=")
+        attributes[key.strip()] = val.strip().strip('"')
+    return attributes
+
+
+def parse_media_playlist(text, base_url):
+    """
+    Returns the init section (or None) and the fragments of an HLS media
+    playlist. Master, live and encrypted playlists raise UnsupportedPlaylist.
+    """
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise HlsError(f"not an m3u8 playlist: {base_url}")
+
+    init = None
+    fragments = []
+    byterange = None
+    ends = {}
+    ended = False
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-STREAM-INF"):
+            raise UnsupportedPlaylist("master playlist")
+        elif line.startswith("#EXT-X-KEY:"):
+            method = _parse_attributes(line[len("#EXT-X-KEY:") :]).get("METHOD")
+            if method != "NONE":
+                raise UnsupportedPlaylist(f"encrypted playlist ({method})")
+        elif line.startswith("#EXT-X-MAP:"):
+            attributes = _parse_attributes(line[len("#EXT-X-MAP:") :])
+            if init is not None or fragments:
+                raise UnsupportedPlaylist("more than one init section")
+            url = urljoin(base_url, attributes["URI"])
+            init_range = None
+            if "BYTERANGE" in attributes:
+                init_range = _parse_byterange(attributes["BYTERANGE"], 0)
+            init = Fragment(-1, url, init_range)
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = line[len("#EXT-X-BYTERANGE:") :]
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif not line.startswith("#"):
+            url = urljoin(base_url, line)
+            fragment_range = None
+            if byterange is not None:
+                fragment_range = _parse_byterange(byterange, ends.get(url, 0))
+                ends[url] = sum(fragment_range)
+                byterange = None
+            fragments.append(Fragment(len(fragments), url, fragment_range))
+    if not ended:
+        raise UnsupportedPlaylist("live playlist")
+    if not fragments:
+        raise HlsError(f"no fragments in {base_url}")
+    return init, fragments
+
+
+class AsyncHttpPool:
+    """
+    Just enough HTTP/1.1 for fragment GETs, on asyncio streams. Connections
+    are kept alive and reused per host, and at most `limit` requests are in
+    flight at once. Bodies are read whole: fragments are a few MB.
+    """
+
+    def __init__(self, limit=16, timeout=(10, 60), bucket=None):
+        self.connect_timeout, self.read_timeout = timeout
+        # optional bandwidth.TokenBucket the received bytes are charged to
+        self.bucket = bucket
+        self._slots = asyncio.Semaphore(limit)
+        self._idle = {}
+        self._ssl = ssl.create_default_context()
+        self.connections_opened = 0
+
+    async def _open(self, scheme, host, port):
+        """Returns (reader, writer, number), the number tells connections apart."""
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port, ssl=self._ssl if scheme == "https" else None
+            ),
+            self.connect_timeout,
+        )
+        self.connections_opened += 1
+        return reader, writer, self.connections_opened
+
+    async def _read(self, awaitable):
+        return await asyncio.wait_for(awaitable, self.read_timeout)
+
+    async def _throttle(self, size):
+        if self.bucket is not None:
+            wait = self.bucket.reserve(size)
+            if wait:
+                await asyncio.sleep(wait)
+
+    async def _read_body(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self._read(reader.readline())).split(b";")[0], 16)
+                if size == 0:
+                    # trailers, up to the empty line
+                    while (await self._read(reader.readline())).strip():
+                        pass
+                    return bytes(body), True
+                body += await self._read(reader.readexactly(size))
+                await self._read(reader.readexactly(2))
+                await self._throttle(size)
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            body = bytearray()
+            while len(body) < length:
+                chunk = await self._read(
+                    reader.readexactly(min(READ_CHUNK, length - len(body)))
+                )
+                body += chunk
+                await self._throttle(len(chunk))
+            return bytes(body), True
+        # no length, the body ends with the connection
+        body = await self._read(reader.read())
+        await self._throttle(len(body))
+        return body, False
+
+    async def _exchange(self, reader, writer, path, host, headers):
+        lines = [f"GET {path} HTTP/1.1", f"Host: {host}"]
+        lines += [f"{key}: {value}" for key, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        try:
+            return await self._read_response(reader)
+        except (ValueError, IndexError) as err:
+            raise ProtocolError(f"malformed response for {path}: {err!r}") from err
+
+    async def _read_response(self, reader):
+        status_line = await self._read(reader.readline())
+        if not status_line:
+            raise ConnectionResetError("connection closed before the response")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = (await self._read(reader.readline())).decode("latin-1").strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        body, reusable = await self._read_body(reader, response_headers)
+        if response_headers.get("connection", "").lower() == "close":
+            reusable = False
+        return status, response_headers, body, reusable
+
+    async def get(self, url, headers=None, max_redirects=5, used=None):
+        """
+        Returns (status, headers, body, final url). The numbers of the
+        connections the request went over are added to the `used` set.
+        """
+
+        async with self._slots:
+            for _ in range(max_redirects + 1):
+                parts = urlsplit(url)
+                scheme = parts.scheme
+                port = parts.port or (443 if scheme == "https" else 80)
+                key = (scheme, parts.hostname, port)
+                path = parts.path or "/"
+                if parts.query:
+                    path += f"?{parts.query}"
+                request_headers = {
+                    "User-Agent": "rooster",
+                    "Accept": "*/*",
+                    "Connection": "keep-alive",
+                    **(headers or {}),
+                }
+
+                idle = self._idle.setdefault(key, [])
+                reused = bool(idle)
+                reader, writer, number = idle.pop() if reused else await self._open(*key)
+                try:
+                    status, response_headers, body, reusable = await self._exchange(
+                        reader, writer, path, parts.netloc, request_headers
+                    )
+                except (OSError, asyncio.IncompleteReadError, ProtocolError):
+                    writer.close()
+                    if not reused:
+                        raise
+                    # the server dropped the idle connection, once more on a new one
+                    reader, writer, number = await self._open(*key)
+                    try:
+                        status, response_headers, body, reusable = await self._exchange(
+                            reader, writer, path, parts.netloc, request_headers
+                        )
+                    except BaseException:
+                        writer.close()
+                        raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if used is not None:
+                    used.add(number)
+                if reusable:
+                    idle.append((reader, writer, number))
+                else:
+                    writer.close()
+
+                if status in (301, 302, 303, 307, 308) and "location" in response_headers:
+                    url = urljoin(url, response_headers["location"])
+                    continue
+                return status, response_headers, body, url
+            raise HlsError(f"too many redirects for {url}")
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+        self._idle.clear()
+
+
+class DownloadStats:
+    """Figures of one stream; streams downloaded together share the pool."""
+
+    def __init__(self):
+        self.fragments = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        # numbers of the pool connections this stream's requests went over
+        self.connections_used = set()
+
+    @property
+    def connections(self):
+        return len(self.connections_used)
+
+    @property
+    def size(self):
+        return sum(fragment.size for fragment in self.fragments)
+
+    @property
+    def retries(self):
+        return sum(max(0, fragment.attempts - 1) for fragment in self.fragments)
+
+    @property
+    def speed(self):
+        """MB/s over the whole download."""
+
+        if not self.elapsed:
+            return 0.0
+        return self.size / self.elapsed / 1024 / 1024
+
+    def summary(self):
+        times = sorted(fragment.elapsed for fragment in self.fragments) or [0.0]
+        p50 = times[len(times) // 2]
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        return (
+            f"{len(self.fragments)} fragments, {self.size / 1024 / 1024:.1f} MB in "
+            f"{self.elapsed:.1f}s ({self.speed:.1f} MB/s) over {self.connections} "
+            f"connections, {self.retries} retries, fragment p50 {p50:.2f}s "
+            f"p95 {p95:.2f}s max {times[-1]:.2f}s"
+        )
+
+
+class HlsDownloader:
+    """
+    Native HLS engine: the media playlists yt-dlp resolved are fetched
+    fragment by fragment with asyncio over `connections` keep-alive
+    connections. Fragments are written to their place in the output file
+    as soon as everything before them is there; at most `window` fragments
+    are downloaded ahead, which bounds the memory. Every fragment is
+    retried on its own, with backoff, up to `retries` times.
+    """
+
+    name = "native-hls"
+
+    def __init__(self, connections=16, retries=10, window=None):
+        self.connections = max(1, connections)
+        self.retries = retries
+        self.window = window or self.connections * 2
+
+    async def _fetch(self, pool, fragment, headers, used=None):
+        error = None
+        for attempt in range(1, self.retries + 2):
+            fragment.attempts = attempt
+            start = time.monotonic()
+            retry_after = 0
+            try:
+                status, response_headers, body, _ = await pool.get(
+                    fragment.url, headers={**headers, **fragment.headers()}, used=used
+                )
+                if status in (200, 206):
+                    if fragment.byterange is not None and status == 200:
+                        length, offset = fragment.byterange
+                        body = body[offset : offset + length]
+                    fragment.size = len(body)
+                    fragment.elapsed = time.monotonic() - start
+                    return body
+                try:
+                    retry_after = float(response_headers.get("retry-after", 0))
+                except ValueError:
+                    pass
+                error = HttpStatusError(status, fragment.url, retry_after)
+                if status not in RETRYABLE_STATUSES:
+                    raise error
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncio.IncompleteReadError,
+                ProtocolError,
+            ) as err:
+                error = err
+            if attempt > self.retries:
+                break
+            delay = min(10, 0.5 * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+            logging.debug(
+                f"HLS: fragment {fragment.index} attempt {attempt} failed ({error!r}), retrying"
+            )
+            await asyncio.sleep(max(delay, retry_after))
+        raise HlsError(f"fragment {fragment.index} failed after {fragment.attempts} attempts: {error!r}")
+
+    async def _download_playlist(self, pool, url, path, headers, stats):
+        stats.started = time.monotonic()
+        status, _, body, url = await pool.get(
+            url, headers=headers, used=stats.connections_used
+        )
+        if status != 200:
+            raise HttpStatusError(status, url)
+        try:
+            init, fragments = parse_media_playlist(body.decode("utf-8"), url)
+        except (ValueError, KeyError) as err:
+            raise HlsError(f"malformed playlist {url}: {err!r}") from err
+        ordered = ([init] if init else []) + fragments
+        stats.fragments.extend(ordered)
+
+        loop = asyncio.get_running_loop()
+        tasks = {}
+
+        def start(index):
+            if index < len(ordered):
+                tasks[index] = asyncio.ensure_future(
+                    self._fetch(pool, ordered[index], headers, stats.connections_used)
+                )
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            for index in range(self.window):
+                start(index)
+            offset = 0
+            for index in range(len(ordered)):
+                data = await tasks.pop(index)
+                start(index + self.window)
+                # the write happens off the loop so fragments keep arriving
+                await loop.run_in_executor(None, _pwrite_all, fd, data, offset)
+                offset += len(data)
+            # this stream is done, the others may still be going
+            stats.elapsed = time.monotonic() - stats.started
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            os.close(fd)
+
+    async def _download_all(self, jobs):
+        limiter = get_bandwidth_limiter()
+        pool = AsyncHttpPool(
+            limit=self.connections,
+            bucket=limiter.ingress if limiter.limits_ingress else None,
+        )
+        stats = [DownloadStats() for _ in jobs]
+        try:
+            await asyncio.gather(
+                *(
+                    self._download_playlist(pool, url, path, headers, job_stats)
+                    for (url, path, headers), job_stats in zip(jobs, stats)
+                )
+            )
+        finally:
+            await pool.close()
+        return stats
+
+    def download(self, jobs):
+        """
+        Downloads every (playlist url, path, headers) job at the same time,
+        sharing the connections. Returns a DownloadStats per job.
+        """
+
+        return asyncio.run(self._download_all(jobs))
+
+    def download_formats(self, formats, path, cookiejar=None):
+        """
+        Downloads the (HLS) formats yt-dlp selected and remuxes them with
+        ffmpeg into `path`, which only shows up once it's complete.
+        """
+
+        path = Path(path)
+        jobs = []
+        for format in formats:
+            if format.get("protocol") not in ("m3u8", "m3u8_native"):
+                raise UnsupportedPlaylist(f"{format.get('protocol')} format")
+            headers = dict(format.get("http_headers") or {})
+            if cookiejar is not None:
+                cookie = cookiejar.get_cookie_header(format["url"])
+                if cookie:
+                    headers["Cookie"] = cookie
+            part = path.with_name(f"{path.stem}.f{format['format_id']}.hls.part")
+            jobs.append((format["url"], part, headers))
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            stats = self.download(jobs)
+            for (_, part, _), job_stats in zip(jobs, stats):
+                summary = f"{part.name}: {job_stats.summary()}"
+                print(f"[{self.name}] {summary}")
+                logging.info(f"{self.name}: {summary}")
+            remux([part for _, part, _ in jobs], path)
+        finally:
+            for _, part, _ in jobs:
+                part.unlink(missing_ok=True)
+        return stats
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def remux(parts, path):
+    """Copies the streams of the downloaded parts into one file, no re-encoding."""
+
+    path = Path(path)
+    temp = path.with_name(f"{path.stem}.temp{path.suffix}")
+    command = ["ffmpeg", "-y", "-nostdin", "-loglevel", "error"]
+    for part in parts:
+        command += ["-i", str(part)]
+    for index in range(len(parts)):
+        command += ["-map", str(index)]
+    command += ["-c", "copy"]
+    if path.suffix in (".mp4", ".m4a", ".mov"):
+        # ADTS AAC from MPEG-TS needs this to go into an mp4
+        command += ["-bsf:a", "aac_adtstoasc"]
+    command.append(str(temp))
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError as err:
+        temp.unlink(missing_ok=True)
+        raise HlsError(f"ffmpeg remux failed: {err.stderr.decode(errors='replace')[-500:]}")
+    os.replace(temp, path)
+
+
+def _final_filename(ydl, info_dict):
+    # the name yt-dlp itself checks for an existing download, see
+    # YoutubeDL.process_info (correct_ext)
+    filename = ydl.prepare_filename(info_dict)
+    if info_dict.get("requested_formats") is None:
+        return Path(filename)
+    ext = ydl.params.get("merge_output_format") or info_dict["ext"]
+    base, real_ext = os.path.splitext(filename)
+    if real_ext[1:] not in (info_dict["ext"], ext):
+        base = filename
+    return Path(f"{base}.{ext}")
+
+
+def download_with_engine(ydl, info_dict, vod_url, engine):
+    """
+    Downloads the episode's selected formats with `engine` (the native HLS
+    engine or the aria2c daemon) into the file yt-dlp would write. yt-dlp
+    then finds the video already downloaded and only writes the sidecar
+    files and the archive entry. Anything the engine can't do is left to
+    yt-dlp. Returns the info dict to hand to ydl.process_ie_result.
+    """
+
+    if info_dict is None:
+        info_dict = ydl.extract_info(vod_url, download=False)
+    if info_dict is None or ydl.in_download_archive(info_dict):
+        return info_dict
+    path = _final_filename(ydl, info_dict)
+    if path.exists():
+        return info_dict
+
+    formats = info_dict.get("requested_formats") or [info_dict]
+    try:
+        engine.download_formats(formats, path, ydl.cookiejar)
+    except UnsupportedPlaylist as err:
+        logging.info(f"{engine.name}: {vod_url} goes to yt-dlp - {err}")
+    except (HlsError, OSError) as err:
+        print(f"{engine.name} download failed, retrying with yt-dlp: {err}")
+        logging.warning(f"{engine.name}: download of {vod_url} failed - {err}")
+    return info_dict
+
+
+_downloader = None
+_downloader_lock = threading.Lock()
+_settings = {"enabled": False, "connections": 16, "retries": 10, "download_jobs": 1}
+
+
+def configure_hls(enabled=False, connections=16, retries=10, download_jobs=1):
+    """
+    `connections` is for the whole run: every episode opens its own pool,
+    so each of the `download_jobs` episodes downloading at once gets a share.
+    """
+
+    _settings["enabled"] = enabled
+    _settings["connections"] = max(1, connections)
+    _settings["retries"] = max(0, retries)
+    _settings["download_jobs"] = max(1, download_jobs)
+
+
+def use_native_hls() -> bool:
+    return _settings["enabled"]
+
+
+def get_hls_downloader() -> HlsDownloader:
+    global _downloader
+    with _downloader_lock:
+        if _downloader is None:
+            _downloader = HlsDownloader(
+                connections=max(1, _settings["connections"] // _settings["download_jobs"]),
+                retries=_settings["retries"],
+            )
+        return _downloader
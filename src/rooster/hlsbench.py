@@ -0,0 +1,181 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yt_dlp
+
+from .aria import AriaDaemon
+from .hls import HlsDownloader
+
+MB = 1024 * 1024
+
+
+class HlsTestServer:
+    """
+    Local HLS server: one media playlist of `fragments` fragments of
+    `fragment_size` bytes, served with HTTP/1.1 keep-alive. `latency`
+    seconds are added to every fragment to stand in for a far away CDN.
+    """
+
+    def __init__(self, fragments=200, fragment_size=2 * MB, latency=0.0):
+        self.fragments = fragments
+        self.latency = latency
+        self.payload = os.urandom(fragment_size)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.playlist = "\n".join(
+            ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4"]
+            + [f"#EXTINF:4.0,\nseg{index}.ts" for index in range(fragments)]
+            + ["#EXT-X-ENDLIST", ""]
+        ).encode()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if self.path.endswith(".m3u8"):
+                    body, content_type = server.playlist, "application/vnd.apple.mpegurl"
+                elif self.path.startswith("/seg"):
+                    time.sleep(server.latency)
+                    body, content_type = server.payload, "video/mp2t"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="hls-server", daemon=True
+        )
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._httpd.server_port}/index.m3u8"
+
+    @property
+    def total_size(self):
+        return self.fragments * len(self.payload)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def run_native(url, directory, connections):
+    path = Path(directory) / "native.ts"
+    HlsDownloader(connections=connections).download([(url, path, {})])
+    return path
+
+
+def run_aria_daemon(url, directory, connections):
+    path = Path(directory) / "aria2c-rpc.ts"
+    daemon = AriaDaemon(max_downloads=connections)
+    try:
+        daemon.download_hls(url, path, {})
+    finally:
+        daemon.shutdown()
+    return path
+
+
+def run_ytdlp(url, directory, connections, use_aria=False):
+    options = {
+        "outtmpl": str(Path(directory) / ("aria2c.%(ext)s" if use_aria else "yt-dlp.%(ext)s")),
+        "quiet": True,
+        "noprogress": True,
+        "fixup": "never",
+        "concurrent_fragment_downloads": connections,
+    }
+    if use_aria:
+        # same arguments as get_video_options
+        options["external_downloader"] = "aria2c"
+        options["external_downloader_args"] = ["-j", "16", "-x", "16", "-s", "16"]
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=True)
+        return Path(ydl.prepare_filename(info))
+
+
+def bench(engines, fragments, fragment_size, latency, connections):
+    results = []
+    with HlsTestServer(fragments, fragment_size, latency) as server:
+        print(
+            f"Serving {fragments} fragments of {fragment_size / MB:.1f} MB "
+            f"({server.total_size / MB:.0f} MB) with {latency * 1000:.0f} ms latency"
+        )
+        for engine in engines:
+            if engine.startswith("aria2c") and shutil.which("aria2c") is None:
+                print(f"{engine}: aria2c not installed, skipped")
+                continue
+            with tempfile.TemporaryDirectory(prefix="rooster-hls-bench-") as directory:
+                start = time.monotonic()
+                if engine == "native":
+                    path = run_native(server.url, directory, connections)
+                elif engine == "aria2c-rpc":
+                    path = run_aria_daemon(server.url, directory, connections)
+                else:
+                    path = run_ytdlp(
+                        server.url, directory, connections, use_aria=engine == "aria2c"
+                    )
+                elapsed = time.monotonic() - start
+                size = path.stat().st_size if path.exists() else 0
+            status = "ok" if size == server.total_size else f"WRONG SIZE {size}"
+            speed = size / elapsed / MB if elapsed else 0.0
+            print(f"{engine:>10}: {elapsed:6.2f}s {speed:8.1f} MB/s {status}")
+            results.append((engine, elapsed, speed, status))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the HLS download engines against a local HLS server"
+    )
+    parser.add_argument(
+        "--engines",
+        default="native,yt-dlp,aria2c,aria2c-rpc",
+        help="Comma separated, from native, yt-dlp, aria2c, aria2c-rpc (default all)",
+    )
+    parser.add_argument("--fragments", default=200, type=int, help="Default is 200")
+    parser.add_argument(
+        "--fragment-size", default=2.0, type=float, metavar="MB", help="Default is 2"
+    )
+    parser.add_argument(
+        "--latency",
+        default=0.0,
+        type=float,
+        metavar="MS",
+        help="Added to every fragment response (default is 0)",
+    )
+    parser.add_argument(
+        "--connections", default=16, type=int, help="Concurrent fragments (default is 16)"
+    )
+    args = parser.parse_args()
+    bench(
+        [engine.strip() for engine in args.engines.split(",") if engine.strip()],
+        args.fragments,
+        int(args.fragment_size * MB),
+        args.latency / 1000,
+        args.connections,
+    )
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,199 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import internetarchive
+
+from .client import get_http_client
+from .plan import iter_batches, normalize_link
+from .state import get_state_store
+
+SEARCH_URL = "https://archive.org/advancedsearch.php"
+# the page url every rooster upload records as originalurl
+ORIGINAL_URL = "https://roosterteeth.com/watch/{slug}"
+
+
+def get_numerical_id(episode_id, episode_type) -> str:
+    """The id an episode is uploaded under, bonus features get a -bonus suffix."""
+    if episode_type == "bonus_feature":
+        return f"{episode_id}-bonus"
+    return episode_id
+
+
+def get_identifier_from_id(episode_id) -> str:
+    return f"roosterteeth-{episode_id}"
+
+
+class _Gathering:
+    """Identifiers waiting for the same search in IAExistenceCache.exists."""
+
+    def __init__(self):
+        self.identifiers = set()
+        self.done = threading.Event()
+
+
+class IAExistenceCache:
+    """
+    Which roosterteeth-{id} items exist on archive.org, for the whole run.
+    Items are looked up in batches with advancedsearch (an OR query of up
+    to 250 values per request, several requests at once) instead of one
+    full item metadata GET per episode:
+    - prefetch_links looks the links up as they stream in: by identifier
+      when the episode id is known from an earlier run, otherwise by the
+      episode page url the item was uploaded with (originalurl)
+    - exists() calls for items that are still unknown once the metadata is
+      resolved wait GATHER_SECONDS for the other workers' calls, then one
+      search answers all of them
+    Only identifiers whose search failed fall back to
+    internetarchive.get_item.
+    """
+
+    BATCH = 250
+    GATHER_SECONDS = 0.3
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._known = {}
+        self._gathering = None
+        self._lock = threading.Lock()
+        self.http = get_http_client()
+
+    def _search(self, field, values):
+        """Docs (identifier, originalurl) of the items with `field` in `values`."""
+
+        terms = " OR ".join(f'"{value}"' for value in values)
+        response = self.http.get(
+            SEARCH_URL,
+            params={
+                "q": f"{field}:({terms})",
+                "fl[]": ["identifier", "originalurl"],
+                "rows": len(values) * 2,
+                "page": 1,
+                "output": "json",
+            },
+            timeout=60,
+        )
+        response.raise_for_status()
+        return response.json()["response"]["docs"]
+
+    def _prefetch_batch(self, identifiers):
+        try:
+            found = {doc["identifier"] for doc in self._search("identifier", identifiers)}
+        except (requests.RequestException, ValueError, KeyError) as err:
+            logging.warning(f"IA search for {len(identifiers)} items failed: {err}")
+            return
+        with self._lock:
+            for identifier in identifiers:
+                self._known[identifier] = identifier in found
+
+    def _prefetch_slug_batch(self, slugs):
+        # only tells which items exist: one that was uploaded without this
+        # originalurl isn't proof of a missing item
+        urls = [ORIGINAL_URL.format(slug=slug) for slug in slugs]
+        try:
+            docs = self._search("originalurl", urls)
+        except (requests.RequestException, ValueError, KeyError) as err:
+            logging.warning(f"IA search for {len(urls)} episode urls failed: {err}")
+            return
+        with self._lock:
+            for doc in docs:
+                self._known[doc["identifier"]] = True
+
+    def _run_batches(self, func, values, what):
+        batches = [values[i : i + self.BATCH] for i in range(0, len(values), self.BATCH)]
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="ia-search"
+        ) as executor:
+            list(executor.map(func, batches))
+        logging.info(f"IA: looked up {len(values)} {what} in {len(batches)} searches")
+
+    def prefetch(self, identifiers):
+        """Looks up every identifier that isn't known yet."""
+
+        with self._lock:
+            todo = list(dict.fromkeys(i for i in identifiers if i not in self._known))
+        if todo:
+            self._run_batches(self._prefetch_batch, todo, "items")
+
+    def prefetch_slugs(self, slugs):
+        """Finds the items uploaded for these episode slugs, by their originalurl."""
+
+        todo = list(dict.fromkeys(slugs))
+        if todo:
+            self._run_batches(self._prefetch_slug_batch, todo, "episode urls")
+
+    def prefetch_links(self, links):
+        """
+        Passes the links through unchanged, looking up their items batch by
+        batch as they come in (see plan.iter_batches). Works on lists and on
+        series links that are still being listed.
+        """
+
+        store = get_state_store()
+        for batch in iter_batches(links, self.BATCH):
+            self._prefetch_links_batch(store, batch)
+            yield from batch
+
+    def _prefetch_links_batch(self, store, links):
+        slugs = [normalize_link(link)[1] for link in links]
+        try:
+            known = store.lookup(slugs)
+        except Exception as err:
+            logging.warning(f"IA: could not read episode ids from the state store - {err}")
+            known = {}
+        self.prefetch(
+            get_identifier_from_id(episode_id)
+            for _, episode_id in known.values()
+            if episode_id
+        )
+        self.prefetch_slugs(slug for slug in slugs if not known.get(slug, (None, None))[1])
+
+    def exists(self, identifier) -> bool:
+        with self._lock:
+            if identifier in self._known:
+                return self._known[identifier]
+            gathering = self._gathering
+            leader = gathering is None
+            if leader:
+                gathering = self._gathering = _Gathering()
+            gathering.identifiers.add(identifier)
+            if len(gathering.identifiers) >= self.BATCH:
+                self._gathering = None
+        if leader:
+            try:
+                # workers that resolve their episode meanwhile join this search
+                time.sleep(self.GATHER_SECONDS)
+                with self._lock:
+                    if self._gathering is gathering:
+                        self._gathering = None
+                self._prefetch_batch(sorted(gathering.identifiers))
+            finally:
+                gathering.done.set()
+        else:
+            gathering.done.wait()
+
+        with self._lock:
+            if identifier in self._known:
+                return self._known[identifier]
+        # the search failed
+        exists = internetarchive.get_item(identifier).exists
+        self.set_exists(identifier, exists)
+        return exists
+
+    def set_exists(self, identifier, exists=True):
+        with self._lock:
+            self._known[identifier] = exists
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ia_existence_cache() -> IAExistenceCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = IAExistenceCache()
+        return _cache
@@ -1,12 +1,38 @@
 #!/usr/bin/python3 -B
-from .downloader import show_stuff
+from .downloader import show_stuff, is_tool, bcolors
+from .pipeline import make_episode_pipeline
 import argparse
 import logging
+import internetarchive
 import os
 import validators
 from .parser import RoosterTeethParser
+from .session import get_rooster_session
+from .cache import configure_metadata_cache
+from .resolver import configure_resolver
+from .state import get_state_store, DONE_STATUSES
+from .plan import LinkPlanner, plan_links
+from .slugindex import get_slug_index
+from .iaexists import get_ia_existence_cache
+from .metaupdate import BulkMetadataUpdater, configure_metadata_updates
+from .upload import configure_uploads
+from .multipart import configure_multipart
+from .hls import configure_hls
+from .aria import configure_aria, shutdown_aria_daemon
+from .adaptive import configure_adaptive_fragments
+from .bandwidth import configure_bandwidth
+from .workers import (
+    SlugRegistry,
+    get_slug_from_link,
+    print_summary,
+    run_episode_pool,
+    unique_links,
+)
 from pathlib import Path
+import itertools
 import random
+import sqlite3
+import time
 
 
 log_dir = Path.cwd() / "logs"
@@ -14,32 +40,151 @@ if not os.path.exists(log_dir):
     os.makedirs(log_dir)
 
 
-def load_slugs_from_downloaded_log():
-    downloaded_log_path = Path.cwd() / "logs" / "downloaded.log"
-    slugs = set()
-
-    if os.path.isfile(downloaded_log_path):
+def load_slugs_from_downloaded_log(rebuild_index=False):
+    # imports whatever is new in logs/downloaded.log & co. into the state store,
+    # then opens the on-disk slug index instead of loading every slug
+    try:
+        slugs = get_slug_index(rebuild=rebuild_index)
+    except (sqlite3.Error, OSError) as err:
+        logging.warning(f"Error for loading slug index: {err}")
         try:
-            with open(downloaded_log_path, "r") as f:
-                for line in f:
-                    slugs.add(
-                        line.strip()
-                    )  # Assuming each line in the log file represents a slug
-        except (FileNotFoundError, IOError) as err:
-            logging.warning("Error for opening Slugs: {err}")
-            pass
-    print("Loaded all previously downloaded slug...")
+            slugs = SlugRegistry(set(get_state_store().iter_slugs(DONE_STATUSES)))
+        except sqlite3.Error as err:
+            logging.warning(f"Error for loading Slugs: {err}")
+            slugs = SlugRegistry(set())
+    print(f"Loaded {len(slugs)} previously downloaded slugs...")
     return slugs
 
 
 logging.basicConfig(
     filename="logs/rooster.log",
     filemode="a",
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(name)s - %(threadName)s - %(levelname)s - %(message)s",
     level=logging.DEBUG,
 )
 
 
+def make_episode_handler(
+    username,
+    password,
+    num_links,
+    concurrent_fragments,
+    fast_check,
+    use_aria,
+    fn_mode,
+    fragment_retries,
+    fragment_abort,
+    total_slugs,
+    ignore_existing,
+    keep_after_upload,
+    update_metadata,
+):
+    def handle_episode(index, link):
+        print(f"Downloading link {index} of {num_links}: {link}")
+        status = show_stuff(
+            username,
+            password,
+            link,
+            concurrent_fragments,
+            fast_check,
+            use_aria,
+            fn_mode,
+            fragment_retries,
+            fragment_abort,
+            total_slugs,
+            ignore_existing,
+            keep_after_upload,
+            update_metadata,
+        )
+        if status == "downloaded":
+            total_slugs.add(get_slug_from_link(link))
+        return status
+
+    return handle_episode
+
+
+def run_links(
+    username,
+    password,
+    links,
+    num_links,
+    concurrent_fragments,
+    fast_check,
+    use_aria,
+    fn_mode,
+    fragment_retries,
+    fragment_abort,
+    total_slugs,
+    ignore_existing,
+    keep_after_upload,
+    update_metadata,
+    jobs,
+    pipeline_settings,
+    source=None,
+):
+    """
+    Processes the links either on the episode worker pool or, when
+    pipeline_settings is given, on the staged download/upload pipeline.
+    --update-meta runs go to the bulk metadata updater instead.
+    """
+
+    if update_metadata:
+        # metadata updates want the done ones too, no planning. Every item
+        # is fetched whole for its metadata anyway, no existence prefetch
+        updater = BulkMetadataUpdater(username, password, jobs=jobs)
+        links = unique_links(links)
+        start_time = time.monotonic()
+        results = updater.run(links)
+        print_summary(results, time.monotonic() - start_time, source)
+        return results
+
+    # drop everything that's already done before touching the network
+    planner = None
+    if isinstance(links, list):
+        links = plan_links(links, fast_check)
+        num_links = len(links)
+    else:
+        # series still being listed, filter the links as they come in
+        planner = LinkPlanner(fast_check)
+        links = planner.filter(links)
+
+    # look up which items already exist on archive.org in a few batched
+    # searches, for every link whose episode id is known from earlier runs
+    if fn_mode == "ia" and not ignore_existing:
+        links = get_ia_existence_cache().prefetch_links(links)
+        if isinstance(num_links, int):
+            links = list(links)
+
+    show_args = (
+        username,
+        password,
+        num_links,
+        concurrent_fragments,
+        fast_check,
+        use_aria,
+        fn_mode,
+        fragment_retries,
+        fragment_abort,
+        total_slugs,
+        ignore_existing,
+        keep_after_upload,
+        update_metadata,
+    )
+    start_time = time.monotonic()
+    if pipeline_settings:
+        pipeline = make_episode_pipeline(
+            *show_args, download_jobs=jobs, **pipeline_settings
+        )
+        results = pipeline.run(links)
+    else:
+        handler = make_episode_handler(*show_args)
+        results = run_episode_pool(links, jobs, handler)
+    if planner is not None:
+        planner.report()
+    print_summary(results, time.monotonic() - start_time, source)
+    return results
+
+
 def process_links_from_file(
     username,
     password,
@@ -55,39 +200,35 @@ def process_links_from_file(
     keep_after_upload,
     update_metadata,
     randomize,
+    jobs=1,
+    pipeline_settings=None,
 ):
     with open(filename, "r") as file:
-        links = file.readlines()
+        links = [line.strip() for line in file if line.strip()]
         num_links = len(links)
         print(f"Found {num_links} links.")
         if randomize:
             print(f"Shuffling the list of {num_links} links. *shakes very violently*")
             random.shuffle(links)
 
-    for index, line in enumerate(links, start=1):
-        print(f"Downloading link {index} of {num_links}: {line.strip()}")
-        try:
-            show_stuff(
-                username,
-                password,
-                line.strip(),
-                concurrent_fragments,
-                fast_check,
-                use_aria,
-                fn_mode,
-                fragment_retries,
-                fragment_abort,
-                total_slugs,
-                ignore_existing,
-                keep_after_upload,
-                update_metadata,
-            )
-        except Exception as e:
-            # Log the exception
-            print(f"Error occurred while processing link {index}: {line.strip()}")
-            logging.critical(
-                f"{e} - Error occurred while processing link {index}: {line.strip()}"
-            )
+    run_links(
+        username,
+        password,
+        links,
+        num_links,
+        concurrent_fragments,
+        fast_check,
+        use_aria,
+        fn_mode,
+        fragment_retries,
+        fragment_abort,
+        total_slugs,
+        ignore_existing,
+        keep_after_upload,
+        update_metadata,
+        jobs,
+        pipeline_settings,
+    )
 
 
 def process_links_from_list(
@@ -106,41 +247,49 @@ def process_links_from_list(
     keep_after_upload,
     update_metadata,
     randomize,
+    jobs=1,
+    pipeline_settings=None,
 ):
-    num_links = len(episode_links)
     if randomize:
-        print(f"Shuffling the list of {num_links} links. *shakes very violently*")
+        episode_links = list(episode_links)
+        print(
+            f"Shuffling the list of {len(episode_links)} links. *shakes very violently*"
+        )
         random.shuffle(episode_links)
-
-    for index, episode in enumerate(episode_links):
-        print(f"Downloading link {index+1} of {num_links}: {episode}")
-        try:
-            show_stuff(
-                username,
-                password,
-                episode,
-                concurrent_fragments,
-                fast_check,
-                use_aria,
-                fn_mode,
-                fragment_retries,
-                fragment_abort,
-                total_slugs,
-                ignore_existing,
-                keep_after_upload,
-                update_metadata,
-            )
-        except Exception as e:
-            # Log the exception
-            print(
-                f"{e} Error occurred while processing link {index+1}: {episode} | Input : {input_value}"
-            )
-            logging.critical(
-                f"{e} Error occurred while processing link {index+1}: {episode} | Input: {input_value}"
-            )
+    # episode_links can also be a generator still listing the series
+    num_links = len(episode_links) if isinstance(episode_links, list) else "?"
+
+    results = run_links(
+        username,
+        password,
+        episode_links,
+        num_links,
+        concurrent_fragments,
+        fast_check,
+        use_aria,
+        fn_mode,
+        fragment_retries,
+        fragment_abort,
+        total_slugs,
+        ignore_existing,
+        keep_after_upload,
+        update_metadata,
+        jobs,
+        pipeline_settings,
+        source=input_value,
+    )
+    return results
 
 
 def main():
+    try:
+        return run()
+    finally:
+        # the daemon is shared by every episode, stop it once they are all done
+        shutdown_aria_daemon()
+
+
+def run():
     parser = argparse.ArgumentParser(description="Process command line arguments")
 
     parser.add_argument("--email", help="Email for authentication")
@@ -176,6 +325,44 @@ def main():
         action="store_true",
         help="Use aria2c as downloader if it exists in system",
     )
+    parser.add_argument(
+        "--adaptive-fragments",
+        action="store_true",
+        help="Tune the concurrent fragments per CDN host from throughput and errors, starting at --concurrent-fragments",
+    )
+    parser.add_argument(
+        "--max-concurrent-fragments",
+        default=32,
+        type=int,
+        help="Upper bound for --adaptive-fragments (default is 32)",
+    )
+    parser.add_argument(
+        "--aria-daemon",
+        action="store_true",
+        help="Download through one aria2c daemon shared by all workers (over RPC)",
+    )
+    parser.add_argument(
+        "--aria-downloads",
+        default=16,
+        type=int,
+        help="Fragments/files the aria2c daemon downloads at once, for all workers (default is 16)",
+    )
+    parser.add_argument(
+        "--aria-speed-limit",
+        default=None,
+        help="Overall download limit of the aria2c daemon, e.g. 50M (default is unlimited)",
+    )
+    parser.add_argument(
+        "--native-hls",
+        action="store_true",
+        help="Download HLS fragments with rooster's own asyncio engine instead of yt-dlp's",
+    )
+    parser.add_argument(
+        "--hls-connections",
+        default=None,
+        type=int,
+        help="Connections of the native HLS engine, split between the --jobs (default is --concurrent-fragments)",
+    )
     parser.add_argument(
         "--i",
         action="store_true",
@@ -212,6 +399,131 @@ def main():
         help="Randomize the links on runs if a txt file/series/season is provided",
     )
 
+    parser.add_argument(
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of episodes to process at once (default is 1)",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run metadata, download, post-processing and upload as separate stages",
+    )
+    parser.add_argument(
+        "--metadata-jobs",
+        default=2,
+        type=int,
+        help="Metadata workers in --pipeline mode (default is 2)",
+    )
+    parser.add_argument(
+        "--upload-jobs",
+        default=1,
+        type=int,
+        help="Upload workers in --pipeline mode (default is 1)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        default=2,
+        type=int,
+        help="Episodes waiting between two --pipeline stages (default is 2)",
+    )
+
+    parser.add_argument(
+        "--refresh-metadata",
+        action="store_true",
+        help="Ignore cached episode metadata and fetch it again",
+    )
+    parser.add_argument(
+        "--no-metadata-cache",
+        action="store_true",
+        help="Don't read or write the local episode metadata cache",
+    )
+
+    parser.add_argument(
+        "--hedge-metadata",
+        default=None,
+        type=float,
+        metavar="SECONDS",
+        help="Start the API metadata sources if yt-dlp hasn't answered after SECONDS (0 starts all at once)",
+    )
+
+    parser.add_argument(
+        "--ia-upload-jobs",
+        default=4,
+        type=int,
+        help="Files uploaded to IA at once, shared by all episodes (default is 4)",
+    )
+    parser.add_argument(
+        "--ia-upload-retries",
+        default=5,
+        type=int,
+        help="Attempts per file before an IA upload is given up (default is 5)",
+    )
+
+    parser.add_argument(
+        "--meta-write-jobs",
+        default=4,
+        type=int,
+        help="Items written at once in --update-meta runs (default is 4)",
+    )
+    parser.add_argument(
+        "--meta-write-rate",
+        default=2.0,
+        type=float,
+        help="Most metadata writes per second in --update-meta runs (default is 2)",
+    )
+
+    parser.add_argument(
+        "--multipart",
+        action="store_true",
+        help="Upload large files to IA as resumable S3 multipart uploads",
+    )
+    parser.add_argument(
+        "--multipart-threshold",
+        default=1024,
+        type=int,
+        metavar="MB",
+        help="Files from this size on use multipart uploads (default is 1024)",
+    )
+    parser.add_argument(
+        "--multipart-part-size",
+        default=100,
+        type=int,
+        metavar="MB",
+        help="Size of one multipart part (default is 100)",
+    )
+    parser.add_argument(
+        "--multipart-jobs",
+        default=4,
+        type=int,
+        help="Parts uploaded at once (default is 4)",
+    )
+    parser.add_argument(
+        "--s3-endpoint",
+        default=None,
+        help="S3 endpoint for multipart uploads (default is https://s3.us.archive.org)",
+    )
+
+    parser.add_argument(
+        "--limit-download",
+        default=None,
+        metavar="SCHEDULE",
+        help="Total download speed of the run, e.g. 50M or 400Mbit, with time windows like 80M,09:00-18:00=30M",
+    )
+    parser.add_argument(
+        "--limit-upload",
+        default=None,
+        metavar="SCHEDULE",
+        help="Total IA upload speed of the run, same format as --limit-download",
+    )
+
+    parser.add_argument(
+        "--rebuild-slug-index",
+        action="store_true",
+        help="Rebuild logs/downloaded.bloom from the state store and downloaded.log",
+    )
+
     parser.add_argument("input", help="URL or file containing list of links")
 
     args = parser.parse_args()
@@ -233,6 +545,14 @@ def main():
     keep_after_upload = args.keep_uploads
     update_metadata = args.update_meta
     randomize = args.random
+    jobs = max(1, args.jobs)
+    pipeline_settings = None
+    if args.pipeline:
+        pipeline_settings = {
+            "metadata_jobs": args.metadata_jobs,
+            "upload_jobs": args.upload_jobs,
+            "queue_size": args.queue_size,
+        }
 
     if show_flag:
         fn_mode = "show"
@@ -240,12 +560,64 @@ def main():
         fn_mode = "archivist"
     elif upload_to_ia:
         fn_mode = "ia"
-        print(
-            "\033[91mUpload to IA is disabled. Please use --show / --archivist mode. Exiting...\033[0m"
-        )
+        ia_session = internetarchive.get_session()
+        if not ia_session.access_key or not ia_session.secret_key:
+            print(
+                "\033[91m`internetarchive` is not configured, run `ia configure` first. Exiting...\033[0m"
+            )
+            exit()
+
+    # yt-dlp needs it to merge the streams, metadata updates don't download
+    if not update_metadata and not is_tool("ffmpeg"):
+        print(f"{bcolors.WARNING}ffmpeg not installed, go do that{bcolors.ENDC}")
         exit()
 
-    total_slugs = load_slugs_from_downloaded_log()
+    configure_metadata_cache(
+        enabled=not args.no_metadata_cache, refresh=args.refresh_metadata
+    )
+    configure_resolver(
+        hedge_delay=args.hedge_metadata,
+        jobs=max(jobs, args.metadata_jobs if args.pipeline else 1),
+    )
+    configure_uploads(
+        max_workers=args.ia_upload_jobs, max_attempts=args.ia_upload_retries
+    )
+    configure_metadata_updates(
+        write_jobs=args.meta_write_jobs, write_rate=args.meta_write_rate
+    )
+    configure_multipart(
+        enabled=args.multipart,
+        endpoint=args.s3_endpoint,
+        threshold_mb=args.multipart_threshold,
+        part_size_mb=args.multipart_part_size,
+        max_workers=args.multipart_jobs,
+    )
+    try:
+        configure_bandwidth(
+            ingress=args.limit_download, egress=args.limit_upload, download_jobs=jobs
+        )
+    except ValueError as err:
+        parser.error(str(err))
+    configure_hls(
+        enabled=args.native_hls,
+        connections=args.hls_connections or concurrent_fragments,
+        retries=fragment_retries,
+        download_jobs=jobs,
+    )
+    configure_adaptive_fragments(
+        enabled=args.adaptive_fragments,
+        initial=concurrent_fragments,
+        maximum=args.max_concurrent_fragments,
+    )
+    if args.aria_daemon and not is_tool("aria2c"):
+        print(f"{bcolors.WARNING}aria2c not installed, downloading with yt-dlp{bcolors.ENDC}")
+    configure_aria(
+        enabled=args.aria_daemon and is_tool("aria2c"),
+        max_downloads=args.aria_downloads,
+        speed_limit=args.aria_speed_limit,
+        max_tries=fragment_retries,
+    )
+    total_slugs = load_slugs_from_downloaded_log(rebuild_index=args.rebuild_slug_index)
 
     if input_value.endswith(".txt"):
         process_links_from_file(
@@ -263,14 +635,27 @@ def main():
             keep_after_upload,
             update_metadata,
             randomize,
+            jobs,
+            pipeline_settings,
         )
     else:
         input_value = input_value.strip()
         if validators.url(input_value):
             url_parts = input_value.split("/")
             if "roosterteeth.com" in url_parts and "series" in url_parts:
-                parser = RoosterTeethParser()
-                episode_links = parser.get_episode_links(input_value)
+                parser = RoosterTeethParser(
+                    session=get_rooster_session(username, password)
+                )
+                if randomize:
+                    episode_links = parser.get_episode_links(input_value)
+                else:
+                    # start downloading while the rest of the series is listed
+                    episode_links = parser.iter_episode_links(input_value)
+                    first_link = next(episode_links, None)
+                    if first_link is None:
+                        episode_links = None
+                    else:
+                        episode_links = itertools.chain([first_link], episode_links)
                 if episode_links is not None:
                     process_links_from_list(
                         username,
@@ -288,6 +673,8 @@ def main():
                         keep_after_upload,
                         update_metadata,
                         randomize,
+                        jobs,
+                        pipeline_settings,
                     )
                 else:
                     print(
@@ -0,0 +1,160 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import internetarchive
+
+from .downloader import (
+    bcolors,
+    generate_ia_meta,
+    get_itemname,
+    get_metadata_sources,
+)
+from .cache import get_cached_episode_data, save_episode_data_to_cache
+from .resolver import resolve_first
+from .state import get_state_store
+from .workers import get_slug_from_link, run_episode_pool
+
+# yt-dlp is the slowest source and isn't needed for metadata only
+SOURCE_ORDER = ("rt-api", "workers-api", "yt-dlp")
+
+_settings = {"write_jobs": 4, "write_rate": 2.0}
+
+
+def configure_metadata_updates(write_jobs=4, write_rate=2.0):
+    _settings["write_jobs"] = max(1, write_jobs)
+    _settings["write_rate"] = write_rate
+
+
+class RateLimiter:
+    """Lets at most `rate` calls per second through, shared by all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _ia_value(value):
+    """How a value we send ends up looking in the item metadata."""
+
+    if isinstance(value, list):
+        return ";".join(_ia_value(v) for v in value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def diff_metadata(wanted, current):
+    """
+    Returns the keys of `wanted` whose value differs from the item's. Keys
+    are compared ignoring case (metadata sent as upload headers comes back
+    lowercase, `originalurl`), and a changed key keeps the item's spelling
+    so the write replaces the value instead of adding a second key.
+    """
+
+    current_keys = {key.lower(): key for key in current}
+    changed = {}
+    for key, value in wanted.items():
+        current_key = current_keys.get(key.lower(), key)
+        have = current.get(current_key)
+        key = current_key
+        if have is None:
+            changed[key] = value
+        elif isinstance(value, bool):
+            if _ia_value(have).lower() != _ia_value(value):
+                changed[key] = value
+        elif _ia_value(have) != _ia_value(value):
+            changed[key] = value
+    return changed
+
+
+class BulkMetadataUpdater:
+    """
+    --update-meta for many items at once. Metadata is resolved from the
+    local cache or the APIs in parallel, the wanted metadata is compared
+    with what the item has, and only items that differ are written,
+    `write_jobs` at a time and at most `write_rate` writes a second.
+    """
+
+    def __init__(self, username, password, jobs=1, write_jobs=None, write_rate=None):
+        self.username = username
+        self.password = password
+        self.jobs = jobs
+        self.limiter = RateLimiter(write_rate or _settings["write_rate"])
+        self._writer = ThreadPoolExecutor(
+            max_workers=write_jobs or _settings["write_jobs"],
+            thread_name_prefix="meta-write",
+        )
+        self._writes = {}
+        self._writes_lock = threading.Lock()
+
+    def _resolve(self, link):
+        slug = get_slug_from_link(link)
+        episode_data = get_cached_episode_data(slug)
+        if episode_data is not None:
+            return episode_data
+        sources = dict(get_metadata_sources(self.username, self.password, link))
+        episode_data, _ = resolve_first([(name, sources[name]) for name in SOURCE_ORDER])
+        if episode_data is not None:
+            save_episode_data_to_cache(slug, episode_data)
+            try:
+                get_state_store().mark_resolved(slug, episode_data["id_numerical"])
+            except Exception as ex:
+                logging.warning(f"State Store: could not save {slug} - {ex}")
+        return episode_data
+
+    def _check(self, index, link):
+        episode_data = self._resolve(link)
+        if episode_data is None:
+            print(f"{bcolors.FAIL}No metadata for {link}, skipping{bcolors.ENDC}")
+            return "failed"
+
+        wanted = generate_ia_meta(episode_data)
+        wanted.pop("mediatype")
+        wanted.pop("collection")
+        item = internetarchive.get_item(get_itemname(episode_data))
+        if not item.exists:
+            print(
+                f"{bcolors.WARNING}Item doesn't exist yet, can't update metadata for {link}{bcolors.ENDC}"
+            )
+            return "missing"
+
+        changed = diff_metadata(wanted, item.metadata)
+        if not changed:
+            return "unchanged"
+        print(f"{item.identifier}: {', '.join(sorted(changed))} changed")
+        future = self._writer.submit(self._write, item, changed)
+        with self._writes_lock:
+            self._writes[link] = future
+        return "queued"
+
+    def _write(self, item, changed):
+        self.limiter.wait()
+        try:
+            r = item.modify_metadata(metadata=changed)
+        except Exception as e:
+            print(f"{item.identifier}: metadata update failed - {e}")
+            logging.critical(f"Metadata update failed for {item.identifier} - {e}")
+            return "failed"
+        if r.status_code == 200:
+            return "updated"
+        print(f"{item.identifier}: metadata update failed - {r.status_code} {r.text[:200]}")
+        logging.critical(f"Metadata update failed for {item.identifier} - {r.status_code}")
+        return "failed"
+
+    def run(self, links):
+        results = run_episode_pool(links, self.jobs, self._check)
+        for link, future in self._writes.items():
+            results[link] = future.result()
+        self._writer.shutdown()
+        return results
@@ -0,0 +1,286 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import quote
+from xml.etree import ElementTree
+
+import requests
+import internetarchive
+from internetarchive.iarequest import S3PreparedRequest
+
+from .bandwidth import get_bandwidth_limiter
+from .client import get_http_client
+from .state import get_state_store
+
+MB = 1024 * 1024
+
+
+class MultipartError(Exception):
+    pass
+
+
+class UploadGone(MultipartError):
+    """The server doesn't know the stored upload id anymore."""
+
+
+class FileSlice:
+    """
+    Read-only window over part of a file, handed to requests as a streamed
+    body. The md5 is computed while it's sent so the part can be checked
+    against the ETag the server answers with.
+    """
+
+    def __init__(self, path, offset, length):
+        self._file = open(path, "rb")
+        self._file.seek(offset)
+        self._left = length
+        self.len = length
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        chunk = self._file.read(size)
+        self._left -= len(chunk)
+        self.md5.update(chunk)
+        get_bandwidth_limiter().egress.consume(len(chunk))
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+class MultipartUploader:
+    """
+    Uploads large files to IA's S3-compatible API (or a local stand-in, see
+    `endpoint`) as a multipart upload. The upload id and the ETag of every
+    confirmed part are kept in the state store, so an upload cut off
+    halfway resumes at the missing parts on the next run instead of sending
+    the whole file again. Parts are sent `max_workers` at a time.
+    """
+
+    def __init__(
+        self,
+        endpoint="https://s3.us.archive.org",
+        access_key=None,
+        secret_key=None,
+        part_size=100 * MB,
+        max_workers=4,
+        policy=None,
+        store=None,
+    ):
+        if access_key is None or secret_key is None:
+            session = internetarchive.get_session()
+            access_key = access_key or session.access_key
+            secret_key = secret_key or session.secret_key
+        if not access_key or not secret_key:
+            raise MultipartError(
+                "`internetarchive` configuration file is not configured properly, no S3 keys"
+            )
+        self.endpoint = endpoint.rstrip("/")
+        self.part_size = part_size
+        self.policy = policy
+        self.store = store or get_state_store()
+        self.http = get_http_client()
+        self._auth = {"authorization": f"LOW {access_key}:{secret_key}"}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="multipart"
+        )
+
+    def _url(self, identifier, key):
+        return f"{self.endpoint}/{identifier}/{quote(key)}"
+
+    def _request(self, method, url, headers=None, **kwargs):
+        response = self.http.request(
+            method,
+            url,
+            headers={**self._auth, **(headers or {})},
+            timeout=(30, 600),
+            **kwargs,
+        )
+        if response.status_code == 404 and b"NoSuchUpload" in response.content:
+            raise UploadGone(url)
+        response.raise_for_status()
+        return response
+
+    def _start(self, identifier, key, path, metadata, queue_derive):
+        # same x-archive-* headers as internetarchive's own uploads
+        prepared = S3PreparedRequest()
+        prepared.prepare_headers(None, metadata, None, queue_derive)
+        response = self._request(
+            "POST",
+            self._url(identifier, key) + "?uploads",
+            headers=dict(prepared.headers),
+        )
+        upload_id = _find_text(response.content, "UploadId")
+        if not upload_id:
+            raise MultipartError(f"No UploadId in answer: {response.text[:200]}")
+        stat = os.stat(path)
+        self.store.save_multipart(
+            identifier, key, upload_id, stat.st_size, stat.st_mtime, self.part_size
+        )
+        return upload_id, self.part_size
+
+    def _resume_or_start(self, identifier, key, path, metadata, queue_derive):
+        stat = os.stat(path)
+        saved = self.store.get_multipart(identifier, key)
+        if saved:
+            upload_id, size, mtime, part_size = saved
+            if size == stat.st_size and mtime == stat.st_mtime:
+                return upload_id, part_size
+            print(f"{key} changed since its upload started, starting over")
+            self.abort(identifier, key, upload_id)
+        return self._start(identifier, key, path, metadata, queue_derive)
+
+    def abort(self, identifier, key, upload_id):
+        """Drops an unfinished upload, on the server (best effort) and locally."""
+
+        try:
+            self._request(
+                "DELETE", self._url(identifier, key), params={"uploadId": upload_id}
+            )
+        except (requests.RequestException, MultipartError) as error:
+            logging.warning(f"Multipart: could not abort {identifier}/{key} - {error}")
+        self.store.delete_multipart(identifier, key)
+
+    def _send_part(self, url, upload_id, path, number, offset, length):
+        attempt = 0
+        while True:
+            attempt += 1
+            body = FileSlice(path, offset, length)
+            try:
+                response = self._request(
+                    "PUT",
+                    url,
+                    params={"partNumber": number, "uploadId": upload_id},
+                    data=body,
+                    headers={"content-length": str(length)},
+                )
+                etag = response.headers.get("ETag", "").strip('"')
+                if etag and etag != body.md5.hexdigest():
+                    raise MultipartError(f"part {number} arrived damaged (ETag {etag})")
+                self.store.save_multipart_part(upload_id, number, etag or body.md5.hexdigest())
+                return
+            except UploadGone:
+                raise
+            except (requests.RequestException, OSError, MultipartError) as error:
+                if self.policy is None or not self.policy.should_retry(attempt, error):
+                    raise
+                delay = self.policy.delay(attempt, error)
+                logging.warning(f"Multipart: part {number} failed ({error}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+            finally:
+                body.close()
+
+    def upload(self, identifier, key, path, metadata=None, queue_derive=True):
+        """Uploads (or finishes uploading) `path` as `key` in the item."""
+
+        try:
+            return self._upload(identifier, key, path, metadata, queue_derive)
+        except UploadGone:
+            # aborted or expired on the server, the saved parts are useless
+            print(f"Saved upload of {key} is gone from the server, starting over")
+            self.store.delete_multipart(identifier, key)
+            return self._upload(identifier, key, path, metadata, queue_derive)
+
+    def _upload(self, identifier, key, path, metadata, queue_derive):
+        upload_id, part_size = self._resume_or_start(
+            identifier, key, path, metadata, queue_derive
+        )
+        url = self._url(identifier, key)
+        size = os.path.getsize(path)
+        parts = {
+            number: (offset, min(part_size, size - offset))
+            for number, offset in enumerate(range(0, max(size, 1), part_size), start=1)
+        }
+        done = self.store.multipart_parts(upload_id)
+        todo = [number for number in parts if number not in done]
+        if done:
+            print(f"Resuming {key}: {len(done)} of {len(parts)} parts already uploaded")
+
+        futures = [
+            self._executor.submit(self._send_part, url, upload_id, path, number, *parts[number])
+            for number in todo
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # the caller may retry the upload, it mustn't race parts of this
+            # attempt that are still being sent
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+
+        etags = self.store.multipart_parts(upload_id)
+        body = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>\"{etags[number]}\"</ETag></Part>"
+            for number in sorted(parts)
+        )
+        response = self._request(
+            "POST",
+            url,
+            params={"uploadId": upload_id},
+            data=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>",
+        )
+        # S3 can answer 200 and still report an error in the body
+        if _find_text(response.content, "Code"):
+            raise MultipartError(f"Completing {key} failed: {response.text[:200]}")
+        self.store.delete_multipart(identifier, key)
+        logging.info(f"Multipart: {identifier}/{key} done, {len(parts)} parts")
+        return response
+
+
+def _find_text(content, tag):
+    try:
+        root = ElementTree.fromstring(content)
+    except ElementTree.ParseError:
+        return None
+    for element in root.iter():
+        if element.tag.split("}")[-1] == tag:
+            return element.text
+    return None
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+_settings = {
+    "enabled": False,
+    "endpoint": "https://s3.us.archive.org",
+    "threshold": 1024 * MB,
+    "part_size": 100 * MB,
+    "max_workers": 4,
+}
+
+
+def configure_multipart(
+    enabled=False, endpoint=None, threshold_mb=1024, part_size_mb=100, max_workers=4
+):
+    _settings["enabled"] = enabled
+    if endpoint:
+        _settings["endpoint"] = endpoint
+    _settings["threshold"] = threshold_mb * MB
+    # S3 wants parts of at least 5 MB, except the last one
+    _settings["part_size"] = max(5, part_size_mb) * MB
+    _settings["max_workers"] = max(1, max_workers)
+
+
+def use_multipart(size) -> bool:
+    return _settings["enabled"] and size >= _settings["threshold"]
+
+
+def get_multipart_uploader(policy=None) -> MultipartUploader:
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None:
+            _uploader = MultipartUploader(
+                endpoint=_settings["endpoint"],
+                part_size=_settings["part_size"],
+                max_workers=_settings["max_workers"],
+                policy=policy,
+            )
+        return _uploader
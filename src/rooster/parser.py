@@ -1,21 +1,28 @@
+import logging
 import requests
-from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, urlencode, parse_qsl
+
+from .client import SVOD_HEADERS, get_http_client
 
 
 class RoosterTeethParser:
     _API_BASE = "https://svod-be.roosterteeth.com"
     _API_BASE_URL = f"{_API_BASE}/api/v1"
-    HEADERS = {
-        "authority": "svod-be.roosterteeth.com",
-        "accept": "application/json",
-        "accept-language": "en-US,en;q=0.9",
-        "cache-control": "no-cache",
-        "client-debug-id": "0.9053162591183688",
-        "client-id": "4338d2b4bdc8db1239360f28e72f0d9ddb1fd01e7a38fbb07b4b1f4ba4564cc5",
-        "client-type": "web",
-        "content-type": "application/json",
-        "origin": "https://roosterteeth.com",
-    }
+    HEADERS = SVOD_HEADERS
+    PER_PAGE = 100
+
+    def __init__(self, session=None, max_workers=8):
+        # optional RoosterSession, adds the login token to svod-be requests
+        self.session = session
+        self.max_workers = max_workers
+        # the shared keep-alive client, also used for thumbnails and the APIs
+        self.http = get_http_client()
+
+    def _headers(self):
+        if self.session is None:
+            return self.HEADERS
+        return {**self.HEADERS, **self.session.headers()}
 
     def _extract_series_id(self, url):
         parsed_url = urlparse(url)
@@ -24,28 +31,57 @@ class RoosterTeethParser:
             return path_parts[2]
         return None
 
+    def _with_page(self, url, page):
+        parsed_url = urlparse(url)
+        query = dict(parse_qsl(parsed_url.query, keep_blank_values=True))
+        query["page"] = page
+        query["per_page"] = self.PER_PAGE
+        return parsed_url._replace(query=urlencode(query)).geturl()
+
+    def _get_json(self, url):
+        response = self.http.get(url, headers=self._headers(), timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def _iter_pages(self, url):
+        """Yields the items of every page of a paginated svod-be listing."""
+
+        page = 1
+        while True:
+            data = self._get_json(self._with_page(url, page))
+            items = data.get("data", [])
+            yield from items
+
+            total_pages = data.get("total_pages")
+            if total_pages is not None:
+                if page >= int(total_pages):
+                    return
+            elif len(items) < self.PER_PAGE:
+                return
+            page += 1
+
     def _extract_sesaon_links_in_order(self, id, season_number):
         api_url = f"https://svod-be.roosterteeth.com/api/v1/shows/{id}/seasons?order=asc&order_by"
-        response = requests.request("GET", api_url, headers=self.HEADERS, data={})
-        if response.ok:
-            seasons_data = response.json()
-            data = []
-            for season in seasons_data["data"]:
-                if season_number is not None:
-                    if int(season["attributes"]["number"]) == int(season_number):
-                        season_link = f"{self._API_BASE}{season['links']['episodes']}&page=1&per_page=999"
-                        return [season_link]
-                if season["links"]["episodes"]:
-                    season_link = f"{self._API_BASE}{season['links']['episodes']}&page=1&per_page=999"
-                    data.append(season_link)
-            return data
-        return None
+        try:
+            seasons = list(self._iter_pages(api_url))
+        except requests.RequestException:
+            return None
+        data = []
+        for season in seasons:
+            if season_number is not None:
+                if int(season["attributes"]["number"]) == int(season_number):
+                    return [f"{self._API_BASE}{season['links']['episodes']}"]
+            if season["links"]["episodes"]:
+                data.append(f"{self._API_BASE}{season['links']['episodes']}")
+        return data
 
     def _extract_bonus_series(self, id):
         api_url = f"https://svod-be.roosterteeth.com/api/v1/shows/{id}"
-        response = requests.request("GET", api_url, headers=self.HEADERS, data={})
-        if response.ok:
-            show_data = response.json()
+        try:
+            show_data = self._get_json(api_url)
+        except requests.RequestException:
+            return None
+        if show_data:
             for show in show_data["data"]:
                 if show["links"]["bonus_features"]:
                     return f"{self._API_BASE}{show['links']['bonus_features']}"
@@ -55,35 +91,18 @@ class RoosterTeethParser:
         query_params = parse_qs(urlparse(url).query)
         return query_params.get("season", [None])[0]
 
-    def _fetch_episode_links(self, season_links):
-        # Construct the API URL
-        print(f"Found {len(season_links)} seasons. Grabbing episode lists for them...")
+    def _fetch_season(self, link):
         episode_links = []
-        season_count = 1
-        for link in season_links:
-            response = requests.get(link)
-            response.raise_for_status()
-            data = response.json()
-            print(
-                f"Parsing Season: {'Bonus Season (Checking if Exists)' if 'bonus_features' in link else season_count}..."
-            )
-
-            for episode in data.get("data", []):
-                if episode["canonical_links"]["self"]:
-                    link = (
-                        f"https://roosterteeth.com{episode['canonical_links']['self']}"
-                    )
-                    episode_links.append(link)
-                else:
-                    print("no links found on season data")
-            season_count += 1
+        for episode in self._iter_pages(link):
+            if episode["canonical_links"]["self"]:
+                episode_links.append(
+                    f"https://roosterteeth.com{episode['canonical_links']['self']}"
+                )
+            else:
+                print("no links found on season data")
+        return episode_links
 
-        if episode_links:
-            return episode_links
-        else:
-            return None
-
-    def get_episode_links(self, url):
+    def _get_season_links(self, url):
         series_id = self._extract_series_id(url)
         season_number = self._extract_season_number(url)
         if not series_id:
@@ -91,19 +110,66 @@ class RoosterTeethParser:
 
         # Gets seasons
         if not season_number:
-            # whole series
-            series_slugs = self._extract_sesaon_links_in_order(series_id, season_number)
-            bonus_content = self._extract_bonus_series(series_id)
+            # whole series, seasons and bonus features are looked up together
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                seasons = executor.submit(
+                    self._extract_sesaon_links_in_order, series_id, season_number
+                )
+                bonus = executor.submit(self._extract_bonus_series, series_id)
+                series_slugs = seasons.result()
+                bonus_content = bonus.result()
             if series_slugs is not None:
                 if bonus_content is not None:
                     series_slugs.append(bonus_content)
         else:
             # single season
             series_slugs = self._extract_sesaon_links_in_order(series_id, season_number)
+        return series_slugs
+
+    def iter_episode_links(self, url):
+        """
+        Yields the episode links of a series/season url, season by season.
+        All seasons are requested at once, and each season is handed out
+        (in order) as soon as it and the ones before it have come back, so
+        downloads can start before the whole series is listed.
+        """
+
+        season_links = self._get_season_links(url)
+        if not season_links:
+            return
 
-        # Fetch episode links
-        episode_links = self._fetch_episode_links(series_slugs)
-        print(f"Found {len(episode_links)} episodes across {url}")
+        print(f"Found {len(season_links)} seasons. Grabbing episode lists for them...")
+        found = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            seasons = [executor.submit(self._fetch_season, link) for link in season_links]
+            for season_count, (link, season) in enumerate(
+                zip(season_links, seasons), start=1
+            ):
+                season_name = (
+                    "Bonus Season (Checking if Exists)"
+                    if "bonus_features" in link
+                    else season_count
+                )
+                try:
+                    episode_links = season.result()
+                except Exception as e:
+                    # one broken season shouldn't end the run of the others
+                    print(f"Parsing Season: {season_name}... failed: {e}")
+                    logging.warning(f"{e} - Could not list season {season_name}: {link}")
+                    failed += 1
+                    continue
+                print(
+                    f"Parsing Season: {season_name}... {len(episode_links)} episodes"
+                )
+                found += len(episode_links)
+                yield from episode_links
+        print(f"Found {found} episodes across {url}")
+        if failed:
+            logging.critical(f"{failed} seasons could not be listed | Input: {url}")
+
+    def get_episode_links(self, url):
+        episode_links = list(self.iter_episode_links(url))
         if episode_links:
             return episode_links
         else:
@@ -0,0 +1,188 @@
+import sys
+import queue
+import logging
+import threading
+
+from .downloader import (
+    resolve_episode,
+    download_episode,
+    post_process_download,
+    upload_episode,
+)
+from .workers import WorkerOutput, get_slug_from_link
+
+_DONE = object()
+
+
+class EpisodeJob:
+    def __init__(self, index, link):
+        self.index = index
+        self.link = link
+        self.episode_data = None
+        self.container_dir = None
+        self.info_dict = None
+        self.status = None
+
+
+class Stage:
+    """
+    A pipeline stage. `func(job)` returns True to hand the job to the next
+    stage, or False when the job is finished (with `job.status` set).
+    """
+
+    def __init__(self, name, workers, func):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.func = func
+
+
+class Pipeline:
+    """
+    Runs episode jobs through a list of stages. Each stage has its own
+    worker threads, and stages are joined by bounded queues so a slow stage
+    (usually the IA upload) holds back the ones in front of it instead of
+    letting finished downloads pile up on disk.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def run(self, links):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        threads = []
+
+        original_stdout = sys.stdout
+        sys.stdout = WorkerOutput(original_stdout)
+        try:
+            for position, stage in enumerate(self.stages):
+                outbox = queues[position + 1] if position + 1 < len(queues) else None
+                for number in range(stage.workers):
+                    thread = threading.Thread(
+                        target=self._work,
+                        args=(position, queues[position], outbox, remaining),
+                        name=f"{stage.name}_{number}",
+                        daemon=True,
+                    )
+                    thread.start()
+                    threads.append(thread)
+
+            for index, link in enumerate(links, start=1):
+                queues[0].put(EpisodeJob(index, link))  # blocks when stage 1 is busy
+            queues[0].put(_DONE)
+
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.stdout = original_stdout
+        return self.results
+
+    def _work(self, position, inbox, outbox, remaining):
+        stage = self.stages[position]
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                inbox.put(_DONE)  # let the other workers of this stage see it
+                with self._lock:
+                    remaining[position] -= 1
+                    last_worker = remaining[position] == 0
+                if last_worker and outbox is not None:
+                    outbox.put(_DONE)
+                return
+
+            try:
+                forward = stage.func(job)
+            except Exception as e:
+                print(f"{e} Error occurred in {stage.name} for link {job.index}: {job.link}")
+                logging.critical(
+                    f"{e} - Error occurred in {stage.name} for link {job.index}: {job.link}"
+                )
+                job.status = "failed"
+                forward = False
+
+            if forward and outbox is not None:
+                outbox.put(job)
+            else:
+                with self._lock:
+                    self.results[job.link] = job.status or "downloaded"
+
+
+def make_episode_pipeline(
+    username,
+    password,
+    num_links,
+    concurrent_fragments,
+    fast_check,
+    use_aria,
+    fn_mode,
+    fragment_retries,
+    fragment_abort,
+    total_slugs,
+    ignore_existing,
+    keep_after_upload,
+    update_metadata,
+    download_jobs=1,
+    metadata_jobs=2,
+    upload_jobs=1,
+    queue_size=2,
+):
+    def resolve(job):
+        print(f"Resolving link {job.index} of {num_links}: {job.link}")
+        job.status, job.episode_data, job.info_dict = resolve_episode(
+            username,
+            password,
+            job.link,
+            fast_check,
+            fn_mode,
+            total_slugs,
+            ignore_existing,
+            update_metadata,
+        )
+        return job.status is None
+
+    def download(job):
+        print(f"Downloading link {job.index} of {num_links}: {job.link}")
+        job.container_dir = download_episode(
+            username,
+            password,
+            job.link,
+            job.episode_data,
+            concurrent_fragments,
+            use_aria,
+            fn_mode,
+            fragment_retries,
+            fragment_abort,
+            job.info_dict,
+        )
+        job.info_dict = None  # not needed anymore, don't keep it around
+        if job.container_dir is None:
+            job.status = "failed"
+            return False
+        return True
+
+    def post_process(job):
+        if not post_process_download(job.episode_data, job.container_dir, fn_mode):
+            job.status = "failed"
+            return False
+        total_slugs.add(get_slug_from_link(job.link))
+        job.status = "downloaded"
+        return fn_mode == "ia"
+
+    def upload(job):
+        uploaded = upload_episode(
+            job.episode_data, job.container_dir, keep_after_upload, ignore_existing
+        )
+        job.status = "downloaded" if uploaded else "failed"
+        return False
+
+    stages = [
+        Stage("metadata", metadata_jobs, resolve),
+        Stage("download", download_jobs, download),
+        Stage("postprocess", 1, post_process),
+    ]
+    if fn_mode == "ia":
+        stages.append(Stage("upload", upload_jobs, upload))
+    return Pipeline(stages, queue_size=queue_size)
@@ -0,0 +1,152 @@
+import queue
+import logging
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+from .state import get_state_store, DONE_STATUSES
+
+# a batch that isn't full goes out once the links stop coming for this long
+FLUSH_SECONDS = 0.5
+
+
+def normalize_link(link):
+    """Returns (clean link, slug) for an episode link."""
+
+    link = link.strip()
+    parsed_url = urlparse(link)
+    slug = parsed_url.path.rstrip("/").split("/")[-1]
+    if parsed_url.scheme:
+        link = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path.rstrip('/')}"
+    return link, slug
+
+
+def iter_batches(items, size, flush_after=FLUSH_SECONDS):
+    """
+    Groups items into lists of at most `size`. Lists are sliced right away.
+    Anything else (series links that are still being listed) is read on a
+    thread: the first item goes out on its own, after that a batch goes out
+    when it's full or when no new item came for `flush_after` seconds, like
+    between two seasons, so a slow source never holds back what arrived.
+    """
+
+    if isinstance(items, (list, tuple)):
+        for start in range(0, len(items), size):
+            yield list(items[start : start + size])
+        return
+
+    inbox = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                inbox.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+        except Exception as err:
+            put((False, err))
+        else:
+            put((False, None))
+
+    threading.Thread(target=read, name="batch-reader", daemon=True).start()
+    batch = []
+    first = True
+    try:
+        while True:
+            try:
+                more, item = inbox.get(timeout=flush_after if batch else None)
+            except queue.Empty:
+                yield batch
+                batch = []
+                continue
+            if not more:
+                if batch:
+                    yield batch
+                if item is not None:
+                    raise item
+                return
+            batch.append(item)
+            if first or len(batch) >= size:
+                first = False
+                yield batch
+                batch = []
+    finally:
+        stop.set()
+
+
+class LinkPlanner:
+    """
+    Planning pass run before any network I/O. Every link is normalized to
+    its slug and checked in batches against the state store:
+    - done: recorded as downloaded (only with fast check) or its numeric id,
+      known from an earlier run, is in the download archive
+    - retry: seen in an earlier run but never finished
+    - unknown: never seen before, the metadata has to be fetched
+    Only retry and unknown links are handed on, batch by batch as the
+    links come in (see iter_batches).
+    """
+
+    BATCH = 500
+
+    def __init__(self, fast_check, store=None):
+        self.fast_check = fast_check
+        self.store = store or get_state_store()
+        self.counts = {"done": 0, "retry": 0, "unknown": 0, "duplicate": 0}
+        self._seen = set()
+
+    def filter(self, links):
+        for batch in iter_batches(links, self.BATCH):
+            yield from self._filter_batch([normalize_link(link) for link in batch])
+
+    def _filter_batch(self, batch):
+        try:
+            known = self.store.lookup(slug for _, slug in batch)
+            archived = self.store.archive_ids(
+                episode_id for _, episode_id in known.values() if episode_id
+            )
+        except sqlite3.Error as err:
+            logging.warning(f"Planner: state store lookup failed, not filtering - {err}")
+            known, archived = {}, set()
+
+        for link, slug in batch:
+            if slug in self._seen:
+                self.counts["duplicate"] += 1
+                continue
+            self._seen.add(slug)
+
+            status, episode_id = known.get(slug, (None, None))
+            if (self.fast_check and status in DONE_STATUSES) or (
+                episode_id is not None and episode_id in archived
+            ):
+                self.counts["done"] += 1
+                continue
+            self.counts["retry" if status else "unknown"] += 1
+            yield link
+
+    def report(self):
+        total = sum(self.counts.values())
+        todo = self.counts["retry"] + self.counts["unknown"]
+        print(
+            f"Planned {total} links: {self.counts['done']} already done, {todo} to process "
+            f"({self.counts['unknown']} new, {self.counts['retry']} from earlier runs), "
+            f"{self.counts['duplicate']} duplicates"
+        )
+        logging.info(f"Planner: {self.counts}")
+
+
+def plan_links(links, fast_check):
+    """Filters a full list of links up front and prints what's left to do."""
+
+    planner = LinkPlanner(fast_check)
+    todo = list(planner.filter(links))
+    planner.report()
+    return todo
@@ -0,0 +1,208 @@
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from yt_dlp.networking.exceptions import TransportError
+
+# a lookup runs at most this many sources at once
+MAX_SOURCES = 3
+
+TRANSPORT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+    socket.gaierror,
+    requests.ConnectionError,
+    requests.Timeout,
+    TransportError,
+)
+
+
+class CircuitBreaker:
+    """
+    Stops sending traffic to a metadata source that keeps failing.
+    After `failure_threshold` failures in a row the breaker opens and the
+    source is skipped for `reset_timeout` seconds, then calls are let
+    through again (half open). A success closes it, one more failure opens
+    it for another `reset_timeout`.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info(f"Metadata source {self.name} is back, closing breaker")
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(
+                        f"Metadata source {self.name} failed {self._failures} times in a row, skipping it for {self.reset_timeout}s"
+                    )
+                    logging.warning(f"Metadata source {self.name}: breaker opened")
+                self._opened_at = time.monotonic()
+
+
+def _http_status(error):
+    response = getattr(error, "response", None)
+    for status in (
+        getattr(error, "status", None),
+        getattr(response, "status_code", None),
+        getattr(error, "code", None),
+    ):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_outage(error) -> bool:
+    """
+    Whether an error says the source itself is in trouble (network,
+    timeout, 5xx) rather than something about the episode, like a FIRST
+    only or removed video. Follows the errors yt-dlp wraps.
+    """
+
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = _http_status(error)
+        if status is not None:
+            return status >= 500
+        if isinstance(error, TRANSPORT_ERRORS):
+            return True
+        exc_info = getattr(error, "exc_info", None)
+        error = (
+            getattr(error, "cause", None)
+            or (exc_info[1] if isinstance(exc_info, tuple) else None)
+            or error.__cause__
+            or error.__context__
+        )
+    return False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_settings = {"hedge_delay": None, "jobs": 1}
+_executor = None
+
+
+def configure_resolver(hedge_delay=None, jobs=1):
+    """
+    hedge_delay: None tries the sources one after another (default). Otherwise
+    the first source is started alone, and if it hasn't answered after
+    hedge_delay seconds the other sources are started in parallel. 0 starts
+    all of them at once.
+    jobs: episodes resolved at once, sizes the pool the sources run on.
+    """
+
+    _settings["hedge_delay"] = hedge_delay
+    _settings["jobs"] = max(1, jobs)
+
+
+def get_breaker(name) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def _get_executor():
+    global _executor
+    with _breakers_lock:
+        if _executor is None:
+            # losing sources can't be stopped once they run, so every
+            # worker gets room for its current lookup and a previous one
+            _executor = ThreadPoolExecutor(
+                max_workers=_settings["jobs"] * MAX_SOURCES * 2,
+                thread_name_prefix="resolver",
+            )
+        return _executor
+
+
+def _call_source(name, fetch):
+    """Runs a source, returns its (episode_data, info_dict) or None."""
+
+    breaker = get_breaker(name)
+    try:
+        result = fetch()
+    except Exception as e:
+        print(f"Metadata source {name} failed: {e}")
+        logging.warning(f"Metadata source {name} failed: {e}")
+        # only an unreachable source counts against its breaker, not
+        # an episode it can't give out
+        if is_outage(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return None
+    breaker.record_success()
+    if result is None or result[0] is None:
+        return None
+    return result
+
+
+def resolve_first(sources):
+    """
+    sources: list of (name, fetch) in order of preference, where fetch()
+    returns (episode_data, info_dict).
+    Returns the first complete (episode_data, info_dict), or (None, None).
+    """
+
+    sources = [
+        (name, fetch) for name, fetch in sources if get_breaker(name).allow()
+    ][:MAX_SOURCES]
+    if not sources:
+        print("All metadata sources are switched off by their breakers")
+        return None, None
+
+    hedge_delay = _settings["hedge_delay"]
+    if hedge_delay is None or len(sources) == 1:
+        for name, fetch in sources:
+            result = _call_source(name, fetch)
+            if result is not None:
+                return result
+            print(f"{name} failed, trying the next method")
+        return None, None
+
+    executor = _get_executor()
+    first_name, first_fetch = sources[0]
+    pending = {executor.submit(_call_source, first_name, first_fetch)}
+    done, pending = wait(pending, timeout=hedge_delay)
+    for future in done:
+        if future.result() is not None:
+            return future.result()
+
+    # first source is slow or already failed, race the others against it
+    for name, fetch in sources[1:]:
+        pending.add(executor.submit(_call_source, name, fetch))
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result() is not None:
+                    return future.result()
+    finally:
+        # losers that haven't started yet give their slot back
+        for future in pending:
+            future.cancel()
+    return None, None
@@ -0,0 +1,173 @@
+import io
+import json
+import time
+import logging
+import threading
+from http.cookiejar import Cookie, MozillaCookieJar
+from pathlib import Path
+
+import requests
+
+from .client import get_http_client
+
+
+class RoosterSession:
+    """
+    Logs in to Rooster Teeth once per run and shares the access token with
+    every yt-dlp instance (through a cookie jar) and every svod-be request
+    (through the Authorization header). The token and cookie jar are kept
+    in logs/ together with their expiry, so the next run skips the login too.
+    """
+
+    AUTH_URL = "https://auth.roosterteeth.com/oauth/token"
+    CLIENT_ID = "4338d2b4bdc8db1239360f28e72f0d9ddb1fd01e7a38fbb07b4b1f4ba4564cc5"
+    COOKIE_DOMAIN = ".roosterteeth.com"
+    # refresh a bit before the token actually runs out
+    EXPIRY_MARGIN = 300
+
+    def __init__(self, username, password, state_dir=None):
+        self.username = username
+        self.password = password
+        state_dir = Path(state_dir) if state_dir else Path.cwd() / "logs"
+        state_dir.mkdir(parents=True, exist_ok=True)
+        self.token_file = state_dir / "session.json"
+        self.cookie_file = state_dir / "cookies.txt"
+        self._token = None
+        self._expires_at = 0
+        self._cookie_text = None
+        self._login_failed = False
+        self._lock = threading.Lock()
+
+    def _token_is_valid(self):
+        return self._token is not None and time.time() < (
+            self._expires_at - self.EXPIRY_MARGIN
+        )
+
+    def _load(self):
+        try:
+            with open(self.token_file, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get("username") != self.username:
+            return
+        self._token = data.get("access_token")
+        self._expires_at = data.get("expires_at", 0)
+        if self._token_is_valid():
+            try:
+                with open(self.cookie_file, "r") as f:
+                    self._cookie_text = f.read()
+            except FileNotFoundError:
+                self._save()
+
+    def _save(self):
+        with open(self.token_file, "w") as f:
+            json.dump(
+                {
+                    "username": self.username,
+                    "access_token": self._token,
+                    "expires_at": self._expires_at,
+                },
+                f,
+            )
+        jar = MozillaCookieJar(str(self.cookie_file))
+        jar.set_cookie(self._make_cookie())
+        jar.save(ignore_discard=True, ignore_expires=True)
+        with open(self.cookie_file, "r") as f:
+            self._cookie_text = f.read()
+
+    def _make_cookie(self):
+        return Cookie(
+            version=0,
+            name="rt_access_token",
+            value=self._token,
+            port=None,
+            port_specified=False,
+            domain=self.COOKIE_DOMAIN,
+            domain_specified=True,
+            domain_initial_dot=True,
+            path="/",
+            path_specified=True,
+            secure=True,
+            expires=int(self._expires_at),
+            discard=False,
+            comment=None,
+            comment_url=None,
+            rest={},
+        )
+
+    def _login(self):
+        print("Logging in to Rooster Teeth...")
+        try:
+            response = get_http_client().post(
+                self.AUTH_URL,
+                data={
+                    "client_id": self.CLIENT_ID,
+                    "grant_type": "password",
+                    "username": self.username,
+                    "password": self.password,
+                },
+                timeout=30,
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Unable to login, yt-dlp will try on its own: {e}")
+            logging.warning(f"Rooster Teeth login failed: {e}")
+            self._login_failed = True
+            return
+
+        self._token = data["access_token"]
+        self._expires_at = time.time() + int(data.get("expires_in", 3600))
+        self._save()
+        logging.info("Logged in to Rooster Teeth, token saved to session.json")
+
+    def get_token(self):
+        """Returns a valid access token, logging in only when needed."""
+
+        if not self.username or not self.password:
+            return None
+        with self._lock:
+            if self._token_is_valid():
+                return self._token
+            self._load()
+            if not self._token_is_valid() and not self._login_failed:
+                self._login()
+            return self._token if self._token_is_valid() else None
+
+    def ydl_options(self):
+        """
+        yt-dlp options for an authenticated YoutubeDL instance. Every instance
+        gets its own in-memory copy of the cookie jar, so yt-dlp saving cookies
+        on close never races with other workers over the same file.
+        """
+
+        token = self.get_token()
+        if token is None:
+            # no shared session, let yt-dlp login by itself like before
+            return {"username": self.username, "password": self.password}
+
+        return {"cookiefile": io.StringIO(self._cookie_text)}
+
+    def headers(self):
+        """Authorization headers for requests to svod-be."""
+
+        token = self.get_token()
+        if token is None:
+            return {}
+        return {"authorization": f"Bearer {token}"}
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_rooster_session(username, password) -> RoosterSession:
+    """Returns the shared session for these credentials, one per process."""
+
+    with _sessions_lock:
+        session = _sessions.get(username)
+        if session is None or session.password != password:
+            session = RoosterSession(username, password)
+            _sessions[username] = session
+        return session
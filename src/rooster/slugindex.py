@@ -0,0 +1,237 @@
+import os
+import mmap
+import math
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, only threads are kept apart then
+    fcntl = None
+
+from .state import get_state_store
+
+
+class BloomSlugIndex:
+    """
+    Compact on-disk index of downloaded slugs for --fast-check
+    (logs/downloaded.bloom). It's a Bloom filter read through mmap, so
+    startup doesn't load every slug into memory: only the pages that get
+    probed are read. A "maybe" from the filter is confirmed with an exact
+    lookup in the state store, so there are no false positives.
+
+    The file remembers the newest state store change it has seen. On open,
+    only slugs marked done after that are added. Call rebuild() to start
+    over from the whole store (which also holds the imported downloaded.log).
+
+    Several processes can share logs/: changes to the file are made under
+    an flock on downloaded.bloom.lock, and a process whose file was
+    replaced by another one's rebuild switches over to the new file.
+    """
+
+    MAGIC = b"RSTRBLM1"
+    # magic, bit count, hash count, capacity, slug count, watermark
+    HEADER = struct.Struct("<8sQIQQd")
+    ERROR_RATE = 0.001
+
+    def __init__(self, path=None, store=None, capacity=1_000_000):
+        self.path = Path(path) if path else Path.cwd() / "logs" / "downloaded.bloom"
+        self.store = store or get_state_store()
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        if not self._open():
+            self.rebuild(capacity)
+        else:
+            self._catch_up()
+
+    @contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.lock_path, "a+b") as lock_file:
+            if fcntl is not None:
+                # released when the file is closed
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _open(self):
+        try:
+            self._file = open(self.path, "r+b")
+        except FileNotFoundError:
+            return False
+        header = self._file.read(self.HEADER.size)
+        if len(header) < self.HEADER.size:
+            self._file.close()
+            return False
+        magic, bits, hashes, capacity, count, watermark = self.HEADER.unpack(header)
+        if magic != self.MAGIC:
+            logging.warning(f"{self.path} is not a slug index, rebuilding it")
+            self._file.close()
+            return False
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.bits, self.hashes, self.capacity = bits, hashes, capacity
+        self.count, self.watermark = count, watermark
+        return True
+
+    def _close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_header(self):
+        # other processes may have added slugs since
+        _, _, _, _, count, watermark = self.HEADER.unpack(
+            self._map[: self.HEADER.size]
+        )
+        self.count = count
+        self.watermark = max(self.watermark, watermark)
+
+    def _follow_rebuild(self):
+        """Switches to the current file if another process rebuilt it."""
+
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._file is not None and current == os.fstat(self._file.fileno()).st_ino:
+            self._read_header()
+            return
+        self._close()
+        if self._open():
+            self._add_done_since(self.watermark)
+            self._write_header()
+        else:
+            self._rebuild(self.capacity)
+
+    def _write_header(self):
+        self._map[: self.HEADER.size] = self.HEADER.pack(
+            self.MAGIC, self.bits, self.hashes, self.capacity, self.count, self.watermark
+        )
+
+    def _positions(self, slug):
+        digest = hashlib.blake2b(slug.encode("utf-8"), digest_size=16).digest()
+        first, second = struct.unpack("<QQ", digest)
+        second |= 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.bits
+
+    def _set(self, slug):
+        for position in self._positions(slug):
+            offset = self.HEADER.size + position // 8
+            self._map[offset] |= 1 << (position % 8)
+        self.count += 1
+
+    def _maybe_contains(self, slug):
+        for position in self._positions(slug):
+            offset = self.HEADER.size + position // 8
+            if not self._map[offset] & (1 << (position % 8)):
+                return False
+        return True
+
+    def rebuild(self, capacity=1_000_000):
+        """Recreates the filter from every done episode in the state store."""
+
+        with self._locked():
+            self._rebuild(capacity)
+        print(f"Built slug index with {self.count} downloaded slugs")
+
+    def _rebuild(self, capacity):
+        self._close()
+        done = self.store.count_done()
+        # leave room to grow before the error rate goes up
+        self.capacity = max(capacity, done * 2)
+        self.bits = int(
+            -self.capacity * math.log(self.ERROR_RATE) / (math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.count = 0
+        self.watermark = 0.0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # unique name, another process may be rebuilding as well
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.path.parent, prefix=self.path.name + ".", suffix=".tmp"
+        )
+        try:
+            with open(fd, "wb") as f:
+                f.truncate(self.HEADER.size + (self.bits + 7) // 8)
+            self._file = open(tmp_path, "r+b")
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            self._add_done_since(0.0)
+            self._write_header()
+            self._close()
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            self._close()
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        self._open()
+
+    def _add_done_since(self, watermark):
+        for slug, updated_at in self.store.iter_done_since(watermark):
+            if not self._maybe_contains(slug):
+                self._set(slug)
+            self.watermark = max(self.watermark, updated_at)
+
+    def _catch_up(self):
+        with self._locked():
+            self._follow_rebuild()
+            self._add_done_since(self.watermark)
+            self._write_header()
+        if self.count > self.capacity:
+            self.rebuild()
+
+    def __contains__(self, slug):
+        with self._lock:
+            maybe = self._maybe_contains(slug)
+        if not maybe:
+            # a miss can come from a stale file: another process may have
+            # rebuilt it or finished episodes since, catch up and ask again
+            with self._locked():
+                self._follow_rebuild()
+                self._add_done_since(self.watermark)
+                self._write_header()
+                if not self._maybe_contains(slug):
+                    return False
+        return self.store.is_done(slug)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, slug):
+        with self._locked():
+            self._follow_rebuild()
+            if not self._maybe_contains(slug):
+                self._set(slug)
+                self._write_header()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_slug_index(rebuild=False) -> BloomSlugIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            if rebuild:
+                path = Path.cwd() / "logs" / "downloaded.bloom"
+                path.unlink(missing_ok=True)
+            _index = BloomSlugIndex()
+        elif rebuild:
+            _index.rebuild()
+        return _index
@@ -0,0 +1,391 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+# how far an episode got, in order. "failed" is kept apart since it can
+# happen at any step
+STATUSES = ("resolved", "downloaded", "verified", "uploaded")
+DONE_STATUSES = ("downloaded", "verified", "uploaded")
+FAILED = "failed"
+
+
+class StateStore:
+    """
+    Per-episode state of every rooster run in this directory, kept in one
+    SQLite database (logs/state.db) in WAL mode. Several rooster processes
+    can read and write it at the same time, SQLite does the locking.
+
+    It replaces the downloaded.log / archive.log / failed_upload.log text
+    files. Those are still imported (only the new lines, every time the
+    store is opened) so logs copied over from other machines or older
+    versions keep working.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else Path.cwd() / "logs" / "state.db"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS episodes (
+                    slug TEXT PRIMARY KEY,
+                    episode_id TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS episodes_id ON episodes (episode_id);
+                CREATE INDEX IF NOT EXISTS episodes_status ON episodes (status);
+                CREATE INDEX IF NOT EXISTS episodes_updated ON episodes (updated_at);
+                CREATE TABLE IF NOT EXISTS archive (
+                    entry TEXT PRIMARY KEY,
+                    episode_id TEXT
+                );
+                CREATE INDEX IF NOT EXISTS archive_id ON archive (episode_id);
+                CREATE TABLE IF NOT EXISTS imports (
+                    name TEXT PRIMARY KEY,
+                    offset INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS multipart_uploads (
+                    identifier TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    upload_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    part_size INTEGER NOT NULL,
+                    PRIMARY KEY (identifier, key)
+                );
+                CREATE TABLE IF NOT EXISTS multipart_parts (
+                    upload_id TEXT NOT NULL,
+                    part_number INTEGER NOT NULL,
+                    etag TEXT NOT NULL,
+                    PRIMARY KEY (upload_id, part_number)
+                );
+                CREATE TABLE IF NOT EXISTS fragment_tuning (
+                    host TEXT PRIMARY KEY,
+                    concurrency INTEGER NOT NULL,
+                    rate REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                """
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # episodes
+
+    def set_status(self, slug, status, episode_id=None, error=None):
+        """
+        A failure doesn't take back a done status: an upload that fails
+        after the download only records its error, so the episode still
+        counts as downloaded (--fast-check won't download it again).
+        """
+
+        if status not in STATUSES and status != FAILED:
+            raise ValueError(f"Unknown episode status: {status}")
+        placeholders = ",".join("?" for _ in DONE_STATUSES)
+        with self._connect() as conn:
+            conn.execute(
+                f"""INSERT INTO episodes (slug, episode_id, status, error, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (slug) DO UPDATE SET
+                    episode_id = COALESCE(excluded.episode_id, episode_id),
+                    status = CASE
+                        WHEN excluded.status = '{FAILED}' AND status IN ({placeholders})
+                        THEN status ELSE excluded.status END,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at""",
+                (
+                    slug,
+                    _str_or_none(episode_id),
+                    status,
+                    error,
+                    time.time(),
+                    *DONE_STATUSES,
+                ),
+            )
+
+    def mark_resolved(self, slug, episode_id):
+        """Records the slug -> id mapping without going back from a later status."""
+
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT INTO episodes (slug, episode_id, status, updated_at)
+                VALUES (?, ?, 'resolved', ?)
+                ON CONFLICT (slug) DO UPDATE SET
+                    episode_id = excluded.episode_id,
+                    updated_at = excluded.updated_at""",
+                (slug, _str_or_none(episode_id), time.time()),
+            )
+
+    def get_status(self, slug):
+        row = (
+            self._connect()
+            .execute("SELECT status FROM episodes WHERE slug = ?", (slug,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def get_episode_id(self, slug):
+        row = (
+            self._connect()
+            .execute("SELECT episode_id FROM episodes WHERE slug = ?", (slug,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def is_done(self, slug):
+        return self.get_status(slug) in DONE_STATUSES
+
+    def iter_slugs(self, statuses=DONE_STATUSES):
+        placeholders = ",".join("?" for _ in statuses)
+        cursor = self._connect().execute(
+            f"SELECT slug FROM episodes WHERE status IN ({placeholders})",
+            tuple(statuses),
+        )
+        for (slug,) in cursor:
+            yield slug
+
+    def count_done(self):
+        placeholders = ",".join("?" for _ in DONE_STATUSES)
+        return (
+            self._connect()
+            .execute(
+                f"SELECT COUNT(*) FROM episodes WHERE status IN ({placeholders})",
+                DONE_STATUSES,
+            )
+            .fetchone()[0]
+        )
+
+    def iter_done_since(self, since):
+        """(slug, updated_at) of the episodes that got done after `since`."""
+
+        placeholders = ",".join("?" for _ in DONE_STATUSES)
+        cursor = self._connect().execute(
+            f"""SELECT slug, updated_at FROM episodes
+            WHERE updated_at > ? AND status IN ({placeholders})""",
+            (since, *DONE_STATUSES),
+        )
+        yield from cursor
+
+    def lookup(self, slugs):
+        """Batch version of get_status/get_episode_id: {slug: (status, episode_id)}."""
+
+        found = {}
+        slugs = list(slugs)
+        conn = self._connect()
+        for start in range(0, len(slugs), 500):
+            chunk = slugs[start : start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            for slug, status, episode_id in conn.execute(
+                f"SELECT slug, status, episode_id FROM episodes WHERE slug IN ({placeholders})",
+                chunk,
+            ):
+                found[slug] = (status, episode_id)
+        return found
+
+    # yt-dlp download archive
+
+    def archive_ids(self, episode_ids):
+        """Returns which of the given episode ids are in the download archive."""
+
+        found = set()
+        episode_ids = [str(episode_id) for episode_id in episode_ids]
+        conn = self._connect()
+        for start in range(0, len(episode_ids), 500):
+            chunk = episode_ids[start : start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            for (episode_id,) in conn.execute(
+                f"SELECT episode_id FROM archive WHERE episode_id IN ({placeholders})",
+                chunk,
+            ):
+                found.add(episode_id)
+        return found
+
+    def archive_contains(self, entry):
+        row = (
+            self._connect()
+            .execute("SELECT 1 FROM archive WHERE entry = ?", (entry,))
+            .fetchone()
+        )
+        return row is not None
+
+    def archive_has_id(self, episode_id):
+        row = (
+            self._connect()
+            .execute("SELECT 1 FROM archive WHERE episode_id = ?", (str(episode_id),))
+            .fetchone()
+        )
+        return row is not None
+
+    def archive_add(self, entry):
+        with self._connect() as conn:
+            self._insert_archive(conn, [entry])
+
+    def archive_size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM archive").fetchone()[0]
+
+    def _insert_archive(self, conn, entries):
+        rows = []
+        for entry in entries:
+            parts = entry.split(" ")
+            rows.append((entry, parts[1] if len(parts) > 1 else None))
+        conn.executemany("INSERT OR IGNORE INTO archive VALUES (?, ?)", rows)
+
+    # resumable multipart uploads to IA
+
+    def get_multipart(self, identifier, key):
+        """Returns (upload_id, size, mtime, part_size) of an unfinished upload."""
+
+        return (
+            self._connect()
+            .execute(
+                """SELECT upload_id, size, mtime, part_size FROM multipart_uploads
+                WHERE identifier = ? AND key = ?""",
+                (identifier, key),
+            )
+            .fetchone()
+        )
+
+    def save_multipart(self, identifier, key, upload_id, size, mtime, part_size):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO multipart_uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (identifier, key, upload_id, size, mtime, part_size),
+            )
+
+    def multipart_parts(self, upload_id):
+        """{part_number: etag} of the parts the server confirmed."""
+
+        cursor = self._connect().execute(
+            "SELECT part_number, etag FROM multipart_parts WHERE upload_id = ?",
+            (upload_id,),
+        )
+        return dict(cursor.fetchall())
+
+    def save_multipart_part(self, upload_id, part_number, etag):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO multipart_parts VALUES (?, ?, ?)",
+                (upload_id, part_number, etag),
+            )
+
+    def delete_multipart(self, identifier, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT upload_id FROM multipart_uploads WHERE identifier = ? AND key = ?",
+                (identifier, key),
+            ).fetchone()
+            if row:
+                conn.execute("DELETE FROM multipart_parts WHERE upload_id = ?", row)
+            conn.execute(
+                "DELETE FROM multipart_uploads WHERE identifier = ? AND key = ?",
+                (identifier, key),
+            )
+
+    def get_fragment_tuning(self, host):
+        """Returns (concurrency, rate) of the best setting seen for a CDN host."""
+
+        return (
+            self._connect()
+            .execute(
+                "SELECT concurrency, rate FROM fragment_tuning WHERE host = ?", (host,)
+            )
+            .fetchone()
+        )
+
+    def save_fragment_tuning(self, host, concurrency, rate):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO fragment_tuning VALUES (?, ?, ?, ?)",
+                (host, concurrency, rate, time.time()),
+            )
+
+    # legacy text logs
+
+    def import_legacy_logs(self, log_dir=None):
+        """
+        Imports lines added to the old text logs since the last import.
+        downloaded.log -> downloaded, failed_upload.log -> failed (unless the
+        episode already has a state), archive.log -> archive.
+        """
+
+        log_dir = Path(log_dir) if log_dir else self.path.parent
+        imported = 0
+        with self._connect() as conn:
+            for line in self._read_new_lines(conn, log_dir / "downloaded.log"):
+                conn.execute(
+                    """INSERT INTO episodes (slug, status, updated_at)
+                    VALUES (?, 'downloaded', ?)
+                    ON CONFLICT (slug) DO UPDATE SET status = 'downloaded'
+                    WHERE status NOT IN ('verified', 'uploaded')""",
+                    (line, time.time()),
+                )
+                imported += 1
+            for line in self._read_new_lines(conn, log_dir / "failed_upload.log"):
+                slug = line.rstrip("/").split("/")[-1]
+                conn.execute(
+                    """INSERT OR IGNORE INTO episodes (slug, status, error, updated_at)
+                    VALUES (?, 'failed', 'upload', ?)""",
+                    (slug, time.time()),
+                )
+                imported += 1
+            archive_lines = list(self._read_new_lines(conn, log_dir / "archive.log"))
+            self._insert_archive(conn, archive_lines)
+            imported += len(archive_lines)
+        if imported:
+            print(f"Imported {imported} lines from the old log files into {self.path.name}")
+            logging.info(f"State store: imported {imported} lines from legacy logs")
+        return imported
+
+    def _read_new_lines(self, conn, path):
+        row = conn.execute(
+            "SELECT offset FROM imports WHERE name = ?", (path.name,)
+        ).fetchone()
+        offset = row[0] if row else 0
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size < offset:  # replaced by a shorter file, read it all again
+            offset = 0
+        if size == offset:
+            return
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(size - offset)
+        end = chunk.rfind(b"\n") + 1  # leave a half written line for next time
+        for line in chunk[:end].decode("utf-8", errors="replace").splitlines():
+            if line.strip():
+                yield line.strip()
+        conn.execute(
+            "INSERT OR REPLACE INTO imports VALUES (?, ?)", (path.name, offset + end)
+        )
+
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore()
+            _store.import_legacy_logs()
+        return _store
@@ -0,0 +1,306 @@
+import os
+import time
+import hashlib
+import random
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import internetarchive
+from requests.exceptions import HTTPError, RequestException
+
+from .bandwidth import get_bandwidth_limiter
+from .multipart import MultipartError, get_multipart_uploader, use_multipart
+
+# (connect, read) timeout per request, instead of 9001s
+UPLOAD_TIMEOUT = (30, 600)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """
+    Bounded retries for file uploads. The delay doubles from `base` up to
+    `cap` with some jitter, and it goes up for every upload while IA keeps
+    answering 503 SlowDown / 429: the shared penalty grows on each
+    throttling answer and shrinks again on successes.
+    """
+
+    def __init__(self, max_attempts=5, base=5, cap=300):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self._penalty = 1.0
+        self._lock = threading.Lock()
+
+    def should_retry(self, attempt, error):
+        if attempt >= self.max_attempts:
+            return False
+        response = getattr(error, "response", None)
+        if response is None:
+            return isinstance(error, (RequestException, OSError))
+        return response.status_code in RETRYABLE_STATUSES
+
+    def delay(self, attempt, error):
+        response = getattr(error, "response", None)
+        retry_after = None
+        if response is not None:
+            if response.status_code in (429, 503):
+                with self._lock:
+                    self._penalty = min(self._penalty * 2, 8.0)
+            try:
+                retry_after = float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                pass
+        with self._lock:
+            penalty = self._penalty
+        delay = min(self.cap, self.base * 2 ** (attempt - 1) * penalty)
+        delay *= random.uniform(0.8, 1.2)
+        return max(delay, retry_after or 0)
+
+    def record_success(self):
+        with self._lock:
+            self._penalty = max(1.0, self._penalty / 2)
+
+
+class FileUploadResult:
+    def __init__(self, key, path, size):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.response = None
+        self.error = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.skipped = False
+
+    @property
+    def ok(self):
+        if self.skipped:
+            return True
+        return self.response is not None and self.response.status_code == 200
+
+    @property
+    def speed(self):
+        """MB/s of the successful attempt."""
+
+        if not self.elapsed:
+            return 0.0
+        return self.size / self.elapsed / 1024 / 1024
+
+
+_md5_cache = {}
+_md5_lock = threading.Lock()
+_hash_executor = ThreadPoolExecutor(
+    max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="hash"
+)
+
+
+def file_md5(path):
+    """md5 of a file, remembered for as long as its size and mtime stay the same."""
+
+    stat = os.stat(path)
+    cache_key = (str(path), stat.st_size, stat.st_mtime)
+    with _md5_lock:
+        if cache_key in _md5_cache:
+            return _md5_cache[cache_key]
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            md5.update(chunk)
+    with _md5_lock:
+        _md5_cache[cache_key] = md5.hexdigest()
+    return md5.hexdigest()
+
+
+def header_metadata(metadata):
+    """
+    Metadata sent along with an upload goes out as x-archive-meta headers,
+    which have to be strings (newer internetarchive versions don't convert
+    them). Booleans are written the way IA stores them from JSON.
+    """
+
+    if not metadata:
+        return metadata
+    converted = {}
+    for key, value in metadata.items():
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif isinstance(value, (int, float)):
+            value = str(value)
+        converted[key] = value
+    return converted
+
+
+def hash_files_in_background(paths):
+    """Starts hashing files (hashlib lets go of the GIL), returns {path: future}."""
+
+    return {path: _hash_executor.submit(file_md5, path) for path in paths}
+
+
+class UploadPool:
+    """
+    Uploads the files of an item on its own worker pool, separate from the
+    episode workers. The first (smallest) file goes up alone with the item
+    metadata so the item gets created once, then the remaining files are
+    sent at the same time: the sidecars don't wait behind the mp4.
+    """
+
+    def __init__(self, max_workers=4, policy=None):
+        self.max_workers = max_workers
+        self.policy = policy or RetryPolicy()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="upload"
+        )
+
+    def _upload_throttled(self, item, result, metadata, queue_derive, delete):
+        # the file is sent through the egress bucket. internetarchive would
+        # read it once more for the md5 with delete=True (and delete by key,
+        # not path, for file objects), so the md5 comes from the cache and
+        # the file is deleted here
+        headers = {"Content-MD5": file_md5(result.path)} if delete else {}
+        with get_bandwidth_limiter().open_for_upload(result.path) as body:
+            response = item.upload_file(
+                body,
+                key=result.key,
+                metadata=metadata,
+                headers=headers,
+                queue_derive=queue_derive,
+                retries=0,
+                request_kwargs=dict(timeout=UPLOAD_TIMEOUT),
+            )
+        if delete and response.status_code == 200:
+            os.remove(result.path)
+        return response
+
+    def _upload_file(self, item, result, metadata, queue_derive, delete):
+        while True:
+            result.attempts += 1
+            start = time.monotonic()
+            try:
+                if use_multipart(result.size):
+                    # resumes from the last confirmed part on every attempt
+                    result.response = get_multipart_uploader(self.policy).upload(
+                        item.identifier,
+                        result.key,
+                        result.path,
+                        metadata=metadata,
+                        queue_derive=queue_derive,
+                    )
+                    if delete:
+                        os.remove(result.path)
+                elif get_bandwidth_limiter().limits_egress:
+                    result.response = self._upload_throttled(
+                        item, result, metadata, queue_derive, delete
+                    )
+                else:
+                    result.response = item.upload_file(
+                        result.path,
+                        key=result.key,
+                        metadata=metadata,
+                        queue_derive=queue_derive,
+                        delete=delete,
+                        retries=0,
+                        request_kwargs=dict(timeout=UPLOAD_TIMEOUT),
+                    )
+                result.error = None
+            except (HTTPError, RequestException, OSError, MultipartError) as error:
+                result.response = getattr(error, "response", None)
+                result.error = error
+            result.elapsed = time.monotonic() - start
+
+            if result.ok:
+                self.policy.record_success()
+                print(
+                    f"Uploaded {result.key} ({result.size / 1024 / 1024:.1f} MB) in {result.elapsed:.1f}s, {result.speed:.2f} MB/s"
+                )
+                logging.info(
+                    f"IA: {item.identifier}/{result.key} {result.size} bytes in {result.elapsed:.1f}s ({result.speed:.2f} MB/s, {result.attempts} attempts)"
+                )
+                return result
+            error = result.error or HTTPError(response=result.response)
+            if not self.policy.should_retry(result.attempts, error):
+                print(f"Upload of {result.key} failed for good: {error}")
+                logging.critical(
+                    f"IA: {item.identifier}/{result.key} failed after {result.attempts} attempts - {error}"
+                )
+                return result
+            delay = self.policy.delay(result.attempts, error)
+            print(f"Upload of {result.key} failed ({error}), retrying in {delay:.0f}s")
+            logging.warning(f"IA: {item.identifier}/{result.key} failed - {error}")
+            time.sleep(delay)
+
+    def upload_directory(self, identifier, directory, metadata, delete=False, sync=False):
+        """
+        Uploads every file under `directory` (keys relative to it, like
+        item.upload does). Returns a list of FileUploadResult.
+        With sync, files the item already has with the same md5 are skipped.
+        """
+
+        directory = Path(directory)
+        results = [
+            FileUploadResult(path.relative_to(directory).as_posix(), str(path), path.stat().st_size)
+            for path in sorted(directory.rglob("*"))
+            if path.is_file()
+        ]
+        if not results:
+            return results
+        hashes = hash_files_in_background(r.path for r in results) if sync else {}
+        item = internetarchive.get_item(identifier)
+        results.sort(key=lambda result: result.size)
+        largest = results[-1]
+        if sync:
+            remote = {f["name"]: f.get("md5") for f in item.files}
+            for result in results:
+                if remote.get(result.key) == hashes[result.path].result():
+                    result.skipped = True
+            skipped = sum(result.skipped for result in results)
+            print(f"{identifier}: {skipped} of {len(results)} files already there, identical")
+            logging.info(f"IA: {identifier} sync skipped {skipped}/{len(results)} files")
+            results_to_send = [result for result in results if not result.skipped]
+        else:
+            results_to_send = results
+        if not results_to_send:
+            return results
+
+        def submit(result, md):
+            # only derive once, after the video
+            return self._executor.submit(
+                self._upload_file, item, result, md, result is largest, delete
+            )
+
+        first = results_to_send[0]
+        submit(first, header_metadata(metadata)).result()
+        if not first.ok:
+            return results
+        futures = [submit(result, None) for result in results_to_send[1:]]
+        for future in futures:
+            future.result()
+
+        sent = [result for result in results_to_send if result.ok]
+        total = sum(result.size for result in sent)
+        print(
+            f"{identifier}: uploaded {len(sent)}/{len(results_to_send)} files, {total / 1024 / 1024:.1f} MB"
+        )
+        return results
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_settings = {"max_workers": 4, "max_attempts": 5}
+
+
+def configure_uploads(max_workers=4, max_attempts=5):
+    _settings["max_workers"] = max(1, max_workers)
+    _settings["max_attempts"] = max(1, max_attempts)
+
+
+def get_upload_pool() -> UploadPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = UploadPool(
+                max_workers=_settings["max_workers"],
+                policy=RetryPolicy(max_attempts=_settings["max_attempts"]),
+            )
+        return _pool
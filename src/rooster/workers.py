@@ -0,0 +1,150 @@
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class WorkerOutput:
+    """
+    Line buffered stdout proxy used while the worker pool is running.
+    Every complete line is tagged with the name of the thread that printed it
+    and written under a lock, so output from parallel episodes doesn't get
+    interleaved mid-line. Progress bars that redraw their line with \r
+    (yt-dlp's) get their latest state printed as a line of its own every
+    `progress_interval` seconds.
+    """
+
+    def __init__(self, stream, progress_interval=5.0):
+        self._stream = stream
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def write(self, text):
+        buffered = getattr(self._local, "buffer", "") + text
+        *lines, rest = buffered.split("\n")
+        # of a redrawn line only the last drawing is worth printing
+        lines = [line.rstrip("\r").rsplit("\r", 1)[-1] for line in lines]
+        if "\r" in rest:
+            progress = rest.rstrip("\r").rsplit("\r", 1)[-1]
+            rest = "\r" + progress
+            now = time.monotonic()
+            last = getattr(self._local, "progress_at", 0.0)
+            if progress and now - last >= self.progress_interval:
+                self._local.progress_at = now
+                lines.append(progress)
+        self._local.buffer = rest
+        if lines:
+            name = threading.current_thread().name
+            with self._lock:
+                for line in lines:
+                    self._stream.write(f"[{name}] {line}\n")
+                self._stream.flush()
+        return len(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class SlugRegistry:
+    """
+    Thread safe wrapper around the set of already downloaded slugs.
+    Workers check and record slugs through this instead of touching
+    `total_slugs` directly.
+    """
+
+    def __init__(self, slugs):
+        self._slugs = slugs
+        self._lock = threading.Lock()
+
+    def __contains__(self, slug):
+        with self._lock:
+            return slug in self._slugs
+
+    def __len__(self):
+        with self._lock:
+            return len(self._slugs)
+
+    def add(self, slug):
+        with self._lock:
+            self._slugs.add(slug)
+
+
+def get_slug_from_link(link):
+    return link.strip().rstrip("/").split("/")[-1]
+
+
+def unique_links(links):
+    """Drops links pointing to a slug that was already seen, keeps order."""
+    seen = set()
+    for link in links:
+        slug = get_slug_from_link(link)
+        if slug in seen:
+            print(f"Skipping duplicate link in input: {link.strip()}")
+            continue
+        seen.add(slug)
+        yield link.strip()
+
+
+def print_summary(results, elapsed=None, source=None):
+    counts = Counter(results.values())
+    print()
+    print(f"Processed {len(results)} links.")
+    for status, count in sorted(counts.items()):
+        print(f"  {status}: {count}")
+    if elapsed is not None:
+        print(f"Finished in {elapsed:.1f}s")
+    failed = [link for link, status in results.items() if status == "failed"]
+    if failed:
+        suffix = f" | Input: {source}" if source else ""
+        logging.warning(f"{len(failed)} links failed in this run: {failed}{suffix}")
+
+
+def run_episode_pool(links, jobs, handler):
+    """
+    Runs `handler(index, link)` for every link on a pool of `jobs` threads.
+    At most `jobs * 2` links are queued at a time so a very long (or lazily
+    produced) list of links isn't materialized into futures all at once.
+    Returns a dict of link -> status string returned by the handler.
+    """
+
+    results = {}
+    if jobs <= 1:
+        for index, link in enumerate(links, start=1):
+            results[link] = _run_handler(handler, index, link)
+        return results
+
+    original_stdout = sys.stdout
+    sys.stdout = WorkerOutput(original_stdout)
+    try:
+        with ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="worker"
+        ) as executor:
+            pending = {}
+            for index, link in enumerate(links, start=1):
+                if len(pending) >= jobs * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[pending.pop(future)] = future.result()
+                future = executor.submit(_run_handler, handler, index, link)
+                pending[future] = link
+            for future in pending:
+                results[pending[future]] = future.result()
+    finally:
+        sys.stdout = original_stdout
+    return results
+
+
+def _run_handler(handler, index, link):
+    try:
+        status = handler(index, link)
+    except Exception as e:
+        print(f"{e} Error occurred while processing link {index}: {link}")
+        logging.critical(f"{e} - Error occurred while processing link {index}: {link}")
+        return "failed"
+    return status or "done"
@@ -0,0 +1,70 @@
+import json
+import importlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.adapters import HTTPAdapter
+
+from rooster.client import HttpClient
+from rooster.crawler import make_episode_record
+
+# the package attribute rooster.downloader is the downloader() function
+downloader = importlib.import_module("rooster.downloader")
+
+
+def episode(episode_type):
+    return {
+        "id": 1234,
+        "uuid": "0f1e2d3c",
+        "type": episode_type,
+        "attributes": {
+            "slug": "some-episode",
+            "title": "Some Episode",
+            "show_id": "5e9dc88c-ab95-402b-9ce6-d12b1747ef74",
+            "channel_id": "b0252a94-e97d-4784-9fc0-03b97be9df38",
+            "season_number": 1,
+            "number": 2,
+            "original_air_date": "2015-03-01T12:00:00.000Z",
+        },
+        "canonical_links": {"self": "/watch/some-episode"},
+    }
+
+
+@pytest.fixture
+def rt_api(monkeypatch):
+    """Serves `served["episode"]` as the watch api answer."""
+    served = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = json.dumps({"data": [served["episode"]]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = HttpClient()
+    client.session.mount("http://", HTTPAdapter())
+    monkeypatch.setattr(downloader, "get_http_client", lambda: client)
+    served["url"] = f"http://127.0.0.1:{server.server_port}/api/v1/watch/some-episode"
+    yield served
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("episode_type", ["episode", "bonus_feature"])
+def test_archive_id_is_the_uploaded_item_name(rt_api, episode_type):
+    rt_api["episode"] = episode(episode_type)
+
+    data = downloader.get_episode_data_from_rt_api(rt_api["url"])
+
+    assert make_episode_record(rt_api["episode"])["archive_id"] == downloader.get_itemname(data)
@@ -0,0 +1,193 @@
+import asyncio
+
+import pytest
+
+from rooster import hls
+from rooster.hls import AsyncHttpPool, UnsupportedPlaylist, parse_media_playlist
+
+
+async def serve(responses, connections):
+    """
+    Raw HTTP/1.1 server answering each path with the canned bytes in
+    `responses`, the connection is closed after "/close" paths.
+    Every accepted connection is appended to `connections`.
+    """
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()).strip():
+                    pass
+                path = request_line.split()[1].decode()
+                writer.write(responses[path])
+                await writer.drain()
+                if path.startswith("/close"):
+                    break
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+def fetch_all(responses, paths):
+    """GETs `paths` one after another, returns the responses, pool and server connections."""
+
+    async def run():
+        connections = []
+        server, base = await serve(responses, connections)
+        pool = AsyncHttpPool(limit=4, timeout=(5, 5))
+        try:
+            results = [await pool.get(base + path) for path in paths]
+        finally:
+            await pool.close()
+            server.close()
+        return results, pool, connections
+
+    return asyncio.run(run())
+
+
+def test_chunked_body_with_extensions_and_trailers():
+    responses = {
+        "/chunked": (
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"5;name=value\r\nhello\r\n"
+            b"7\r\n, world\r\n"
+            b"0\r\nX-Checksum: 1234\r\n\r\n"
+        ),
+        "/after": b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nnext",
+    }
+
+    results, pool, connections = fetch_all(responses, ["/chunked", "/after"])
+
+    (status, headers, body, _), (_, _, after, _) = results
+    assert status == 200 and body == b"hello, world"
+    # the trailers were read up to the end, the next response parses
+    assert after == b"next"
+    assert pool.connections_opened == 1 and len(connections) == 1
+
+
+def test_keep_alive_connections_are_reused():
+    responses = {
+        f"/fragment{i}": b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\n" + b"%03d" % i
+        for i in range(5)
+    }
+
+    results, pool, connections = fetch_all(responses, list(responses))
+
+    assert [body for _, _, body, _ in results] == [b"%03d" % i for i in range(5)]
+    assert pool.connections_opened == 1 and len(connections) == 1
+
+
+def test_closed_connections_are_not_reused():
+    responses = {
+        "/close-header": (
+            b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok"
+        ),
+        "/close-eof": b"HTTP/1.1 200 OK\r\n\r\nuntil the end",
+        "/last": b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nlast",
+    }
+
+    results, pool, _ = fetch_all(responses, ["/close-header", "/close-eof", "/last"])
+
+    assert [body for _, _, body, _ in results] == [b"ok", b"until the end", b"last"]
+    assert pool.connections_opened == 3
+
+
+def test_redirects_are_followed():
+    responses = {
+        "/old": b"HTTP/1.1 302 Found\r\nLocation: /new\r\nContent-Length: 0\r\n\r\n",
+        "/new": b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nnew",
+    }
+
+    (result,), pool, _ = fetch_all(responses, ["/old"])
+
+    status, _, body, url = result
+    assert (status, body) == (200, b"new") and url.endswith("/new")
+    assert pool.connections_opened == 1
+
+
+def test_byterange_playlist():
+    text = "\n".join(
+        [
+            "#EXTM3U",
+            "#EXT-X-VERSION:7",
+            '#EXT-X-MAP:URI="init.mp4",BYTERANGE="720@0"',
+            "#EXTINF:4.0,",
+            "#EXT-X-BYTERANGE:1000@720",
+            "media.mp4",
+            "#EXTINF:4.0,",
+            # no offset, it follows the previous range of the same file
+            "#EXT-X-BYTERANGE:500",
+            "media.mp4",
+            "#EXTINF:4.0,",
+            "#EXT-X-BYTERANGE:300",
+            "other.mp4",
+            "#EXT-X-ENDLIST",
+        ]
+    )
+
+    init, fragments = parse_media_playlist(text, "https://cdn.example/video/index.m3u8")
+
+    assert init.url == "https://cdn.example/video/init.mp4"
+    assert init.byterange == (720, 0)
+    assert init.headers() == {"Range": "bytes=0-719"}
+    assert [(f.url, f.byterange) for f in fragments] == [
+        ("https://cdn.example/video/media.mp4", (1000, 720)),
+        ("https://cdn.example/video/media.mp4", (500, 1720)),
+        ("https://cdn.example/video/other.mp4", (300, 0)),
+    ]
+    assert fragments[1].headers() == {"Range": "bytes=1720-2219"}
+
+
+def test_plain_playlist_with_init_section():
+    text = "\n".join(
+        [
+            "#EXTM3U",
+            '#EXT-X-MAP:URI="https://other.example/init.mp4"',
+            "#EXTINF:4.0,",
+            "segment0.m4s",
+            "#EXTINF:4.0,",
+            "segment1.m4s?token=abc",
+            "#EXT-X-ENDLIST",
+        ]
+    )
+
+    init, fragments = parse_media_playlist(text, "https://cdn.example/video/index.m3u8")
+
+    assert (init.url, init.byterange) == ("https://other.example/init.mp4", None)
+    assert [f.url for f in fragments] == [
+        "https://cdn.example/video/segment0.m4s",
+        "https://cdn.example/video/segment1.m4s?token=abc",
+    ]
+    assert [f.index for f in fragments] == [0, 1] and init.index == -1
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [
+        ['#EXT-X-STREAM-INF:BANDWIDTH=1000', "low.m3u8"],
+        ['#EXT-X-KEY:METHOD=AES-128,URI="key"', "#EXTINF:4.0,", "a.ts", "#EXT-X-ENDLIST"],
+        ["#EXTINF:4.0,", "a.ts"],
+        ['#EXT-X-MAP:URI="a.mp4"', '#EXT-X-MAP:URI="b.mp4"', "#EXTINF:4.0,", "a.ts", "#EXT-X-ENDLIST"],
+    ],
+)
+def test_unsupported_playlists(lines):
+    with pytest.raises(UnsupportedPlaylist):
+        parse_media_playlist("\n".join(["#EXTM3U", *lines]), "https://cdn.example/index.m3u8")
+
+
+def test_connections_are_split_between_jobs(monkeypatch):
+    monkeypatch.setattr(hls, "_settings", dict(hls._settings))
+    monkeypatch.setattr(hls, "_downloader", None)
+
+    hls.configure_hls(enabled=True, connections=32, download_jobs=4)
+    assert hls.get_hls_downloader().connections == 8
+
+    monkeypatch.setattr(hls, "_downloader", None)
+    hls.configure_hls(enabled=True, connections=2, download_jobs=4)
+    assert hls.get_hls_downloader().connections == 1
@@ -0,0 +1,131 @@
+import re
+import json
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rooster import iaexists
+from rooster.iaexists import IAExistenceCache
+from rooster.state import StateStore
+
+
+class SearchStub:
+    """advancedsearch over `items` ({identifier: originalurl}), remembers the queries."""
+
+    def __init__(self, items):
+        self.items = items
+        self.queries = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)["q"][0]
+                stub.queries.append(query)
+                field, terms = re.match(r"(\w+):\((.*)\)", query).groups()
+                values = set(re.findall(r'"([^"]+)"', terms))
+                docs = [
+                    {"identifier": identifier, "originalurl": url}
+                    for identifier, url in stub.items.items()
+                    if (identifier if field == "identifier" else url) in values
+                ]
+                body = json.dumps(
+                    {"response": {"numFound": len(docs), "docs": docs}}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/advancedsearch.php"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def search(monkeypatch):
+    stub = SearchStub(
+        {
+            "roosterteeth-1": "https://roosterteeth.com/watch/first-episode",
+            "roosterteeth-2": "https://roosterteeth.com/watch/second-episode",
+        }
+    )
+    monkeypatch.setattr(iaexists, "SEARCH_URL", stub.url)
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = StateStore(tmp_path / "state.db")
+    monkeypatch.setattr(iaexists, "get_state_store", lambda: store)
+    return store
+
+
+def test_links_without_known_ids_are_found_by_their_page_url(search, store):
+    cache = IAExistenceCache()
+    links = [
+        "https://roosterteeth.com/watch/first-episode",
+        "https://roosterteeth.com/watch/new-episode",
+    ]
+
+    assert list(cache.prefetch_links(links)) == links
+
+    assert len(search.queries) == 1 and search.queries[0].startswith("originalurl:")
+    assert cache.exists("roosterteeth-1")
+    assert len(search.queries) == 1
+
+
+def test_links_with_known_ids_are_found_by_identifier(search, store):
+    store.mark_resolved("second-episode", 2)
+    store.mark_resolved("gone-episode", 3)
+    cache = IAExistenceCache()
+
+    links = [
+        "https://roosterteeth.com/watch/second-episode",
+        "https://roosterteeth.com/watch/gone-episode",
+    ]
+
+    list(cache.prefetch_links(links))
+
+    assert [query.split(":")[0] for query in search.queries] == ["identifier"]
+    assert cache.exists("roosterteeth-2")
+    assert not cache.exists("roosterteeth-3")
+    assert len(search.queries) == 1
+
+
+def test_concurrent_lookups_share_one_search(search):
+    cache = IAExistenceCache()
+    identifiers = ["roosterteeth-1", "roosterteeth-2", "roosterteeth-4", "roosterteeth-5"]
+    answers = {}
+
+    def look_up(identifier):
+        answers[identifier] = cache.exists(identifier)
+
+    threads = [threading.Thread(target=look_up, args=(i,)) for i in identifiers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert answers == {
+        "roosterteeth-1": True,
+        "roosterteeth-2": True,
+        "roosterteeth-4": False,
+        "roosterteeth-5": False,
+    }
+    assert len(search.queries) == 1
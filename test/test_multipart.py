@@ -0,0 +1,243 @@
+import os
+import time
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree
+
+import pytest
+import requests
+
+from rooster.multipart import MultipartUploader
+from rooster.state import StateStore
+
+PART_SIZE = 1024
+
+
+class S3Stub:
+    """
+    Just enough of the S3 multipart API for MultipartUploader: initiate,
+    upload part, complete and abort. Parts listed in `fail_parts` answer
+    500, `delay` slows every part down.
+    """
+
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+        self.requests = []
+        self.fail_parts = set()
+        self.delay = 0.0
+        self.in_flight = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _answer(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _parse(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("content-length") or 0)
+                body = self.rfile.read(length)
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                if url.query == "uploads":
+                    query["uploads"] = ""
+                return url.path.lstrip("/"), query, body
+
+            def do_POST(self):
+                key, query, body = self._parse()
+                with stub._lock:
+                    if "uploads" in query:
+                        stub._next_id += 1
+                        upload_id = f"upload-{stub._next_id}"
+                        stub.uploads[upload_id] = {}
+                        stub.requests.append(("initiate", key, upload_id))
+                        return self._answer(
+                            200,
+                            f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>".encode(),
+                        )
+                    upload_id = query["uploadId"]
+                    parts = stub.uploads.pop(upload_id, None)
+                    stub.requests.append(("complete", key, upload_id))
+                    if parts is None:
+                        return self._answer(404, b"<Error><Code>NoSuchUpload</Code></Error>")
+                    root = ElementTree.fromstring(body)
+                    numbers = [int(e.text) for e in root.iter("PartNumber")]
+                    etags = [e.text.strip('"') for e in root.iter("ETag")]
+                    for number, etag in zip(numbers, etags):
+                        assert hashlib.md5(parts[number]).hexdigest() == etag
+                    stub.objects[key] = b"".join(parts[number] for number in numbers)
+                    return self._answer(200, b"<CompleteMultipartUploadResult/>")
+
+            def do_PUT(self):
+                key, query, body = self._parse()
+                number = int(query["partNumber"])
+                with stub._lock:
+                    stub.in_flight += 1
+                    stub.requests.append(("part", key, query["uploadId"], number))
+                try:
+                    time.sleep(stub.delay)
+                    with stub._lock:
+                        parts = stub.uploads.get(query["uploadId"])
+                        if parts is None:
+                            return self._answer(
+                                404, b"<Error><Code>NoSuchUpload</Code></Error>"
+                            )
+                        if number in stub.fail_parts:
+                            return self._answer(500, b"<Error><Code>InternalError</Code></Error>")
+                        parts[number] = body
+                    etag = hashlib.md5(body).hexdigest()
+                    return self._answer(200, headers={"ETag": f'"{etag}"'})
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def do_DELETE(self):
+                key, query, _ = self._parse()
+                with stub._lock:
+                    stub.uploads.pop(query["uploadId"], None)
+                    stub.requests.append(("abort", key, query["uploadId"]))
+                return self._answer(204)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def parts_sent(self, upload_id=None):
+        return sorted(
+            request[3]
+            for request in self.requests
+            if request[0] == "part" and upload_id in (None, request[2])
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub():
+    with S3Stub() as stub:
+        yield stub
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StateStore(tmp_path / "state.db")
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(os.urandom(PART_SIZE * 4 + 100))
+    return path
+
+
+def make_uploader(stub, store, max_workers=1):
+    return MultipartUploader(
+        endpoint=stub.endpoint,
+        access_key="access",
+        secret_key="secret",
+        part_size=PART_SIZE,
+        max_workers=max_workers,
+        store=store,
+    )
+
+
+def test_upload_sends_every_part_and_completes(stub, store, video):
+    uploader = make_uploader(stub, store, max_workers=3)
+
+    uploader.upload("item", "video.mp4", video)
+
+    assert stub.objects["item/video.mp4"] == video.read_bytes()
+    assert stub.parts_sent() == [1, 2, 3, 4, 5]
+    assert store.get_multipart("item", "video.mp4") is None
+
+
+def test_interrupted_upload_resumes_from_saved_etags(stub, store, video):
+    uploader = make_uploader(stub, store)
+    stub.fail_parts = {3}
+
+    with pytest.raises(requests.HTTPError):
+        uploader.upload("item", "video.mp4", video)
+
+    upload_id = store.get_multipart("item", "video.mp4")[0]
+    saved = store.multipart_parts(upload_id)
+    # the worker may pick up part 4 before the failure cancels the rest
+    assert {1, 2} <= set(saved) and 3 not in saved
+    assert saved[1] == hashlib.md5(video.read_bytes()[:PART_SIZE]).hexdigest()
+
+    stub.fail_parts = set()
+    sent_before = len(stub.requests)
+    uploader.upload("item", "video.mp4", video)
+
+    resumed = [request for request in stub.requests[sent_before:] if request[0] == "part"]
+    assert sorted(request[3] for request in resumed) == sorted({1, 2, 3, 4, 5} - set(saved))
+    assert all(request[2] == upload_id for request in resumed)
+    assert stub.objects["item/video.mp4"] == video.read_bytes()
+    assert store.multipart_parts(upload_id) == {}
+
+
+def test_failed_part_waits_for_the_parts_in_flight(stub, store, video):
+    uploader = make_uploader(stub, store, max_workers=3)
+    stub.fail_parts = {1}
+    stub.delay = 0.2
+
+    with pytest.raises(requests.HTTPError):
+        uploader.upload("item", "video.mp4", video)
+
+    # nothing of the failed attempt may still be sending when it raises
+    assert stub.in_flight == 0
+
+
+def test_changed_file_aborts_the_old_upload(stub, store, video):
+    uploader = make_uploader(stub, store)
+    stub.fail_parts = {2}
+    with pytest.raises(requests.HTTPError):
+        uploader.upload("item", "video.mp4", video)
+    old_id = store.get_multipart("item", "video.mp4")[0]
+
+    stub.fail_parts = set()
+    video.write_bytes(os.urandom(PART_SIZE * 2))
+    uploader.upload("item", "video.mp4", video)
+
+    assert ("abort", "item/video.mp4", old_id) in stub.requests
+    assert old_id not in stub.uploads
+    assert stub.objects["item/video.mp4"] == video.read_bytes()
+
+
+def test_upload_gone_from_server_starts_over(stub, store, video):
+    uploader = make_uploader(stub, store)
+    stub.fail_parts = {2}
+    with pytest.raises(requests.HTTPError):
+        uploader.upload("item", "video.mp4", video)
+    old_id = store.get_multipart("item", "video.mp4")[0]
+
+    # expired on the server
+    stub.uploads.clear()
+    stub.fail_parts = set()
+    uploader.upload("item", "video.mp4", video)
+
+    upload_ids = {request[2] for request in stub.requests if request[0] == "initiate"}
+    assert len(upload_ids) == 2 and old_id in upload_ids
+    assert stub.objects["item/video.mp4"] == video.read_bytes()
@@ -0,0 +1,62 @@
+import time
+import threading
+
+import pytest
+
+from rooster.plan import LinkPlanner, iter_batches
+from rooster.state import StateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StateStore(tmp_path / "state.db")
+
+
+def test_batches_go_out_when_the_source_pauses():
+    next_season = threading.Event()
+
+    def series():
+        yield from ["a1", "a2", "a3"]
+        # the next season is only listed once the first one was handed out
+        next_season.wait(5)
+        yield from ["b1", "b2"]
+
+    batches = iter_batches(series(), 500, flush_after=0.1)
+    assert next(batches) == ["a1"]
+    assert next(batches) == ["a2", "a3"]
+    next_season.set()
+    assert list(batches) == [["b1", "b2"]]
+
+
+def test_lists_are_sliced():
+    assert list(iter_batches([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
+
+
+def test_errors_of_the_source_are_raised():
+    def series():
+        yield "a1"
+        raise RuntimeError("season failed")
+
+    with pytest.raises(RuntimeError):
+        list(iter_batches(series(), 500))
+
+
+def test_planner_streams_and_drops_done_links(store):
+    store.set_status("done-episode", "downloaded", episode_id=1)
+    listed = threading.Event()
+
+    def series():
+        yield "https://roosterteeth.com/watch/done-episode"
+        yield "https://roosterteeth.com/watch/new-episode/"
+        listed.wait(5)
+        yield "https://roosterteeth.com/watch/new-episode"
+
+    planner = LinkPlanner(fast_check=True, store=store)
+    links = planner.filter(series())
+    start = time.monotonic()
+    assert next(links) == "https://roosterteeth.com/watch/new-episode"
+    # handed out before the rest of the series was listed
+    assert time.monotonic() - start < 5
+    listed.set()
+    assert list(links) == []
+    assert planner.counts == {"done": 1, "retry": 0, "unknown": 1, "duplicate": 1}
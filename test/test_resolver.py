@@ -0,0 +1,103 @@
+import importlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from rooster import resolver
+from rooster.client import HttpClient
+from rooster.resolver import get_breaker, resolve_first
+
+# the package attribute rooster.downloader is the downloader() function
+downloader = importlib.import_module("rooster.downloader")
+
+
+class ApiStub:
+    """Answers every GET with `status` and counts the requests."""
+
+    def __init__(self, status):
+        self.status = status
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.requests += 1
+                body = b'{"data": []}'
+                self.send_response(stub.status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/api/v1/watch/some-episode"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    monkeypatch.setattr(resolver, "_breakers", {})
+    # no urllib3 retries with backoff, every lookup is one request
+    client = HttpClient()
+    client.session.mount("http://", HTTPAdapter())
+    monkeypatch.setattr(downloader, "get_http_client", lambda: client)
+
+
+@pytest.fixture
+def api(request):
+    stub = ApiStub(request.param)
+    yield stub
+    stub.close()
+
+
+def rt_api_source(url):
+    return ("rt-api", lambda: (downloader.get_episode_data_from_rt_api(url), None))
+
+
+@pytest.mark.parametrize("api", [503], indirect=True)
+def test_server_errors_open_the_breaker(api):
+    breaker = get_breaker("rt-api")
+    for _ in range(breaker.failure_threshold):
+        assert resolve_first([rt_api_source(api.url)]) == (None, None)
+
+    assert not breaker.allow()
+    # the open breaker keeps the source from being asked again
+    assert resolve_first([rt_api_source(api.url)]) == (None, None)
+    assert api.requests == breaker.failure_threshold
+
+
+@pytest.mark.parametrize("api", [404], indirect=True)
+def test_unknown_episodes_keep_the_breaker_closed(api):
+    breaker = get_breaker("rt-api")
+    for _ in range(breaker.failure_threshold * 2):
+        assert resolve_first([rt_api_source(api.url)]) == (None, None)
+
+    assert breaker.allow()
+    assert api.requests == breaker.failure_threshold * 2
+
+
+def test_unreachable_source_opens_the_breaker():
+    breaker = get_breaker("workers-api")
+
+    def fetch():
+        raise requests.ConnectionError("connection refused")
+
+    for _ in range(breaker.failure_threshold):
+        resolve_first([("workers-api", fetch)])
+
+    assert not breaker.allow()
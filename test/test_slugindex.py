@@ -0,0 +1,51 @@
+import pytest
+
+from rooster.slugindex import BloomSlugIndex
+from rooster.state import StateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StateStore(tmp_path / "state.db")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "downloaded.bloom"
+
+
+def test_index_is_built_from_the_store(path, store):
+    store.set_status("first-episode", "downloaded", episode_id=1)
+    store.set_status("second-episode", "uploaded", episode_id=2)
+    store.set_status("failed-episode", "failed", error="download")
+
+    index = BloomSlugIndex(path, store=store, capacity=1000)
+
+    assert len(index) == 2
+    assert "first-episode" in index and "second-episode" in index
+    assert "failed-episode" not in index
+    assert "new-episode" not in index
+
+
+def test_episodes_done_by_another_process_are_found(path, store):
+    index = BloomSlugIndex(path, store=store, capacity=1000)
+    assert "some-episode" not in index
+
+    # another process finished it without touching this index
+    StateStore(store.path).set_status("some-episode", "downloaded", episode_id=1)
+
+    assert "some-episode" in index
+    assert len(index) == 1
+
+
+def test_file_rebuilt_by_another_process_is_followed(path, store):
+    index = BloomSlugIndex(path, store=store, capacity=1000)
+    other = BloomSlugIndex(path, store=StateStore(store.path), capacity=1000)
+
+    other.rebuild(capacity=5000)
+    other.store.set_status("some-episode", "downloaded", episode_id=1)
+    other.add("some-episode")
+
+    assert "some-episode" in index
+    assert index.capacity == 5000
+    assert "new-episode" not in index
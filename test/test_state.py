@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import multiprocessing
+
+import pytest
+
+from rooster.state import StateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StateStore(tmp_path / "state.db")
+
+
+def test_schema_is_created_in_wal_mode(tmp_path):
+    path = tmp_path / "logs" / "state.db"
+    StateStore(path)
+
+    conn = sqlite3.connect(str(path))
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {
+        "episodes",
+        "archive",
+        "imports",
+        "multipart_uploads",
+        "multipart_parts",
+        "fragment_tuning",
+    } <= tables
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    # opening it again leaves the existing schema and rows alone
+    StateStore(path).set_status("some-episode", "downloaded", episode_id=1)
+    assert StateStore(path).get_status("some-episode") == "downloaded"
+
+
+def test_set_status_keeps_done_over_failed(store):
+    store.set_status("some-episode", "downloaded", episode_id=1)
+    store.set_status("some-episode", "failed", error="upload")
+
+    assert store.get_status("some-episode") == "downloaded"
+    assert store.is_done("some-episode")
+    assert store.get_episode_id("some-episode") == "1"
+
+
+def test_set_status_moves_on_from_failed(store):
+    store.set_status("some-episode", "failed", error="download")
+    store.set_status("some-episode", "downloaded")
+
+    assert store.get_status("some-episode") == "downloaded"
+
+
+def test_set_status_rejects_unknown_status(store):
+    with pytest.raises(ValueError):
+        store.set_status("some-episode", "finished")
+
+
+def test_legacy_logs_are_imported_from_the_saved_offset(tmp_path, store):
+    downloaded = tmp_path / "downloaded.log"
+    archive = tmp_path / "archive.log"
+    downloaded.write_text("first-episode\nsecond-episode\nthird-epi")
+    archive.write_text("roosterteeth 1\n")
+
+    assert store.import_legacy_logs(tmp_path) == 3
+    assert store.is_done("first-episode") and store.is_done("second-episode")
+    # the half written line waits for the rest of it
+    assert store.get_status("third-epi") is None
+    assert store.archive_has_id(1)
+
+    # nothing new, nothing imported
+    assert store.import_legacy_logs(tmp_path) == 0
+
+    with open(downloaded, "a") as f:
+        f.write("sode\nfourth-episode\n")
+    store.set_status("first-episode", "uploaded")
+    assert store.import_legacy_logs(tmp_path) == 2
+    assert store.is_done("third-episode") and store.is_done("fourth-episode")
+    assert store.get_status("first-episode") == "uploaded"
+
+    # a new store on the same database remembers the offsets
+    assert StateStore(store.path).import_legacy_logs(tmp_path) == 0
+
+
+def test_legacy_log_replaced_by_a_shorter_one_is_read_again(tmp_path, store):
+    downloaded = tmp_path / "downloaded.log"
+    downloaded.write_text("first-episode\nsecond-episode\n")
+    store.import_legacy_logs(tmp_path)
+
+    downloaded.write_text("other-episode\n")
+    assert store.import_legacy_logs(tmp_path) == 1
+    assert store.is_done("other-episode")
+
+
+def _write_statuses(path, worker, count):
+    store = StateStore(path)
+    for number in range(count):
+        store.set_status(f"episode-{worker}-{number}", "downloaded", episode_id=number)
+        store.archive_add(f"roosterteeth {worker}-{number}")
+
+
+def test_concurrent_writers(store):
+    count = 50
+    # other processes and threads, each writing through its own connection
+    processes = [
+        multiprocessing.Process(target=_write_statuses, args=(store.path, worker, count))
+        for worker in range(3)
+    ]
+    threads = [
+        threading.Thread(target=_write_statuses, args=(store.path, worker, count))
+        for worker in range(3, 6)
+    ]
+    for worker in processes + threads:
+        worker.start()
+    for worker in processes + threads:
+        worker.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    assert len(list(store.iter_slugs())) == 6 * count
+    assert store.archive_size() == 6 * count